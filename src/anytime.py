@@ -0,0 +1,198 @@
+"""Anytime path planning, for a control loop that can only spend so long on
+each cycle. A ``Search`` finds a path quickly with a weighted A* search, whose
+path may be longer than the shortest one by up to the weight, and then keeps
+lowering the weight and repairing the search, which tightens the path towards
+the shortest one. The work is done in slices of a given time or number of
+expansions, and each slice carries on where the last one stopped. That
+includes the work done before the search can start: building the board's
+visibility graph, if it hasn't been built yet, a few pairs of nodes at a
+time, and then finding which of its nodes the start and the goal can see.
+
+See "ARA*: Anytime A* with Provable Bounds on Sub-Optimality" by Maxim
+Likhachev, Geoff Gordon and Sebastian Thrun, NIPS 2003."""
+
+import heapq
+import time
+from searching import SearchGraph, START, GOAL
+
+class Search(object):
+    """An anytime search for the shortest path from ``start`` to ``goal``
+    across a ``Board``. Each call to ``improve`` works on it for a while and
+    returns the best path found so far, whose length is at most ``bound``
+    times that of the shortest path. If a polygon is added to or removed from
+    the board, the next call starts the search over."""
+    
+    def __init__(self, board, start, goal, weight=2.5, step=.5):
+        """Creates a search from ``start`` to ``goal`` across ``board``, whose
+        visibility graph is calculated first if need be. The first path found
+        is at most ``weight`` times as long as the shortest, and the weight
+        is lowered by ``step`` each time a path that good has been found,
+        until it reaches 1."""
+        super(Search, self).__init__()
+        if weight < 1 or step <= 0:
+            raise Exception("The weight must be at least 1, and the step more "
+                            "than 0")
+        self.board = board
+        self.start = start
+        self.goal = goal
+        self.initial_weight = weight
+        self.step = step
+        self.path = None
+        self.bound = float("inf")
+        self.done = False
+        self.__revision = None
+        self.__links = None
+        self.__linking = None
+        self.__ready = False
+    
+    def __prepare(self, deadline, budget):
+        """Does the work needed before the search can start, until it is done,
+        or ``time.time()`` reaches ``deadline``, or ``budget`` steps have been
+        taken, if either is given. The steps are those of building the
+        board's visibility graph, and then of linking the goal and the start
+        to it. Returns the number of steps taken."""
+        board = self.board
+        steps = 0
+        while not self.__ready:
+            if deadline is not None and time.time() >= deadline: break
+            if budget is not None and steps >= budget: break
+            if not board.precalculated:
+                steps += board.build_visibility(
+                    deadline, None if budget is None else budget - steps)
+            else:
+                if self.__linking is None:
+                    self.__links = SearchGraph(board, self.start, self.goal)
+                    self.__linking = self.__links.linking(self.start)
+                if next(self.__linking, None) is None:
+                    self.__reset()
+                else:
+                    steps += 1
+        return steps
+    
+    def __reset(self):
+        """Starts the search over, once the start and the goal are linked to
+        the board as it is now."""
+        self.__ready = True
+        self.weight = self.initial_weight
+        self.__proven = float("inf") # the weight of the last finished pass
+        self.__g = {START:0.}
+        self.__parent = {}
+        self.__open = {} # id -> its key in the queue
+        self.__queue = []
+        self.__closed = set()
+        self.__incons = set() # ids made cheaper after they were closed
+        self.__push(START)
+    
+    def improve(self, seconds=None, expansions=None):
+        """Works on the search until it has found the shortest path, or until
+        ``seconds`` have passed or ``expansions`` nodes have been expanded,
+        if either is given. Until the search can start, each step of the work
+        to get it ready counts as an expansion, and the time it takes counts
+        too, so a call runs over ``seconds`` by at most one step. Returns the
+        best path found so far, in the same form that
+        ``Board.get_shortest_path`` returns it, or None if none has been found
+        yet. Afterwards, ``bound`` holds how many times longer
+        than the shortest path it could be, which is infinite until a path is
+        found, and ``done`` is True once the path is the shortest, or there is
+        known to be no path."""
+        deadline = None if seconds is None else time.time() + seconds
+        if self.start == self.goal:
+            self.path, self.bound, self.done = [self.start], 1., True
+            return self.path
+        if self.board.revision != self.__revision:
+            self.__revision = self.board.revision
+            self.__links = self.__linking = None
+            self.__ready = False
+            self.path, self.bound, self.done = None, float("inf"), False
+        steps = self.__prepare(deadline, expansions)
+        expanded = 0
+        while self.__ready and not self.done:
+            if deadline is not None and time.time() >= deadline: break
+            if expansions is not None and steps + expanded >= expansions: break
+            if self.__expand_next():
+                expanded += 1
+            elif not self.__finish_pass():
+                break
+        stats = self.board.stats
+        if stats is not None:
+            stats.count("anytime_setup_steps", steps)
+            stats.count("anytime_expanded", expanded)
+        if self.__ready:
+            self.__publish()
+        return self.path
+    
+    def __expand_next(self):
+        """Expands the best node in the queue, unless the goal is no dearer
+        than it, or the queue is empty. Returns True if a node was
+        expanded."""
+        queue, g, links = self.__queue, self.__g, self.__links
+        goal_cost = g.get(GOAL, float("inf"))
+        while queue:
+            key, u = queue[0]
+            if self.__open.get(u) != key:
+                heapq.heappop(queue) # stale
+                continue
+            if goal_cost <= key:
+                return False
+            heapq.heappop(queue)
+            del self.__open[u]
+            self.__closed.add(u)
+            for v in links.successors(u):
+                cost = g[u] + links.cost(u, v)
+                if cost < g.get(v, float("inf")):
+                    g[v] = cost
+                    self.__parent[v] = u
+                    if v in self.__closed:
+                        self.__incons.add(v)
+                    else:
+                        self.__push(v)
+            return True
+        return False
+    
+    def __finish_pass(self):
+        """Ends a pass of the search, whose path is now within ``weight`` of
+        the shortest, and starts the next with a lower weight. Returns False
+        if there is nothing left to do."""
+        self.__proven = self.weight
+        if self.weight <= 1 or GOAL not in self.__g:
+            self.done = True
+            return False
+        self.weight = max(1., self.weight - self.step)
+        ids = set(self.__open) | self.__incons
+        self.__open, self.__queue = {}, []
+        self.__incons, self.__closed = set(), set()
+        for u in ids:
+            self.__push(u)
+        return True
+    
+    def __publish(self):
+        """Sets ``path`` and ``bound`` from the state of the search."""
+        g = self.__g
+        if GOAL not in g:
+            if self.done:
+                self.bound = 1. # there is no path at all
+            return
+        # every shortest path runs through a node in the queue or in incons
+        # whose cost is already right, which bounds the shortest length
+        lower = min([g[u] + self.__links.cost(u, GOAL)
+                     for u in list(self.__open) + list(self.__incons)] or
+                    [g[GOAL]])
+        if self.done:
+            self.bound = 1.
+        else:
+            self.bound = max(1., min(self.__proven, g[GOAL] / lower
+                                     if lower > 0 else float("inf")))
+        path = []
+        u = GOAL
+        while u != START:
+            path.append(self.__links.get_node(u))
+            u = self.__parent[u]
+        path.reverse()
+        if len(path) > 1 and path[-2] == self.goal:
+            del path[-2] # the goal is also a node of the board
+        self.path = path
+    
+    def __push(self, u):
+        key = self.__g[u] + self.weight * self.__links.cost(u, GOAL)
+        self.__open[u] = key
+        heapq.heappush(self.__queue, (key, u))
@@ -0,0 +1,255 @@
+"""A benchmark harness for the pathfinding package. Boards of a few kinds are
+generated at increasing sizes, and the main operations are timed on each:
+building polygons, building the visibility graph, visibility tests, finding
+the visible set of a point, finding shortest paths, and expanding the board.
+
+Every board and query is generated from a fixed seed, so the results of two
+runs can be compared directly. The results are written as JSON, one record per
+line, so they can be collected and plotted by other tools. Run
+``python benchmark.py --help`` for the options."""
+
+import gc
+import json
+import math
+import optparse
+import platform
+import random
+import sys
+import time
+import geometry
+import mapping
+import vectorized
+from node import Node
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+def generate_random(vertices, seed):
+    """Generates randomly shaped, star-like polygons, scattered over a grid so
+    that no two of them overlap. Returns a list of polygons, each a list of
+    ``(x, y)`` points, with around ``vertices`` points in total."""
+    r = random.Random(seed)
+    side = max(1, int(math.ceil(math.sqrt(vertices / 5.5))))
+    polygons = []
+    for i in xrange(side):
+        for k in xrange(side):
+            cx, cy = i + .5 + r.uniform(-.1, .1), k + .5 + r.uniform(-.1, .1)
+            count = r.randint(3, 8)
+            points = []
+            for n in xrange(count):
+                angle = 2 * math.pi * (n + r.uniform(0, .5)) / count
+                radius = r.uniform(.2, .35)
+                points.append((round(cx + radius * math.cos(angle), 6),
+                               round(cy + radius * math.sin(angle), 6)))
+            polygons.append(points)
+    return polygons
+
+def generate_maze(vertices, seed):
+    """Generates a maze of corridors, carved out of a grid by a randomized
+    depth-first search, where each remaining wall is a thin rectangle. Returns
+    a list of polygons, each a list of ``(x, y)`` points, with around
+    ``vertices`` points in total."""
+    r = random.Random(seed)
+    # a maze of side n has about n * n walls, each with 4 points
+    side = max(2, int(math.ceil(math.sqrt(vertices / 4.))))
+    visited = set([(0, 0)])
+    stack = [(0, 0)]
+    open_walls = set()
+    while stack:
+        x, y = stack[-1]
+        options = [(x + dx, y + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1),
+                                                   (0, -1))
+                   if 0 <= x + dx < side and 0 <= y + dy < side and
+                   (x + dx, y + dy) not in visited]
+        if not options:
+            stack.pop()
+            continue
+        cell = r.choice(options)
+        visited.add(cell)
+        open_walls.add(frozenset(((x, y), cell)))
+        stack.append(cell)
+    gap, width = .08, .04
+    polygons = []
+    for x in xrange(side):
+        for y in xrange(side):
+            # the wall on the right of, and the wall above, each cell
+            if x + 1 < side and \
+               frozenset(((x, y), (x + 1, y))) not in open_walls:
+                polygons.append([(x + 1 - width, y + gap),
+                                 (x + 1 + width, y + gap),
+                                 (x + 1 + width, y + 1 - gap),
+                                 (x + 1 - width, y + 1 - gap)])
+            if y + 1 < side and \
+               frozenset(((x, y), (x, y + 1))) not in open_walls:
+                polygons.append([(x + gap, y + 1 - width),
+                                 (x + 1 - gap, y + 1 - width),
+                                 (x + 1 - gap, y + 1 + width),
+                                 (x + gap, y + 1 + width)])
+    return polygons
+
+def generate_clutter(vertices, seed):
+    """Generates a dense clutter of small triangles and squares, each in its
+    own cell of a fine grid. Returns a list of polygons, each a list of
+    ``(x, y)`` points, with around ``vertices`` points in total."""
+    r = random.Random(seed)
+    side = max(1, int(math.ceil(math.sqrt(vertices / 3.5))))
+    polygons = []
+    for i in xrange(side):
+        for k in xrange(side):
+            cx, cy = i + r.uniform(.3, .7), k + r.uniform(.3, .7)
+            size = r.uniform(.1, .25)
+            count = r.choice((3, 4))
+            turn = r.uniform(0, 2 * math.pi)
+            polygons.append([(round(cx + size * math.cos(turn + 2 * math.pi *
+                                                         n / count), 6),
+                              round(cy + size * math.sin(turn + 2 * math.pi *
+                                                         n / count), 6))
+                             for n in xrange(count)])
+    return polygons
+
+generators = {"random":generate_random, "maze":generate_maze,
+              "clutter":generate_clutter}
+
+def free_points(board, count, seed):
+    """Returns ``count`` points scattered over ``board`` that aren't inside of
+    any of its polygons."""
+    r = random.Random(seed)
+    min_x = min([p.bounds[0] for p in board.polygons])
+    min_y = min([p.bounds[1] for p in board.polygons])
+    max_x = max([p.bounds[2] for p in board.polygons])
+    max_y = max([p.bounds[3] for p in board.polygons])
+    points = []
+    while len(points) < count:
+        point = Node(round(r.uniform(min_x, max_x), 6),
+                     round(r.uniform(min_y, max_y), 6))
+        if board.is_free(point):
+            points.append(point)
+    return points
+
+def peak_memory():
+    """Returns the peak memory use of this process so far in kilobytes, or
+    None if it isn't known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024 # reported in bytes rather than kilobytes
+    return peak
+
+def timed(function, repeat):
+    """Calls ``function`` ``repeat`` times, returning the fastest time, in
+    seconds, and the result of the last call."""
+    best, result = float("inf"), None
+    for i in xrange(repeat):
+        gc.collect()
+        start = time.time()
+        result = function()
+        best = min(best, time.time() - start)
+    return best, result
+
+def run(generator, vertices, engine, queries, repeat, seed):
+    """Benchmarks a board of around ``vertices`` points from ``generator`` with
+    the given visibility ``engine``. Yields a record for each operation."""
+    shapes = generators[generator](vertices, seed)
+    base = {"generator":generator, "scale":vertices, "engine":engine,
+            "polygons":len(shapes),
+            "vertices":sum([len(i) for i in shapes]),
+            "numpy":vectorized.available}
+
+    def record(operation, seconds, count, **extra):
+        result = dict(base)
+        result.update(operation=operation, seconds=seconds, count=count,
+                      per_op=seconds / max(count, 1),
+                      peak_rss_kb=peak_memory())
+        result.update(extra)
+        return result
+
+    seconds, polygons = timed(
+        lambda: [geometry.Polygon(*i) for i in shapes], repeat)
+    yield record("construct", seconds, len(shapes))
+
+    def build():
+        board = mapping.Board(engine)
+        for p in polygons:
+            board.add(p)
+        board.precalculate_visibility()
+        return board
+    seconds, board = timed(build, repeat)
+    g = board.graph
+    yield record("precalculate_visibility", seconds, 1,
+                 edges=g.edge_count(),
+                 graph_bytes=sum([len(i) * i.itemsize
+                                  for i in (g.coordinates, g.offsets,
+                                            g.targets)]))
+
+    r = random.Random(seed)
+    nodes = sorted(board.nodes, key=lambda i: (i.x, i.y))
+    pairs = [(r.choice(nodes), r.choice(nodes)) for i in xrange(queries * 10)]
+    seconds = timed(lambda: [board.is_visible(a, b) for a, b in pairs],
+                    repeat)[0]
+    yield record("is_visible", seconds, len(pairs))
+
+    points = free_points(board, 2 * queries, seed)
+    seconds = timed(lambda: [board.get_visible_set(i)
+                             for i in points[:queries]], repeat)[0]
+    yield record("get_visible_set", seconds, queries)
+
+    ends = zip(points[:queries], points[queries:])
+    seconds, paths = timed(lambda: [board.get_shortest_path(a, b)
+                                    for a, b in ends], repeat)
+    yield record("get_shortest_path", seconds, len(ends),
+                 found=len([i for i in paths if i is not None]))
+
+    for merge in (False, True):
+        def expand():
+            board = mapping.Board(engine)
+            for p in polygons:
+                board.add(p)
+            return board.get_expanded(-.01, merge)
+        try:
+            seconds, expanded = timed(expand, repeat)
+        except Exception, e:
+            yield record("get_expanded", None, 0, merge=merge, error=str(e))
+        else:
+            yield record("get_expanded", seconds, 1, merge=merge,
+                         expanded_polygons=len(expanded.polygons))
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]",
+                                   description=__doc__.split("\n\n")[0])
+    parser.add_option("-g", "--generators", default="random,maze,clutter",
+                      help="comma separated kinds of board [%default]")
+    parser.add_option("-s", "--scales", default="100,300,1000",
+                      help="comma separated numbers of vertices [%default]")
+    parser.add_option("-e", "--engines", default=",".join(mapping.Board.engines),
+                      help="comma separated visibility engines [%default]")
+    parser.add_option("-q", "--queries", type="int", default=20,
+                      help="number of queries of each kind [%default]")
+    parser.add_option("-r", "--repeat", type="int", default=3,
+                      help="times to repeat each measurement, keeping the "
+                           "fastest [%default]")
+    parser.add_option("--seed", type="int", default=1,
+                      help="seed for the boards and queries [%default]")
+    parser.add_option("-o", "--output", help="file to write to, rather than "
+                                             "standard output")
+    options = parser.parse_args(argv)[0]
+    out = open(options.output, "w") if options.output else sys.stdout
+    out.write(json.dumps({"python":platform.python_version(),
+                          "platform":platform.platform(),
+                          "numpy":vectorized.available,
+                          "seed":options.seed,
+                          "repeat":options.repeat}) + "\n")
+    for generator in options.generators.split(","):
+        for scale in [int(i) for i in options.scales.split(",")]:
+            for engine in options.engines.split(","):
+                for result in run(generator, scale, engine, options.queries,
+                                  options.repeat, options.seed):
+                    out.write(json.dumps(result, sort_keys=True) + "\n")
+                    out.flush()
+    if out is not sys.stdout:
+        out.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
 import node
 import math
+import skiplist
+
+# how far from zero a cross product can be and still count as zero, when
+# testing whether a point is on an edge
+EPSILON = 1e-7
+
+def get_epsilon():
+    """Returns ``EPSILON``, or 0 if nodes are on a fixed grid (see
+    ``node.set_resolution``), where the tests are exact."""
+    return EPSILON if node.Node.resolution is None else 0.
 
 class Line(object):
     """The name of this class can be misleading. It represents a line segment.
     Line objects are represented by two Node object"""
+    __slots__ = ("node_a", "node_b", "__midpoint", "__hash")
     
     def __init__(self, node_a=None, node_b=None, slope=None, distance=None):
         """Constructs a Line from ``node_a`` extending to ``node_b``. As a
@@ -27,8 +38,7 @@ class Line(object):
        	if node_b is None:
        	    node_b = self.__get_other_node(node_a, slope, distance)
         self.node_a, self.node_b = node_a, node_b
-        self.midpoint = node.Node((node_a.x + node_b.x)*.5,
-                                  (node_a.y + node_b.y)*.5)
+        self.__midpoint = self.__hash = None
     
     def __get_other_node(self, n, slope, distance):
         # alternatively...
@@ -38,6 +48,17 @@ class Line(object):
         return node.Node(n.x + distance * math.cos(ang),
                          n.y + distance * math.sin(ang))
     
+    def get_midpoint(self):
+        if self.__midpoint is None:
+            self.__midpoint = node.Node((self.node_a.x + self.node_b.x)*.5,
+                                        (self.node_a.y + self.node_b.y)*.5)
+        return self.__midpoint
+    
+    midpoint = property(get_midpoint,
+                        doc="""The node halfway between ``node_a`` and
+                        ``node_b``, which is only created when it is first
+                        asked for""")
+    
     def get_length(self):
         return self.node_a.dist(self.node_b)
     
@@ -105,7 +126,12 @@ class Line(object):
         return not self.__eq__(other)
     
     def __hash__(self):
-        return hash(self.node_a) ^ hash(self.node_b)
+        # the same whichever way round the line is, without the collisions of
+        # xor, which cancels out for lines with mirrored ends
+        if self.__hash is None:
+            a, b = hash(self.node_a), hash(self.node_b)
+            self.__hash = hash((a, b) if a < b else (b, a))
+        return self.__hash
 
 class BasePolygon(object):
     """This class and it's subclasses should be assumed to be immutable, for
@@ -135,17 +161,34 @@ class BasePolygon(object):
         self.lines = lines
         
         self.perimeter = sum([l.length for l in self.lines])
+        self.__bounds = None
+    
+    def get_bounds(self):
+        if self.__bounds is None:
+            xs = [i.x for i in self.nodes]
+            ys = [i.y for i in self.nodes]
+            self.__bounds = (min(xs), min(ys), max(xs), max(ys))
+        return self.__bounds
+    
+    bounds = property(get_bounds,
+                      doc="""The bounding box of the polygon, as a tuple of
+                      ``(min_x, min_y, max_x, max_y)``""")
     
     def contains_node_in_area(self, node):
         """Based on/ported from some code donated ad hoc (public domain) by
         asarkar of #xkcd-cs on irc.foonetic.net"""
+        eps = get_epsilon() # a value considered "close enough" to 0
+        # a point above, below, or to the right of the bounds is never inside,
+        # but one just to the left can still be found to be on an edge
+        min_x, min_y, max_x, max_y = self.bounds
+        if node.x > max_x or node.y < min_y - eps or node.y > max_y + eps:
+            return False
         result = False
         # because I'm too lazy of a porter to change all the variable names
         # within
         poly = list(self.nodes)
         poly.append(poly[0])
         p = node
-        eps = 1e-7 # a value considered "close enough" to 0
         for i in xrange(1, len(poly)):
             p1 = poly[i];
             p2 = poly[i - 1];
@@ -156,7 +199,7 @@ class BasePolygon(object):
             elif p == p2:
                 # the point is one of the vertices
                 return True
-            elif abs(p1.y - p.y) < eps and abs(p2.y - p.y) < eps:
+            elif abs(p1.y - p.y) <= eps and abs(p2.y - p.y) <= eps:
                 # the segment is horizontal
                 if p.x >= min(p1.x, p2.x) and p.x <= max(p1.x, p2.x):
                     # the point is on the segment
@@ -166,7 +209,7 @@ class BasePolygon(object):
                 # non-horizontal upward edges include start, exclude end;
                 # non-horizontal downward edges exclude start, include end
                 det = (p1.x - p.x) * (p2.y - p.y) - (p1.y - p.y) * (p2.x - p.x)
-                if abs(det) < eps:
+                if abs(det) <= eps:
                     # point is on the translated segment
                     return True
                 if p2.y < p1.y:
@@ -244,36 +287,176 @@ class Polygon(BasePolygon):
             pass
         else:
             copy.reverse()
-        result = []
-        while len(copy) >= 3:
-            t = Triangle(copy[0], copy[1], copy[2])
-            is_ear = t.is_ccw and \
-                     self.contains_node_in_area(Line(copy[0], copy[2]).midpoint)
-            
-            i = 3
-            while is_ear and i < len(copy):
-                if t.contains_node_in_area(copy[i]):
-                    print "ear: ", copy[:3], ", err: ", copy[i]
-                    is_ear = False
-                i += 1
-            
-            if is_ear:
-                # print "found ear: ", copy[:3]
-                result.append(t)
-                copy.pop(1)
-            else:
-                p = copy.pop(0)
-                copy.append(p)
-        self.triangles = result
+        # a triangulation can be given, as triples of indexes into the list of
+        # nodes, if it was already worked out (see ``storage``)
+        triangles = kwargs.get("triangles")
+        if triangles is None:
+            self.triangles = self.__triangulate(copy)
+        else:
+            self.triangles = [Triangle(*[self.nodes[i] for i in t])
+                              for t in triangles]
         self.triangle_lines = set()
         for t in self.triangles:
             self.triangle_lines.update(t.lines)
         self.triangle_lines.difference_update(self.lines)
-        e = Exception("Polygon is self-intersecting")
-        for i in self.lines:
-            for k in self.lines:
-                if i.does_intersect(k, False):
-                    raise e
+        if triangles is not None:
+            return # it was checked when the triangulation was worked out
+        if self.__is_self_intersecting():
+            raise Exception("Polygon is self-intersecting")
+    
+    def __triangulate(self, copy):
+        """Splits the polygon into triangles by ear clipping, where ``copy`` is
+        a list of the polygon's nodes. The nodes are kept in a doubly linked
+        ring, which is walked around, clipping each ear as it is found. Only a
+        reflex node can lie inside of an ear, so the reflex nodes are kept in a
+        grid, which is kept up to date as the ring shrinks, and only the ones
+        near a candidate are checked, rather than every node. The node that
+        last stopped a candidate from being an ear is remembered and checked
+        first, as it usually still does."""
+        n = len(copy)
+        # the ring must run counter-clockwise, whatever order it was given in
+        area = sum([copy[i - 1].x * copy[i].y - copy[i].x * copy[i - 1].y
+                    for i in xrange(n)])
+        if area < 0:
+            copy.reverse()
+        prev = [(i - 1) % n for i in xrange(n)]
+        next = [(i + 1) % n for i in xrange(n)]
+        blocker = [None] * n
+        min_x = min([i.x for i in copy])
+        min_y = min([i.y for i in copy])
+        size = max(max([i.x for i in copy]) - min_x,
+                   max([i.y for i in copy]) - min_y) / math.sqrt(n) or 1.
+        cells = {} # (column, row) -> the reflex nodes in that cell
+        reflex = set()
+        
+        def cell(x, y):
+            return int((x - min_x) / size), int((y - min_y) / size)
+        
+        def set_reflex(i, is_reflex):
+            if is_reflex == (i in reflex): return
+            c = cell(copy[i].x, copy[i].y)
+            if is_reflex:
+                reflex.add(i)
+                cells.setdefault(c, set()).add(i)
+            else:
+                reflex.discard(i)
+                cells[c].discard(i)
+        
+        def turn(i):
+            a, b, c = copy[prev[i]], copy[i], copy[next[i]]
+            return (b.x - a.x) * (c.y - a.y) - (b.y - a.y) * (c.x - a.x)
+        
+        def is_inside(k, i):
+            """Returns True if node ``k`` is inside of, or on the edge of, the
+            triangle with its corner at node ``i``, without being one of its
+            corners."""
+            a, b, c, p = copy[prev[i]], copy[i], copy[next[i]], copy[k]
+            return (b.x - a.x) * (p.y - a.y) >= (b.y - a.y) * (p.x - a.x) and \
+                   (c.x - b.x) * (p.y - b.y) >= (c.y - b.y) * (p.x - b.x) and \
+                   (a.x - c.x) * (p.y - c.y) >= (a.y - c.y) * (p.x - c.x) and \
+                   p != a and p != b and p != c
+        
+        def is_ear(i):
+            if turn(i) <= 0: return False
+            k = blocker[i]
+            if k in reflex and is_inside(k, i): return False
+            a, b, c = copy[prev[i]], copy[i], copy[next[i]]
+            col_lo, row_lo = cell(min(a.x, b.x, c.x), min(a.y, b.y, c.y))
+            col_hi, row_hi = cell(max(a.x, b.x, c.x), max(a.y, b.y, c.y))
+            for col in xrange(col_lo, col_hi + 1):
+                for row in xrange(row_lo, row_hi + 1):
+                    for k in cells.get((col, row), ()):
+                        if is_inside(k, i):
+                            blocker[i] = k
+                            return False
+            return True
+        
+        # collinear nodes go in with the reflex ones, as they may lie on the
+        # edge of an ear
+        for i in xrange(n):
+            set_reflex(i, turn(i) <= 0)
+        result = []
+        remaining, misses, i = n, 0, next[0]
+        while remaining > 3:
+            if is_ear(i):
+                misses = 0
+            else:
+                misses += 1
+                if misses <= remaining:
+                    i = next[i]
+                    continue
+                # a whole lap went by without an ear, which only happens when
+                # what is left is degenerate, or the polygon is
+                # self-intersecting, so clip a flat corner if there is one
+                for k in xrange(remaining):
+                    if turn(i) == 0: break
+                    i = next[i]
+                misses = 0
+            result.append(Triangle(copy[prev[i]], copy[i], copy[next[i]]))
+            set_reflex(i, False)
+            remaining -= 1
+            p, q = prev[i], next[i]
+            next[p], prev[q] = q, p
+            # the neighbors are the only nodes whose corners have changed
+            set_reflex(p, turn(p) <= 0)
+            set_reflex(q, turn(q) <= 0)
+            i = q
+        result.append(Triangle(copy[prev[i]], copy[i], copy[next[i]]))
+        return result
+    
+    def __is_self_intersecting(self):
+        """Returns True if any two of the polygon's lines intersect, other than
+        at a shared vertex. This is the Shamos-Hoey sweep: a line is swept from
+        left to right over the lines, and the lines it is crossing are kept in
+        a ``skiplist.SkipList``, in order from the bottom to the top. Two of the
+        lines meeting at the leftmost intersection are next to each other in
+        that order just before the sweep line reaches it, so each line is only
+        tested against its neighbors as it is inserted, and its two neighbors
+        against each other as it is removed. That takes O(n log n) time,
+        however much the lines' extents overlap."""
+        lines = self.lines
+        ends = [] # the left and the right end of each line
+        events = []
+        for i in xrange(len(lines)):
+            a, b = lines[i].node_a, lines[i].node_b
+            if (b.x, b.y) < (a.x, a.y):
+                a, b = b, a
+            ends.append((a, b))
+            if a == b:
+                continue # it is parallel to every line, so it can't intersect
+            # the events are in order of their points, and at each point, the
+            # lines ending there are removed before any starting there are
+            # inserted; the index breaks any remaining tie
+            events.append((a.x, a.y, 1, i))
+            events.append((b.x, b.y, 0, i))
+        events.sort()
+        
+        def crosses(i, k):
+            if i is None or k is None:
+                return False
+            return lines[i].does_intersect(lines[k], False) or \
+                   lines[k].does_intersect(lines[i], False)
+        
+        active = skiplist.SkipList()
+        for x, y, inserting, i in events:
+            if not inserting:
+                below, above = active.neighbors(i)
+                active.remove(i)
+                if crosses(below, above):
+                    return True
+                continue
+            a, b = ends[i]
+            
+            def before(k):
+                """Returns True if line ``i`` is below line ``k``."""
+                c, d = ends[k]
+                return (_turn(c, d, a) or _turn(c, d, b)) < 0
+            
+            active.insert(i, before)
+            below, above = active.neighbors(i)
+            if crosses(below, i) or crosses(i, above):
+                return True
+        return False
     
     def does_intersect_line(self, line):
         if line in self.triangle_lines: return True
@@ -330,3 +513,146 @@ class Polygon(BasePolygon):
             return start
         for l in self.lines:
             pass
+
+def merge(polygons):
+    """Merges each group of overlapping polygons in ``polygons`` into a single
+    polygon, tracing the outline of their union. Polygons that don't overlap
+    any other are returned as they are. Any holes enclosed by a group are
+    filled in, as a ``Polygon`` can't have holes. If a group's outline can't
+    be made into a valid ``Polygon``, such as when it pinches into two at a
+    single point, the group's polygons are returned unmerged. Returns a list
+    of polygons."""
+    polygons = list(polygons)
+    # join the polygons that overlap into groups, with a union-find
+    parent = range(len(polygons))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    order = sorted(range(len(polygons)), key=lambda i: polygons[i].bounds[0])
+    for j in xrange(len(order)):
+        a = polygons[order[j]]
+        for k in order[j + 1:]:
+            b = polygons[k]
+            if b.bounds[0] > a.bounds[2]: break
+            if find(order[j]) != find(k) and _overlaps(a, b):
+                parent[find(k)] = find(order[j])
+    groups = {}
+    for i in xrange(len(polygons)):
+        groups.setdefault(find(i), []).append(polygons[i])
+    result = []
+    for group in groups.values():
+        if len(group) == 1:
+            result.extend(group)
+            continue
+        try:
+            result.extend(_union(group))
+        except Exception:
+            result.extend(group)
+    return result
+
+def _overlaps(a, b):
+    """Returns True if the polygons ``a`` and ``b`` overlap or touch."""
+    if a.bounds[0] > b.bounds[2] or b.bounds[0] > a.bounds[2] or \
+       a.bounds[1] > b.bounds[3] or b.bounds[1] > a.bounds[3]:
+        return False
+    for i in a.lines:
+        for k in b.lines:
+            if i.does_intersect(k):
+                return True
+    return a.contains_node_in_area(b.nodes[0]) or \
+           b.contains_node_in_area(a.nodes[0])
+
+def _turn(a, b, c):
+    """Twice the signed area of the triangle ``a``, ``b``, ``c``, which is
+    positive if it runs counter-clockwise."""
+    return (b.x - a.x) * (c.y - a.y) - (b.y - a.y) * (c.x - a.x)
+
+def _union(group):
+    """Traces the outline of the union of the overlapping polygons in
+    ``group``, returning a list of the polygons that it is made of."""
+    # every edge, running counter-clockwise around its polygon
+    edges = []
+    for p in group:
+        nodes = list(p.nodes)
+        if sum([_turn(nodes[0], nodes[i], nodes[i + 1])
+                for i in xrange(1, len(nodes) - 1)]) < 0:
+            nodes.reverse()
+        for i in xrange(len(nodes)):
+            edges.append((nodes[i - 1], nodes[i], p))
+    # split the edges wherever they meet an edge of another polygon, making
+    # one node for each meeting point, so that the pieces join up exactly
+    splits = [[] for e in edges]
+    for i in xrange(len(edges)):
+        a, b, p = edges[i]
+        for k in xrange(i + 1, len(edges)):
+            c, d, q = edges[k]
+            if p is q: continue
+            if max(a.x, b.x) < min(c.x, d.x) or max(c.x, d.x) < min(a.x, b.x) or \
+               max(a.y, b.y) < min(c.y, d.y) or max(c.y, d.y) < min(a.y, b.y):
+                continue
+            for n in (c, d):
+                if _turn(a, b, n) == 0 and _is_between(a, b, n):
+                    splits[i].append(n)
+            for n in (a, b):
+                if _turn(c, d, n) == 0 and _is_between(c, d, n):
+                    splits[k].append(n)
+            denominator = (b.x - a.x) * (d.y - c.y) - (b.y - a.y) * (d.x - c.x)
+            if denominator == 0 or not Line(a, b).does_intersect(Line(c, d)):
+                continue
+            t = ((c.x - a.x) * (d.y - c.y) - (c.y - a.y) * (d.x - c.x)) / \
+                denominator
+            n = node.Node(a.x + t * (b.x - a.x), a.y + t * (b.y - a.y))
+            for m in (a, b, c, d):
+                if n.dist(m) < 1e-9:
+                    n = m
+            splits[i].append(n)
+            splits[k].append(n)
+    # keep the pieces with nothing on their outer side
+    pieces = {} # start node -> the end node of each piece starting there
+    for i in xrange(len(edges)):
+        a, b, p = edges[i]
+        length = a.dist(b)
+        points = sorted(set(splits[i] + [a, b]), key=a.dist)
+        for k in xrange(len(points) - 1):
+            u, v = points[k], points[k + 1]
+            if u == v: continue
+            # a point just to the right of the piece, outside of p
+            offset = 1e-6 * max(1., length) / u.dist(v)
+            outside = node.Node((u.x + v.x) * .5 + (v.y - u.y) * offset,
+                                (u.y + v.y) * .5 - (v.x - u.x) * offset)
+            if any(q is not p and q.contains_node_in_area(outside)
+                   for q in group):
+                continue
+            if v not in pieces.setdefault(u, []):
+                pieces[u].append(v)
+    # chain the pieces together into outlines
+    result = []
+    while pieces:
+        start = next(iter(pieces))
+        outline = [start]
+        while True:
+            ends = pieces[outline[-1]]
+            n = ends.pop()
+            if not ends:
+                del pieces[outline[-1]]
+            if n == start: break
+            outline.append(n)
+            if n not in pieces:
+                raise Exception("Outline is not closed")
+        # drop nodes in the middle of a straight edge
+        outline = [outline[i] for i in xrange(len(outline))
+                   if _turn(outline[i - 1], outline[i],
+                            outline[(i + 1) % len(outline)]) != 0]
+        area = sum([_turn(outline[0], outline[i], outline[i + 1])
+                    for i in xrange(1, len(outline) - 1)])
+        if area > 0: # otherwise it is the outline of a hole
+            result.append(Polygon(*outline))
+    return result
+
+def _is_between(a, b, n):
+    """Returns True if ``n``, which is collinear with ``a`` and ``b``, lies
+    strictly between them."""
+    return n != a and n != b and min(a.x, b.x) <= n.x <= max(a.x, b.x) and \
+           min(a.y, b.y) <= n.y <= max(a.y, b.y)
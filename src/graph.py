@@ -0,0 +1,211 @@
+import bisect
+from array import array
+
+class VisibilityGraph(object):
+    """A visibility graph over a set of nodes, kept in compact arrays rather
+    than in Python sets. Each node is given an integer index, its coordinates
+    are kept in one flat array, and the edges are kept in compressed sparse row
+    form: the neighbors of node ``i`` are ``targets[offsets[i]:offsets[i + 1]]``,
+    in sorted order. This takes a few bytes per edge.
+
+    Edges and nodes can still be added and removed. These edits are kept to the
+    side, and folded into the arrays once there are enough of them to make it
+    worthwhile, so a small change doesn't mean rebuilding the arrays.
+    
+    Each function in ``listeners`` is told about every edit, as it is made: it
+    is called as ``listener(i, k)`` when the edge between the nodes with
+    indexes ``i`` and ``k`` is added or removed, and as ``listener(i, None)``
+    when the node with index ``i`` is added or removed. Replacing every edge
+    at once, with ``set_edges`` or ``load``, isn't reported."""
+
+    def __init__(self, nodes=()):
+        """Creates a graph with no edges over ``nodes``, which are given the
+        indexes 0, 1, 2, and so on, in order."""
+        super(VisibilityGraph, self).__init__()
+        self.nodes = [] # index -> node, or None if the index is free
+        self.index = {} # node -> index
+        self.coordinates = array("d") # x0, y0, x1, y1, ...
+        self.offsets = array("l", [0])
+        self.targets = array("i")
+        self.__free = []
+        self.__added = {} # index -> indexes of edges added since compacting
+        self.__removed = {} # index -> indexes of edges removed since then
+        self.__edits = 0
+        self.listeners = []
+        for n in nodes:
+            self.add_node(n)
+
+    def __len__(self):
+        return len(self.index)
+
+    def add_node(self, node):
+        """Adds ``node`` to the graph, with no edges, returning its index. If
+        the node is already in the graph, its index is simply returned."""
+        if node in self.index:
+            return self.index[node]
+        if self.__free:
+            i = self.__free.pop()
+            self.nodes[i] = node
+            self.coordinates[2 * i] = node.x
+            self.coordinates[2 * i + 1] = node.y
+        else:
+            i = len(self.nodes)
+            self.nodes.append(node)
+            self.coordinates.append(node.x)
+            self.coordinates.append(node.y)
+        self.index[node] = i
+        for f in self.listeners:
+            f(i, None)
+        return i
+
+    def remove_node(self, i):
+        """Removes the node with index ``i``, along with all of its edges. The
+        index may be given to a node added later."""
+        for k in self.neighbors(i):
+            self.remove_edge(i, k)
+        del self.index[self.nodes[i]]
+        self.nodes[i] = None
+        self.__free.append(i)
+        for f in self.listeners:
+            f(i, None)
+
+    def indexes(self):
+        """Returns a list of the indexes of every node in the graph."""
+        return [i for i in xrange(len(self.nodes))
+                if self.nodes[i] is not None]
+
+    def neighbors(self, i):
+        """Returns a list of the indexes of the nodes that share an edge with
+        the node with index ``i``."""
+        if i + 1 < len(self.offsets):
+            row = self.targets[self.offsets[i]:self.offsets[i + 1]]
+        else:
+            row = ()
+        if i in self.__removed:
+            removed = self.__removed[i]
+            row = [k for k in row if k not in removed]
+        if i in self.__added:
+            return list(row) + list(self.__added[i])
+        return list(row)
+
+    def has_edge(self, i, k):
+        """Returns True if there is an edge between the nodes with indexes
+        ``i`` and ``k``."""
+        if i in self.__added and k in self.__added[i]:
+            return True
+        if i in self.__removed and k in self.__removed[i]:
+            return False
+        if i + 1 >= len(self.offsets):
+            return False
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        j = bisect.bisect_left(self.targets, k, lo, hi)
+        return j < hi and self.targets[j] == k
+
+    def add_edge(self, i, k):
+        """Adds an edge between the nodes with indexes ``i`` and ``k``."""
+        if self.has_edge(i, k):
+            return
+        for a, b in ((i, k), (k, i)):
+            if a in self.__removed and b in self.__removed[a]:
+                self.__removed[a].discard(b)
+            else:
+                self.__added.setdefault(a, set()).add(b)
+        self.__edit()
+        for f in self.listeners:
+            f(i, k)
+
+    def remove_edge(self, i, k):
+        """Removes the edge between the nodes with indexes ``i`` and ``k``, if
+        there is one."""
+        if not self.has_edge(i, k):
+            return
+        for a, b in ((i, k), (k, i)):
+            if a in self.__added and b in self.__added[a]:
+                self.__added[a].discard(b)
+            else:
+                self.__removed.setdefault(a, set()).add(b)
+        self.__edit()
+        for f in self.listeners:
+            f(i, k)
+
+    def set_edges(self, firsts, seconds):
+        """Replaces every edge in the graph with the edges between
+        ``firsts[j]`` and ``seconds[j]``, for each ``j``. This is much faster
+        than adding the edges one at a time."""
+        self.__added, self.__removed, self.__edits = {}, {}, 0
+        size = len(self.nodes)
+        degrees = [0] * size
+        for i in firsts: degrees[i] += 1
+        for i in seconds: degrees[i] += 1
+        offsets = array("l", [0])
+        for d in degrees:
+            offsets.append(offsets[-1] + d)
+        targets = array("i", [0]) * offsets[-1]
+        fill = list(offsets[:-1])
+        for i, k in zip(firsts, seconds):
+            targets[fill[i]] = k
+            fill[i] += 1
+            targets[fill[k]] = i
+            fill[k] += 1
+        for i in xrange(size):
+            lo, hi = offsets[i], offsets[i + 1]
+            if hi - lo > 1:
+                targets[lo:hi] = array("i", sorted(targets[lo:hi]))
+        self.offsets, self.targets = offsets, targets
+
+    def load(self, nodes, offsets, targets):
+        """Replaces everything in the graph with ``nodes``, a list holding the
+        node at each index, or None if the index is free, and the edges in
+        compressed sparse row form, as held by ``offsets`` and ``targets``."""
+        self.nodes = list(nodes)
+        self.index = {}
+        self.coordinates = array("d")
+        self.__free = []
+        for i in xrange(len(self.nodes)):
+            n = self.nodes[i]
+            if n is None:
+                self.coordinates.extend((0., 0.))
+                self.__free.append(i)
+            else:
+                self.coordinates.extend((n.x, n.y))
+                self.index[n] = i
+        self.__free.reverse() # so that the lowest is reused first
+        self.offsets = array("l", offsets)
+        self.targets = array("i", targets)
+        self.__added, self.__removed, self.__edits = {}, {}, 0
+    
+    def copy(self):
+        """Returns a copy of the graph, which shares nothing with it but the
+        nodes themselves. Its ``listeners`` start out empty."""
+        if self.__added or self.__removed:
+            self.compact()
+        g = VisibilityGraph()
+        g.load(self.nodes, self.offsets, self.targets)
+        return g
+    
+    def compact(self):
+        """Folds any edits made since the graph was last compacted into the
+        arrays."""
+        firsts, seconds = array("i"), array("i")
+        for i in self.indexes():
+            for k in self.neighbors(i):
+                if i < k:
+                    firsts.append(i)
+                    seconds.append(k)
+        self.set_edges(firsts, seconds)
+
+    def __edit(self):
+        self.__edits += 1
+        if self.__edits > 64 + len(self.targets) // 4:
+            self.compact()
+
+    def edges(self):
+        """Yields every edge in the graph once, as a pair of nodes."""
+        for i in self.indexes():
+            for k in self.neighbors(i):
+                if i < k:
+                    yield self.nodes[i], self.nodes[k]
+
+    def edge_count(self):
+        """Returns the number of edges in the graph."""
+        return sum([len(self.neighbors(i)) for i in self.indexes()]) // 2
@@ -0,0 +1,398 @@
+"""Hierarchical pathfinding, for boards too big to search as a whole. The board
+is cut into square regions, and each border between two regions gets a few
+portals: points on the border that a path can cross it through, spread along
+the stretches of it that no polygon covers.
+
+Within a region, the portals and the polygons' nodes are joined by the pairs
+of them that can see each other, and the shortest paths between its portals
+are worked out. Each region is only done when a search first reaches it, and
+it is kept until a polygon overlapping it is added or removed, so a change
+only costs the regions that it touches.
+
+A search is then done in two steps. First, an A* search over the portals,
+using the distances between them within each region, finds which regions the
+path goes through. Then the path is refined from the paths kept for those
+regions, and straightened wherever its nodes can see past each other. Because
+a path has to cross each border at a portal, it can be a little longer than
+the shortest path over the visibility graph."""
+
+import heapq
+import math
+import profiling
+from node import Node
+
+def _dijkstra(neighbors, sources):
+    """Finds the shortest paths from a point to every node of a graph, where
+    ``neighbors`` is a list holding a list of ``(index, distance)`` pairs for
+    each node, and ``sources`` is a list of ``(index, distance)`` pairs for the
+    nodes that the point is joined to. Returns a list of the distance to each
+    node, and a list of the node before each one on its path, which is None
+    for a node reached straight from the point."""
+    dist = [float("inf")] * len(neighbors)
+    prev = [None] * len(neighbors)
+    queue = []
+    for i, d in sources:
+        if d < dist[i]:
+            dist[i] = d
+            queue.append((d, i))
+    heapq.heapify(queue)
+    while queue:
+        d, i = heapq.heappop(queue)
+        if d > dist[i]: continue
+        for k, length in neighbors[i]:
+            if d + length < dist[k]:
+                dist[k] = d + length
+                prev[k] = i
+                heapq.heappush(queue, (dist[k], k))
+    return dist, prev
+
+def _trace(prev, i):
+    """Returns the list of the indexes on the path ending at ``i``, from the
+    list of previous nodes made by ``_dijkstra``."""
+    path = []
+    while i is not None:
+        path.append(i)
+        i = prev[i]
+    path.reverse()
+    return path
+
+class _Region(object):
+    """The graph of a single region: its ``nodes``, with its portals first,
+    the ``neighbors`` of each node, and the shortest paths from each portal,
+    which are worked out as they are asked for."""
+
+    def __init__(self, nodes, portal_count, neighbors):
+        self.nodes = nodes
+        self.portal_count = portal_count
+        self.neighbors = neighbors
+        self.index = dict((nodes[i], i) for i in xrange(len(nodes)))
+        self.paths = {} # portal index -> the result of _dijkstra from it
+
+    def get_paths(self, i):
+        if i not in self.paths:
+            self.paths[i] = _dijkstra(self.neighbors, [(i, 0.)])
+        return self.paths[i]
+
+class Hierarchy(object):
+    """The regions and portals of a ``Board``, each region a square with a side
+    of ``region_size``. Portals are spread along each free stretch of a
+    border no more than ``portal_spacing`` apart, which is a quarter of
+    ``region_size`` if it isn't given. The board has to tell the hierarchy
+    about each polygon it adds or removes, through ``add`` and ``remove``."""
+
+    def __init__(self, board, region_size, portal_spacing=None):
+        super(Hierarchy, self).__init__()
+        if not region_size > 0:
+            raise Exception("The region size must be more than zero")
+        self.board = board
+        self.region_size = float(region_size)
+        self.portal_spacing = portal_spacing or self.region_size / 4.
+        self.__polygons = {} # region -> the polygons overlapping it
+        self.__regions = {} # region -> its _Region
+        self.__borders = {} # border -> the portals along it
+        self.__extent = None # the range of regions holding every polygon
+        for p in board.polygons:
+            self.add(p)
+
+    def __regions_of(self, poly):
+        """Yields each region that ``poly`` overlaps, or only touches."""
+        s = self.region_size
+        min_x, min_y, max_x, max_y = poly.bounds
+        for col in xrange(int(math.ceil(min_x / s)) - 1,
+                          int(math.floor(max_x / s)) + 1):
+            for row in xrange(int(math.ceil(min_y / s)) - 1,
+                              int(math.floor(max_y / s)) + 1):
+                yield (col, row)
+
+    def __region_at(self, point):
+        s = self.region_size
+        return (int(math.floor(point.x / s)), int(math.floor(point.y / s)))
+
+    def __regions_at(self, point):
+        """Returns the regions that ``point`` is in or on the edge of. The
+        edges are worked out just as the borders' are, so a point on a border
+        is always found on both sides of it."""
+        s = self.region_size
+        col, row = self.__region_at(point)
+        cols = [c for c in (col - 1, col, col + 1)
+                if c * s <= point.x <= (c + 1) * s]
+        rows = [r for r in (row - 1, row, row + 1)
+                if r * s <= point.y <= (r + 1) * s]
+        return [(c, r) for c in cols for r in rows]
+
+    def add(self, poly):
+        """Files ``poly`` under each region it overlaps, and forgets what was
+        worked out for those regions."""
+        for r in self.__regions_of(poly):
+            self.__polygons.setdefault(r, []).append(poly)
+        self.__forget(poly)
+
+    def remove(self, poly):
+        """Takes ``poly`` out of each region it overlaps, and forgets what was
+        worked out for those regions."""
+        for r in self.__regions_of(poly):
+            self.__polygons[r].remove(poly)
+            if not self.__polygons[r]: del self.__polygons[r]
+        self.__forget(poly)
+
+    def __forget(self, poly):
+        """Forgets the graphs of the regions that ``poly`` overlaps, and the
+        portals on the borders that it reaches. The regions on both sides of
+        such a border are always among those forgotten. The portals of any
+        other border come out the same when they are found again, so they are
+        kept, along with the graphs of the regions beyond them."""
+        stats = self.board.stats
+        min_x, min_y, max_x, max_y = poly.bounds
+        s = self.region_size
+        for r in self.__regions_of(poly):
+            if self.__regions.pop(r, None) is not None and stats is not None:
+                stats.count("regions_forgotten")
+            for b in self.__borders_of(r):
+                kind, col, row = b
+                if kind == "v":
+                    reached = min_x <= col * s <= max_x and \
+                              min_y <= (row + 1) * s and row * s <= max_y
+                else:
+                    reached = min_y <= row * s <= max_y and \
+                              min_x <= (col + 1) * s and col * s <= max_x
+                if reached:
+                    self.__borders.pop(b, None)
+        self.__extent = None
+
+    def __borders_of(self, region):
+        """Returns the keys of the four borders of ``region``. A ``"v"``
+        border runs up the left side of the region named after it, and an
+        ``"h"`` border along its bottom side."""
+        col, row = region
+        return [("v", col, row), ("v", col + 1, row), ("h", col, row),
+                ("h", col, row + 1)]
+
+    def __get_portals(self, border):
+        """Returns the list of the portals on ``border``, finding them first if
+        need be. The border is split wherever a polygon's line crosses or
+        touches it, and each piece that isn't inside of a polygon gets portals
+        spread evenly along it."""
+        if border in self.__borders:
+            return self.__borders[border]
+        kind, col, row = border
+        s = self.region_size
+        # the border as the x or y that is fixed along it, the span of the
+        # other, and whether it is vertical
+        if kind == "v":
+            fixed, lo, hi, vertical = col * s, row * s, (row + 1) * s, True
+        else:
+            fixed, lo, hi, vertical = row * s, col * s, (col + 1) * s, False
+        def at(t):
+            return Node(fixed, t) if vertical else Node(t, fixed)
+        # a polygon that reaches the border overlaps both of its regions
+        polygons = self.__polygons.get((col, row), ())
+        cuts = set([lo, hi])
+        for p in polygons:
+            for l in p.lines:
+                a, b = l.node_a, l.node_b
+                if not vertical:
+                    a, b = Node(a.y, a.x), Node(b.y, b.x)
+                # now the border runs along x == fixed
+                if a.x == fixed:
+                    cuts.add(a.y)
+                if b.x == fixed:
+                    cuts.add(b.y)
+                if (a.x - fixed) * (b.x - fixed) < 0:
+                    cuts.add(a.y + (fixed - a.x) * (b.y - a.y) / (b.x - a.x))
+        cuts = sorted([t for t in cuts if lo <= t <= hi])
+        # join the free pieces that meet end to end
+        pieces = []
+        for i in xrange(len(cuts) - 1):
+            middle = at((cuts[i] + cuts[i + 1]) * .5)
+            if self.__covered(middle, polygons):
+                continue
+            if pieces and pieces[-1][1] == cuts[i]:
+                pieces[-1][1] = cuts[i + 1]
+            else:
+                pieces.append([cuts[i], cuts[i + 1]])
+        portals = []
+        for start, end in pieces:
+            count = max(1, int(round((end - start) / self.portal_spacing)))
+            step = (end - start) / count
+            portals.extend([at(start + (i + .5) * step)
+                            for i in xrange(count)])
+        self.__borders[border] = portals
+        return portals
+
+    def __covered(self, point, polygons):
+        """Returns True if ``point`` is inside of any of ``polygons``."""
+        tests, found = 0, False
+        for p in polygons:
+            tests += 1
+            if p.contains_node_in_area(point):
+                found = True
+                break
+        if self.board.stats is not None:
+            self.board.stats.count("contains_node_in_area", tests)
+        return found
+    
+    def __get_region(self, region):
+        """Returns the ``_Region`` for ``region``, building it first if need
+        be. Its nodes are the portals on its borders and the polygons' nodes
+        inside of it, and every pair of them that can see each other is
+        joined, which keeps each path within the region, as it is convex. A
+        polygon's node on the edge of the region is a portal as well, as a
+        path can cross into the next region there."""
+        if region in self.__regions:
+            return self.__regions[region]
+        with profiling.phase(self.board.stats, "build_region"):
+            nodes = []
+            for b in self.__borders_of(region):
+                nodes.extend(self.__get_portals(b))
+            s = self.region_size
+            min_x, min_y = region[0] * s, region[1] * s
+            max_x, max_y = (region[0] + 1) * s, (region[1] + 1) * s
+            inside = []
+            seen = set(nodes)
+            for p in self.__polygons.get(region, ()):
+                for n in p.nodes:
+                    if n not in seen and min_x <= n.x <= max_x and \
+                       min_y <= n.y <= max_y:
+                        seen.add(n)
+                        if n.x in (min_x, max_x) or n.y in (min_y, max_y):
+                            nodes.append(n)
+                        else:
+                            inside.append(n)
+            portal_count = len(nodes)
+            nodes.extend(inside)
+            neighbors = [[] for n in nodes]
+            for i in xrange(len(nodes) - 1):
+                blockers = self.board.get_blockers(nodes[i], nodes[i + 1:])
+                for k in xrange(i + 1, len(nodes)):
+                    if blockers[k - i - 1] is None:
+                        d = nodes[i].dist(nodes[k])
+                        neighbors[i].append((k, d))
+                        neighbors[k].append((i, d))
+            self.__regions[region] = _Region(nodes, portal_count, neighbors)
+        return self.__regions[region]
+
+    def __connect(self, point, region):
+        """Returns the shortest paths within ``region`` from ``point`` to each
+        of its nodes, as ``_dijkstra`` does."""
+        r = self.__get_region(region)
+        blockers = self.board.get_blockers(point, r.nodes)
+        return _dijkstra(r.neighbors, [(i, point.dist(r.nodes[i]))
+                                       for i in xrange(len(r.nodes))
+                                       if blockers[i] is None])
+
+    def __get_extent(self):
+        """Returns the lowest and highest column and row of the regions that
+        hold a polygon."""
+        if self.__extent is None:
+            regions = self.__polygons.keys() or [(0, 0)]
+            self.__extent = (min([r[0] for r in regions]),
+                             min([r[1] for r in regions]),
+                             max([r[0] for r in regions]),
+                             max([r[1] for r in regions]))
+        return self.__extent
+
+    def get_shortest_path(self, node_a, node_b):
+        """Finds a path from ``node_a`` to ``node_b``, in the same form that
+        ``Board.get_shortest_path`` returns it: the list of nodes to travel
+        through, ending with ``node_b`` and not including ``node_a``, or None
+        if there is no path. The search keeps to the regions around the
+        polygons and the two points, with a ring of empty regions around
+        them to find its way around the outside."""
+        board = self.board
+        if node_a == node_b: return [node_a]
+        if board.is_visible(node_a, node_b): return [node_b]
+        start, goal = self.__region_at(node_a), self.__region_at(node_b)
+        col_lo, row_lo, col_hi, row_hi = self.__get_extent()
+        col_lo = min(col_lo, start[0], goal[0]) - 1
+        row_lo = min(row_lo, start[1], goal[1]) - 1
+        col_hi = max(col_hi, start[0], goal[0]) + 1
+        row_hi = max(row_hi, start[1], goal[1]) + 1
+        from_a = self.__connect(node_a, start)
+        to_b = self.__connect(node_b, goal)
+        # the best way found so far, and how it ends
+        best, end = float("inf"), None
+        if start == goal:
+            nodes = self.__get_region(start).nodes
+            for i in xrange(len(nodes)):
+                if from_a[0][i] + to_b[0][i] < best:
+                    best, end = from_a[0][i] + to_b[0][i], (None, i)
+        g = {}
+        came_from = {} # portal -> (the portal before it, the region between)
+        queue = []
+        r = self.__get_region(start)
+        for i in xrange(r.portal_count):
+            if from_a[0][i] < float("inf"):
+                p = r.nodes[i]
+                g[p] = from_a[0][i]
+                came_from[p] = (None, start)
+                heapq.heappush(queue, (g[p] + p.dist(node_b), g[p], p))
+        done = set()
+        expanded = 0
+        while queue:
+            f, cost, p = heapq.heappop(queue)
+            if f >= best: break
+            if p in done: continue
+            done.add(p)
+            expanded += 1
+            for region in self.__regions_at(p):
+                if not (col_lo <= region[0] <= col_hi and
+                        row_lo <= region[1] <= row_hi):
+                    continue
+                r = self.__get_region(region)
+                i = r.index.get(p)
+                if i is None or i >= r.portal_count: continue
+                if region == goal and cost + to_b[0][i] < best:
+                    best, end = cost + to_b[0][i], (p, i)
+                dist = r.get_paths(i)[0]
+                for k in xrange(r.portal_count):
+                    q = r.nodes[k]
+                    if q in done or cost + dist[k] >= g.get(q, float("inf")):
+                        continue
+                    g[q] = cost + dist[k]
+                    came_from[q] = (p, region)
+                    heapq.heappush(queue, (g[q] + q.dist(node_b), g[q], q))
+        if board.stats is not None:
+            board.stats.count("portals_expanded", expanded)
+        if end is None:
+            return None
+        return self.__refine(node_a, node_b, start, goal, from_a, to_b,
+                             came_from, end)
+
+    def __refine(self, node_a, node_b, start, goal, from_a, to_b, came_from,
+                 end):
+        """Turns the portals found by the search into a path, by joining up the
+        paths kept for the regions between them, and then straightens it."""
+        p, i = end
+        r = self.__get_region(goal)
+        path = [r.nodes[k] for k in reversed(_trace(to_b[1], i))]
+        while p is not None:
+            before, region = came_from[p]
+            r = self.__get_region(region)
+            if before is None:
+                prev = from_a[1]
+            else:
+                prev = r.get_paths(r.index[before])[1]
+            # the path already starts with p
+            path[:0] = [r.nodes[k] for k in _trace(prev, r.index[p])[:-1]]
+            p = before
+        if end[0] is None:
+            r = self.__get_region(start)
+            path[:0] = [r.nodes[k] for k in _trace(from_a[1], i)[:-1]]
+        path.append(node_b)
+        return self.__straighten(node_a, path)
+
+    def __straighten(self, node_a, path):
+        """Drops the nodes of ``path`` that it can skip, going straight on from
+        each node to the furthest node after it that can be seen from it
+        without losing sight of the ones in between."""
+        path = [node_a] + path
+        result = []
+        i = 0
+        while i < len(path) - 1:
+            k = i + 1
+            while k + 1 < len(path) and \
+                  self.board.is_visible(path[i], path[k + 1]):
+                k += 1
+            result.append(path[k])
+            i = k
+        return result
@@ -0,0 +1,87 @@
+"""Reading maps of many polygons, for ``Board.add_all``. Each function here is
+a generator, which makes each ``Polygon`` as its points are read, so a map is
+read in a single pass and never held in memory as a whole.
+
+A map file holds one polygon per line, as its points in order. A line can be
+any of these forms, and a file can mix them:
+
+    0 0 4 0 4 3                          coordinates, split by spaces or commas
+    [[0, 0], [4, 0], [4, 3]]             a JSON list of points
+    [0, 0, 4, 0, 4, 3]                   a JSON list of coordinates
+    POLYGON ((0 0, 4 0, 4 3, 0 0))       a WKT polygon, without holes
+
+Blank lines, and lines starting with ``#``, are skipped. If a polygon's last
+point repeats its first, as in WKT, the repeat is dropped."""
+
+import json
+import geometry
+
+def read_polygons(source):
+    """Yields a ``Polygon`` for each polygon in the map ``source``, which is
+    either the path to a map file or a file already open for reading."""
+    if isinstance(source, basestring):
+        with open(source) as f:
+            for p in read_polygons(f):
+                yield p
+        return
+    name = getattr(source, "name", "the map")
+    number = 0
+    for line in source:
+        number += 1
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            points = _parse(line)
+        except ValueError:
+            raise Exception("Line %d of %s isn't a polygon: %s" %
+                            (number, name, line))
+        yield _make(points, "line %d of %s" % (number, name))
+
+def from_array(coordinates, sizes):
+    """Yields a ``Polygon`` for each polygon in a flat sequence of
+    ``coordinates``, such as an ``array.array`` or a NumPy array, holding the
+    x and then the y of each point of each polygon in turn. ``sizes`` holds
+    the number of points in each polygon."""
+    start = 0
+    for n in xrange(len(sizes)):
+        end = start + 2 * int(sizes[n])
+        if end > len(coordinates):
+            raise Exception("There are too few coordinates for polygon %d" % n)
+        points = [(float(coordinates[i]), float(coordinates[i + 1]))
+                  for i in xrange(start, end, 2)]
+        yield _make(points, "polygon %d" % n)
+        start = end
+
+def _parse(line):
+    """Returns the points of a polygon from a line of a map file. Raises a
+    ``ValueError`` if the line isn't in any of the forms of a map file."""
+    if line.startswith("["):
+        data = json.loads(line)
+        if data and isinstance(data[0], list):
+            return [(float(x), float(y)) for x, y in data]
+        return _pair(data)
+    if line[0].isalpha():
+        kind, sep, rings = line.partition("(")
+        if kind.strip().upper() != "POLYGON" or not sep:
+            raise ValueError(line)
+        rings = rings.strip()
+        if rings.count("(") != 1:
+            raise ValueError(line) # holes can't be represented
+        return _pair(rings.strip("()").replace(",", " ").split())
+    return _pair(line.replace(",", " ").split())
+
+def _pair(values):
+    """Returns a list of points from a flat list of coordinates."""
+    if len(values) % 2:
+        raise ValueError(values)
+    return [(float(values[i]), float(values[i + 1]))
+            for i in xrange(0, len(values), 2)]
+
+def _make(points, where):
+    """Returns a ``Polygon`` of ``points``, found at ``where``."""
+    if len(points) > 3 and points[0] == points[-1]:
+        points = points[:-1]
+    if len(points) < 3:
+        raise Exception("There are fewer than 3 points in " + where)
+    return geometry.Polygon(*points)
@@ -1,32 +1,336 @@
+import collections
+import heapq
+import math
+import multiprocessing
+import time
+from array import array
+import anytime
 import geometry
+import graph
+import hierarchy
+import navmesh
 import node
+import profiling
+import spatial
+import storage
+import sweep
+import vectorized
+
+# the fewest nearby segments worth handing over to NumPy for a single test
+VECTORIZE_THRESHOLD = 48
 
 class Board(object):
     """Representing a game board, this class is composed of a set of
     ``Polygon``s which are non-moveable. These can represent PVC, blocks, or any
     other place you wish for the robot to avoid. Knowing everything about the
     game's design, this class can do such things as tell if a node is within the
-    line-of-sight or another node, or even utilize Dijkstra's algorithm to find
-    the shortest possible path from one node to another. Note that this board is
+    line-of-sight or another node, or even utilize the A* algorithm to find the
+    shortest possible path from one node to another. Note that this board is
     not entirely realistic. It assumes each node is simply an infinitely tiny
     point in space, and that robots are nodes. For realistic purposes, a wrapper
-    or extended version of this class could be used."""
+    or extended version of this class could be used.
+    
+    The visibility graph can be built with one of two engines. The
+    ``"pairwise"`` engine tests every pair of nodes directly, while the
+    ``"sweep"`` engine uses Lee's rotational plane-sweep, which is much faster
+    on boards with many nodes. Both produce the same graph. As the sweep needs
+    the polygons not to overlap, the pairwise engine is used in its place on
+    boards where they do."""
     
-    def __init__(self):
-        """Creates an empty board. Use the ``add`` function"""
+    engines = ("pairwise", "sweep")
+    # the most expanded boards that ``get_expanded`` keeps around
+    expanded_cache_size = 4
+    # how far the navigation mesh reaches past the polygons on every side
+    navmesh_margin = 1.
+    # the most pairs of nodes that ``build_visibility`` decides in one step
+    build_step = 64
+    
+    def __init__(self, engine="pairwise", path_cache_size=0, snap=0.,
+                 stats=None, reduced=False, lazy=False, mesh=False,
+                 region_size=0.):
+        """Creates an empty board. Use the ``add`` function. ``engine`` selects
+        how the visibility graph is built, and should be one of
+        ``Board.engines``.
+        
+        If ``path_cache_size`` is more than zero, up to that many results of
+        ``get_shortest_path`` are kept, so that repeating a query is almost
+        free. The least recently used results are dropped first, and adding or
+        removing a polygon makes every result stale. If ``snap`` is more than
+        zero, queries whose endpoints fall in the same ``snap`` sized square
+        share a result, so the path found for one pair of endpoints is reused,
+        with its last node replaced, for endpoints slightly apart from them,
+        as long as the new endpoints can see the path's first and last turns;
+        otherwise the path is searched for again.
+        
+        If ``stats`` is a ``profiling.Stats`` object, the board collects its
+        counters and timers into it, as described in the ``profiling`` module.
+        It can also be set or cleared later through the ``stats`` attribute.
+        
+        If ``reduced`` is True, paths are searched for over the
+        ``reduced_graph`` rather than the full visibility graph, which gives
+        the same shortest paths with far fewer edges to search.
+        
+        If ``lazy`` is True, ``get_shortest_path`` doesn't calculate the
+        visibility graph, but only tests the pairs of nodes its search needs,
+        keeping the results for later searches. This makes the first searches
+        on a new or changed board much faster. Once the graph is calculated
+        some other way, it is used instead.
+        
+        If ``mesh`` is True, ``get_shortest_path`` searches the ``navmesh``
+        instead of the visibility graph, which is much cheaper to build and
+        keep on very large boards, though its paths may be a little longer.
+        
+        If ``region_size`` is more than zero, ``get_shortest_path`` searches
+        the board's ``hierarchy`` of square regions of that size instead, as
+        described in the ``hierarchy`` module. Only the regions that a search
+        needs are worked out, and adding or removing a polygon only makes
+        the regions it overlaps be worked out again."""
         super(Board, self).__init__()
+        if engine not in self.engines:
+            raise Exception("Unknown visibility engine: " + str(engine))
+        self.engine = engine
+        self.path_cache_size = path_cache_size
+        self.snap = snap
+        self.stats = stats
+        self.reduced = reduced
+        self.lazy = lazy
+        self.mesh = mesh
+        self.region_size = region_size
+        self.__path_cache = collections.OrderedDict()
+        self.__path_cache_hits = self.__path_cache_misses = 0
         self.polygons = set()
         self.__precalculated = False
+        self.__building = None # (revision, the rows left) of a graph build
+        self.__revision = 0
+        self.__index = None
+        self.__index_keys = {} # polygon -> keys of its segments in the index
+        self.__locator = None
+        self.__locator_keys = {} # polygon -> keys of its triangles
+        self.__expanded = collections.OrderedDict() # key -> expanded board
+        self.__owners = {} # segment -> polygons it belongs to
+        self.__diagonals = {} # triangulation segment -> polygons it belongs to
+        self.__diagonal_ends = {} # node -> [(other end, polygons)] of each
+        self.__graph = None
+        self.__corners = None # (node -> its neighbors, reflex nodes)
+        self.__lazy_blockers = {} # pair of nodes -> polygon blocking them
+        self.__reduced = None
+        self.__navmesh = None
+        self.__hierarchy = None
+        self.__uses = {} # node -> the number of polygons it is a vertex of
+        # polygon -> the pairs it is blocking, as [the first index of each, the
+        # second index of each, the length to drop duplicates at]
+        self.__blocking = {}
+        self.__segment_array = None
+        self.__frozen = False
+        self.__anytime = None # the last anytime search
     
     def add(self, poly):
-        """Adds a polygon, ``poly``, to the game board."""
+        """Adds a polygon, ``poly``, to the game board. If the visibility graph
+        has already been calculated, it is updated to match, rather than thrown
+        away: only the edges that cross ``poly`` are removed, and only the new
+        nodes are tested against the rest of the board."""
+        if self.__frozen:
+            raise Exception("A frozen board can't be changed")
+        if poly in self.polygons: return
+        segments = self.__own(poly)
+        self.__revision += 1
+        self.__expanded.clear()
+        self.__segment_array = None
+        self.__corners = self.__reduced = self.__navmesh = None
+        if self.__index is not None:
+            if len(self.__index) + len(segments) > \
+               2 * self.__index.built_size:
+                # the grid has outgrown its cell size, so rebuild it later
+                self.__index = None
+            else:
+                self.__index_keys[poly] = [self.__index.add(l, poly)
+                                           for l in segments]
+        if self.__locator is not None:
+            if len(self.__locator) + len(poly.triangles) > \
+               2 * self.__locator.built_size:
+                self.__locator = None
+            else:
+                self.__locator_keys[poly] = [self.__locator.add(t, poly)
+                                             for t in poly.triangles]
+        if self.__hierarchy is not None:
+            self.__hierarchy.add(poly)
+        if self.__precalculated:
+            with profiling.phase(self.stats, "update_visibility"):
+                self.__add_visibility(poly)
+        elif self.__lazy_blockers:
+            self.__add_lazy_blocker(poly)
+    
+    def __own(self, poly):
+        """Puts ``poly`` in ``polygons``, and records it as the owner of each
+        of its segments, which it returns."""
         self.polygons.add(poly)
-        self.__precalculated = False
+        segments = poly.lines + list(poly.triangle_lines)
+        for l in segments:
+            self.__owners.setdefault(l, []).append(poly)
+        for l in poly.triangle_lines:
+            if l not in self.__diagonals:
+                polys = self.__diagonals[l] = []
+                self.__diagonal_ends.setdefault(l.node_a, []).append(
+                    (l.node_b, polys))
+                self.__diagonal_ends.setdefault(l.node_b, []).append(
+                    (l.node_a, polys))
+            self.__diagonals[l].append(poly)
+        return segments
+    
+    def add_all(self, polygons, precalculate=True, processes=1):
+        """Adds many polygons at once, far faster than adding each with
+        ``add``. ``polygons`` can be any iterable, such as those from the
+        ``loading`` module, and is read just once; each item is either a
+        ``Polygon`` or a sequence of ``(x, y)`` points, which is made into one
+        as it arrives. Nothing else is updated while they are added. Instead,
+        the spatial index, the visibility graph and the rest are thrown away
+        once, and, if ``precalculate`` is True, built again at the end with a
+        single pass each, using ``processes`` as ``precalculate_visibility``
+        does. A board that finds its paths some other way builds what it
+        uses instead of the visibility graph: nothing if it is ``lazy``, the
+        ``navmesh`` if it uses a mesh, and nothing for a ``hierarchy``, which
+        works out its regions as they are needed.
+        
+        If a ``planner.Planner`` is following the board's visibility graph,
+        the polygons are added one at a time with ``add``, so that it sees
+        each change."""
+        if self.__frozen:
+            raise Exception("A frozen board can't be changed")
+        if self.__precalculated and self.__graph.listeners:
+            for poly in polygons:
+                self.add(_as_polygon(poly))
+            return
+        added = 0
+        with profiling.phase(self.stats, "add_all"):
+            for poly in polygons:
+                poly = _as_polygon(poly)
+                if poly not in self.polygons:
+                    self.__own(poly)
+                    added += 1
+        if added:
+            self.__revision += added
+            self.__expanded.clear()
+            self.__index = self.__locator = None
+            self.__index_keys, self.__locator_keys = {}, {}
+            self.__segment_array = None
+            self.__corners = self.__reduced = self.__navmesh = None
+            self.__hierarchy = None
+            self.__graph = None
+            self.__precalculated = False
+            self.__lazy_blockers = {}
+        if precalculate:
+            self.get_index()
+            if self.mesh:
+                self.get_navmesh()
+            elif not self.lazy and self.region_size <= 0:
+                self.precalculate_visibility(processes)
     
     def remove(self, poly):
-        """Removes a polygon, ``poly``, from the game board."""
+        """Removes a polygon, ``poly``, from the game board. If the visibility
+        graph has already been calculated, it is updated to match: only the
+        pairs of nodes that ``poly`` was blocking are tested again."""
+        if self.__frozen:
+            raise Exception("A frozen board can't be changed")
         self.polygons.remove(poly)
-        self.__precalculated = False
+        self.__revision += 1
+        self.__expanded.clear()
+        for l in poly.lines + list(poly.triangle_lines):
+            self.__owners[l].remove(poly)
+            if not self.__owners[l]: del self.__owners[l]
+        for l in poly.triangle_lines:
+            polys = self.__diagonals[l]
+            polys.remove(poly)
+            if not polys:
+                del self.__diagonals[l]
+                for end in (l.node_a, l.node_b):
+                    ends = [i for i in self.__diagonal_ends[end]
+                            if i[1] is not polys]
+                    if ends:
+                        self.__diagonal_ends[end] = ends
+                    else:
+                        del self.__diagonal_ends[end]
+        self.__segment_array = None
+        self.__corners = self.__reduced = self.__navmesh = None
+        if self.__index is not None:
+            for key in self.__index_keys.pop(poly):
+                self.__index.remove(key)
+        if self.__locator is not None:
+            for key in self.__locator_keys.pop(poly):
+                self.__locator.remove(key)
+        if self.__hierarchy is not None:
+            self.__hierarchy.remove(poly)
+        if self.__precalculated:
+            with profiling.phase(self.stats, "update_visibility"):
+                self.__remove_visibility(poly)
+        elif self.__lazy_blockers:
+            blockers = self.__lazy_blockers
+            for pair in [k for k, v in blockers.items() if v is poly]:
+                del blockers[pair] # to be tested again when it is needed
+    
+    def get_revision(self):
+        return self.__revision
+    
+    revision = property(get_revision,
+                        doc="""A counter that is bumped every time a polygon is
+                        added to or removed from this ``Board``""")
+    
+    def get_index(self):
+        """Returns a ``spatial.SegmentGrid`` over every segment that blocks
+        line-of-sight on this ``Board``: every polygon's lines, as well as the
+        lines added by each polygon's triangulation. Each segment is owned by
+        its polygon. The grid is kept up to date as polygons are added and
+        removed."""
+        if self.__index is None:
+            lines, owners = [], []
+            for p in self.polygons:
+                segments = p.lines + list(p.triangle_lines)
+                lines.extend(segments)
+                owners.extend([p] * len(segments))
+            self.__index = spatial.SegmentGrid(lines, owners=owners)
+            self.__index_keys = {}
+            for key, p in self.__index.owners.items():
+                self.__index_keys.setdefault(p, []).append(key)
+        return self.__index
+    
+    index = property(get_index,
+                     doc="""A ``spatial.SegmentGrid`` of every segment that
+                     blocks line-of-sight on this ``Board``""")
+    
+    def __get_locator(self):
+        """Returns a ``spatial.TriangleGrid`` over the triangles of every
+        polygon on this ``Board``, each owned by its polygon. Like the index,
+        it is kept up to date as polygons are added and removed."""
+        if self.__locator is None:
+            triangles, owners = [], []
+            for p in self.polygons:
+                triangles.extend(p.triangles)
+                owners.extend([p] * len(p.triangles))
+            self.__locator = spatial.TriangleGrid(triangles, owners=owners)
+            self.__locator_keys = {}
+            for key, p in self.__locator.owners.items():
+                self.__locator_keys.setdefault(p, []).append(key)
+        return self.__locator
+    
+    def locate(self, point):
+        """Returns the polygon on this ``Board`` that ``point`` is inside of,
+        or None if it isn't inside of any. A point on the edge of a polygon
+        counts as being inside of it. Rather than testing every polygon, the
+        point is looked up in a grid over the polygons' triangles."""
+        locator = self.__get_locator()
+        key = locator.find(point, self.stats)
+        return None if key is None else locator.owners[key]
+    
+    def locate_all(self, points):
+        """Returns a list with the result of ``locate`` for each of
+        ``points``."""
+        locator = self.__get_locator()
+        return [None if key is None else locator.owners[key]
+                for key in locator.find_all(list(points), self.stats)]
+    
+    def is_free(self, point):
+        """Returns True if ``point`` isn't inside of, or on the edge of, any
+        polygon on this ``Board``."""
+        return self.locate(point) is None
     
     def get_lines(self):
         """Creates and returns a set of every polygon's lines on this
@@ -36,10 +340,39 @@ class Board(object):
             lines.update(i.lines)
         return lines
     
-    def get_expanded(self, outset):
-        b = Board()
-        for p in self.polygons:
-            b.add(p.get_expanded(outset))
+    def get_expanded(self, outset, merge=False):
+        """Returns a new ``Board`` with each polygon on this one grown outwards
+        by ``outset``, which is useful for planning the path of a robot with a
+        radius of ``outset``. If ``merge`` is True, each group of expanded
+        polygons that overlap is merged into one polygon, which makes for a
+        smaller visibility graph. The new board searches for paths the same
+        way as this one, with the same ``engine``, ``reduced``, ``lazy``,
+        ``mesh`` and ``region_size``.
+        
+        The expanded boards are cached, so asking for the same one again is
+        cheap, as long as no polygon has been added or removed in the
+        meantime. As the returned board is shared with every other caller, it
+        is ``frozen``, and adding or removing a polygon on it raises an
+        exception."""
+        key = (outset, bool(merge), self.engine, self.reduced, self.lazy,
+               self.mesh, self.region_size)
+        cache = self.__expanded
+        if key in cache:
+            b = cache.pop(key)
+        else:
+            with profiling.phase(self.stats, "get_expanded"):
+                polygons = [p.get_expanded(outset) for p in self.polygons]
+                if merge:
+                    polygons = geometry.merge(polygons)
+                b = Board(self.engine, stats=self.stats, reduced=self.reduced,
+                          lazy=self.lazy, mesh=self.mesh,
+                          region_size=self.region_size)
+                for p in polygons:
+                    b.add(p)
+                b.__frozen = True
+            while len(cache) >= self.expanded_cache_size:
+                cache.popitem(last=False) # the least recently used
+        cache[key] = b
         return b
     
     def __str__(self):
@@ -59,114 +392,1019 @@ class Board(object):
     nodes = property(get_nodes,
                      doc="A set of every ``Polygon``'s nodes on this ``Board``")
     
-    def precalculate_visibility(self):
+    def precalculate_visibility(self, processes=1):
         """Before doing a group of visibility tests, call this first, and it can
         do some caching that may improve the performance of further is_visible
         calls. You don't need to call this before calling ``get_shortest_path``,
         as it will intelligently decide if it should call this or not, and if
-        so, it will do it itself."""
+        so, it will do it itself. Once calculated, the cache is kept up to date
+        by ``add`` and ``remove``.
+        
+        If ``processes`` is more than one, the work is split between that many
+        worker processes, which is much faster for large boards on a machine
+        with cores to spare. If it is None, a process is used for each core.
+        The graph is the same either way."""
         if self.__precalculated: return False
-        for i in self.nodes:
-            i.visible_siblings = set()
-            i.nonvisible_siblings = set()
-        for i in self.nodes:
-            for k in self.nodes:
-                if not k is i and k not in i.visible_siblings and \
-                   k not in i.nonvisible_siblings:
-                    if self.__visibility_test(i, k):
-                        i.visible_siblings.add(k)
-                        k.visible_siblings.add(i)
-                    else:
-                        i.nonvisible_siblings.add(k)
-                        k.nonvisible_siblings.add(i)
-        for i in self.nodes: # cleanup
-            del i.nonvisible_siblings
-        self.__precalculated = True
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes > 1 and self.__building is None:
+            with profiling.phase(self.stats, "precalculate_visibility"):
+                nodes = self.__start_graph()
+                if len(nodes) > 1:
+                    firsts, seconds = array("i"), array("i")
+                    self.__precalculate_in_parallel(nodes, processes, firsts,
+                                                    seconds)
+                    self.__graph.set_edges(firsts, seconds)
+                self.__finish_graph()
+        else:
+            self.build_visibility()
         return True
     
-    def __visibility_test(self, node_a, node_b):
-        """Performs a simple direct visibility test between two points, in an
-        unoptimized fashion"""
-        # Todo: ensure visibility checks cannot go through polygons (facepalm)
-        direct_line = geometry.Line(node_a, node_b)
+    def build_visibility(self, deadline=None, steps=None):
+        """Works on the visibility graph, as ``precalculate_visibility`` does
+        in a single process, until it is done, or ``time.time()`` reaches
+        ``deadline``, or ``steps`` steps of it have been taken, if either is
+        given. A step decides up to ``build_step`` pairs of nodes. Each call
+        carries on where the last one stopped, unless a polygon has been
+        added or removed in the meantime, which starts it over. Returns the
+        number of steps taken; ``precalculated`` is True once the graph is
+        done. This lets a caller with a budget, such as an ``anytime.Search``,
+        spread the work over many calls."""
+        if self.__precalculated: return 0
+        if self.__building is None or self.__building[0] != self.__revision:
+            budgeted = deadline is not None or steps is not None
+            self.__building = (self.__revision, self.__build_steps(
+                self.build_step if budgeted else None))
+        work = self.__building[1]
+        done = 0
+        with profiling.phase(self.stats, "precalculate_visibility"):
+            while steps is None or done < steps:
+                if deadline is not None and time.time() >= deadline:
+                    break
+                if next(work, None) is None:
+                    break
+                done += 1
+        return done
+    
+    def __build_steps(self, size):
+        """Builds the visibility graph, yielding True after deciding each
+        ``size`` pairs of nodes, or each row of pairs if ``size`` is None, so
+        that ``build_visibility`` can stop in between. Row ``i`` holds the
+        pairs of the ``i``th node and each later node."""
+        nodes = self.__start_graph()
+        firsts, seconds = array("i"), array("i")
+        index = self.get_index()
+        if self.engine == "sweep" and not sweep.has_crossings(index):
+            pairs = sweep.visibility(nodes, index.lines.values(),
+                                     self.__diagonals, stats=self.stats)
+            count, row = 0, 0
+            for i, k, blocker in pairs:
+                if blocker is None:
+                    firsts.append(i)
+                    seconds.append(k)
+                else:
+                    self.__record(i, k, self.__owners[blocker][0])
+                count += 1
+                if count == size or (size is None and i != row):
+                    count, row = 0, i
+                    yield True
+        else:
+            for i in xrange(len(nodes)):
+                others = nodes[i + 1:]
+                step = size or max(1, len(others))
+                for start in xrange(0, len(others), step):
+                    blockers = self.__find_blockers(
+                        nodes[i], others[start:start + step])
+                    first = i + 1 + start
+                    for k in xrange(len(blockers)):
+                        if blockers[k] is None:
+                            firsts.append(i)
+                            seconds.append(first + k)
+                        else:
+                            self.__record(i, first + k, blockers[k])
+                    yield True
+        self.__graph.set_edges(firsts, seconds)
+        self.__finish_graph()
+    
+    def __start_graph(self):
+        """Sets up a new visibility graph, with no edges, over the board's
+        nodes, which it returns in the order of their indexes."""
+        self.__blocking = {}
+        self.__uses = {}
         for p in self.polygons:
-            for l in p.lines:
-                if l.does_intersect(direct_line, False):
-                    return False
-            for l in p.triangle_lines:
-                if l.does_intersect(direct_line, False):
+            for i in set(p.nodes):
+                self.__uses[i] = self.__uses.get(i, 0) + 1
+        # sorted, as each pair is tested from the lesser node to the greater
+        nodes = sorted(self.__uses, key=lambda i: (i.x, i.y))
+        self.__graph = graph.VisibilityGraph(nodes)
+        return nodes
+    
+    def __finish_graph(self):
+        self.__building = None
+        self.__precalculated = True
+        self.__lazy_blockers = {} # the graph has all of these now
+    
+    def get_precalculated(self):
+        return self.__precalculated
+    
+    precalculated = property(get_precalculated,
+                             doc="""True once the visibility graph of this
+                             ``Board`` has been calculated""")
+    
+    def __precalculate_in_parallel(self, nodes, processes, firsts, seconds):
+        """Does the work of ``precalculate_visibility`` in a pool of
+        ``processes`` worker processes. Each worker is sent the polygons once,
+        along with their triangulations, and then decides whole rows of pairs,
+        where row ``i`` holds the pairs of ``nodes[i]`` and each later node.
+        The visible pairs are added to ``firsts`` and ``seconds``, and the
+        blocked ones are recorded."""
+        polygons = list(self.polygons)
+        shapes = []
+        for p in polygons:
+            position = dict((p.nodes[i], i) for i in xrange(len(p.nodes)))
+            shapes.append(([(i.x, i.y) for i in p.nodes],
+                           [[position[i] for i in t.nodes]
+                            for t in p.triangles]))
+        engine = self.engine
+        if engine == "sweep" and sweep.has_crossings(self.get_index()):
+            engine = "pairwise"
+        # many more chunks than processes, each with rows from all over, so
+        # that the chunks take about as long as each other, and every process
+        # is kept busy until the end
+        count = min(len(nodes), 8 * processes)
+        chunks = [range(j, len(nodes), count) for j in xrange(count)]
+        pool = multiprocessing.Pool(processes, _start_worker, (shapes, engine))
+        try:
+            for rows in pool.imap_unordered(_decide_rows, chunks):
+                for i, row in rows:
+                    for t in xrange(len(row)):
+                        if row[t] < 0:
+                            firsts.append(i)
+                            seconds.append(i + 1 + t)
+                        else:
+                            self.__record(i, i + 1 + t, polygons[row[t]])
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    
+    def get_reduced_graph(self):
+        """Returns a ``graph.VisibilityGraph`` holding only the edges of the
+        board's visibility graph that a shortest path can follow. A shortest
+        path only ever bends around convex corners of the polygons, so the
+        reflex nodes are left out, and it only follows edges which are tangent
+        to the polygons at both ends, with both of the polygon's neighbors of
+        each end on the same side of the edge. The nodes have the same indexes
+        as in the full graph. The reduced graph is built when it is first
+        needed, and again after a polygon is added or removed."""
+        return self.__get_reduced()
+    
+    reduced_graph = property(get_reduced_graph,
+                             doc="""The ``graph.VisibilityGraph`` of the edges
+                             of this ``Board``'s visibility graph that can be
+                             part of a shortest path""")
+    
+    def __get_reduced(self):
+        """Returns the reduced graph, building it first if need be."""
+        self.precalculate_visibility()
+        if self.__reduced is None:
+            g = self.__graph
+            firsts, seconds = array("i"), array("i")
+            for i in g.indexes():
+                if not self.__can_bend(g.nodes[i]): continue
+                for k in g.neighbors(i):
+                    if k > i and self.__can_bend(g.nodes[i], g.nodes[k]) and \
+                       self.__can_bend(g.nodes[k], g.nodes[i]):
+                        firsts.append(i)
+                        seconds.append(k)
+            self.__reduced = graph.VisibilityGraph()
+            self.__reduced.load(g.nodes, array("l", [0]) * (len(g.nodes) + 1),
+                                array("i"))
+            self.__reduced.set_edges(firsts, seconds)
+        return self.__reduced
+    
+    def __get_corners(self):
+        """Returns a tuple of a dictionary mapping each node of the board to a
+        list of the pairs of its neighbors in each polygon, and the set of the
+        nodes that are reflex corners of a polygon."""
+        if self.__corners is None:
+            corners = {}
+            reflex = set()
+            for p in self.polygons:
+                nodes = p.nodes
+                area = sum([nodes[i - 1].x * nodes[i].y -
+                            nodes[i].x * nodes[i - 1].y
+                            for i in xrange(len(nodes))])
+                for i in xrange(len(nodes)):
+                    a, b = nodes[i - 1], nodes[(i + 1) % len(nodes)]
+                    corners.setdefault(nodes[i], []).append((a, b))
+                    if sweep.orientation(a, nodes[i], b) * area < 0:
+                        reflex.add(nodes[i])
+            self.__corners = (corners, reflex)
+        return self.__corners
+    
+    def __can_bend(self, pov, other=None):
+        """Returns True if a shortest path could bend at ``pov``, on its way to
+        or from ``other``, if given. It can't if ``pov`` is a reflex corner of
+        a polygon, or if the line from ``pov`` to ``other`` isn't tangent to
+        every polygon that ``pov`` is a corner of."""
+        corners, reflex = self.__get_corners()
+        if pov in reflex:
+            return False
+        if other is not None:
+            for a, b in corners.get(pov, ()):
+                if sweep.orientation(pov, other, a) * \
+                   sweep.orientation(pov, other, b) < 0:
                     return False
-            if direct_line in p.triangle_lines: return False
-        return True # survived all the tests
+        return True
+    
+    def get_navmesh(self):
+        """Returns a ``navmesh.NavMesh`` of the free space on this ``Board``,
+        reaching ``navmesh_margin`` past the polygons on every side, or None
+        if there are no polygons. It is built when it is first needed, and
+        again after a polygon is added or removed."""
+        if self.__navmesh is None and self.polygons:
+            bounds = [p.bounds for p in self.polygons]
+            margin = self.navmesh_margin
+            with profiling.phase(self.stats, "build_navmesh"):
+                self.__navmesh = navmesh.NavMesh(self.polygons, (
+                    min([b[0] for b in bounds]) - margin,
+                    min([b[1] for b in bounds]) - margin,
+                    max([b[2] for b in bounds]) + margin,
+                    max([b[3] for b in bounds]) + margin))
+        return self.__navmesh
+    
+    navmesh = property(get_navmesh,
+                       doc="""The ``navmesh.NavMesh`` of the free space on this
+                       ``Board``""")
+    
+    def get_hierarchy(self):
+        """Returns the board's ``hierarchy.Hierarchy`` of regions with a side
+        of ``region_size``, making it first if need be. It is kept up to date
+        as polygons are added and removed."""
+        h = self.__hierarchy
+        if h is None or h.region_size != self.region_size:
+            self.__hierarchy = hierarchy.Hierarchy(self, self.region_size)
+        return self.__hierarchy
+    
+    hierarchy = property(get_hierarchy,
+                         doc="""The ``hierarchy.Hierarchy`` of regions on this
+                         ``Board``""")
+    
+    def get_graph(self):
+        """Returns the board's ``graph.VisibilityGraph``, calculating it first
+        if need be."""
+        self.precalculate_visibility()
+        return self.__graph
+    
+    graph = property(get_graph,
+                     doc="""The ``graph.VisibilityGraph`` of every node on this
+                     ``Board``""")
+    
+    def freeze(self):
+        """Returns a snapshot of this board as it is now: a new ``Board`` with
+        its own copy of the visibility graph, which can't be changed. Its
+        visibility graph, spatial index, and everything else that a board
+        otherwise builds when first needed, are built up front, so answering
+        a query never changes it. That makes it safe for any number of threads
+        to call its ``get_shortest_path``, ``get_shortest_paths``,
+        ``get_distance_matrix``, ``is_visible``, ``get_visible_set``,
+        ``get_links`` and ``locate`` at once, while this board goes on being
+        changed. The snapshot doesn't use a path cache, the ``lazy``,
+        ``mesh`` or ``region_size`` modes, or ``stats``, and these shouldn't
+        be turned on for it, as they all change the board as it is used."""
+        self.precalculate_visibility()
+        snapshot = Board(self.engine, reduced=self.reduced)
+        for p in self.polygons:
+            snapshot.add(p)
+        snapshot.__graph = self.__graph.copy()
+        snapshot.__uses = dict(self.__uses)
+        snapshot.__blocking = dict(
+            (p, [array("i", pairs[0]), array("i", pairs[1]), pairs[2]])
+            for p, pairs in self.__blocking.items())
+        snapshot.__revision = self.__revision
+        snapshot.__precalculated = True
+        snapshot.get_index()
+        snapshot.__get_locator()
+        snapshot.__get_corners()
+        if vectorized.available:
+            snapshot.__get_segment_array()
+        if snapshot.reduced:
+            snapshot.__get_reduced()
+        snapshot.__frozen = True
+        return snapshot
+    
+    def get_frozen(self):
+        return self.__frozen
+    
+    frozen = property(get_frozen,
+                      doc="""True if this ``Board`` can't be changed, as it is a
+                      snapshot made by ``freeze``, or a board shared by
+                      ``get_expanded``""")
+    
+    def save(self, path):
+        """Saves this board, with its visibility graph, to the file at
+        ``path``, in the format of the ``storage`` module. The graph is
+        calculated first if need be. Use ``Board.load`` to load it again."""
+        self.precalculate_visibility()
+        g = self.__graph
+        blocking = {}
+        for p, pairs in self.__blocking.items():
+            blocking[p] = sorted((i, k) for i, k in set(zip(*pairs[:2]))
+                                 if g.nodes[i] is not None and
+                                    g.nodes[k] is not None)
+        storage.write(path, self.polygons, g, blocking, self.engine)
+    
+    def load(path, polygons=None, engine="pairwise"):
+        """Loads a board saved with ``save`` from the file at ``path``, without
+        triangulating its polygons or calculating its visibility graph again.
+        If ``polygons`` is given, it should be the polygons the board is meant
+        to hold, either as ``Polygon``s or as sequences of ``(x, y)`` points.
+        The board holds those very ``Polygon``s, whether the file is used or
+        not, so they can be removed from it later. Should the file be missing,
+        unreadable, or built from other polygons, a board is built from
+        ``polygons`` with the given ``engine`` and saved to ``path`` in its
+        place."""
+        if polygons is not None:
+            polygons = list(polygons)
+            try:
+                if storage.read_hash(path) == storage.content_hash(polygons):
+                    return Board.__read(path, polygons)
+            except Exception:
+                pass # missing, stale, or broken, so rebuild it
+            board = Board(engine)
+            board.add_all(polygons)
+            board.save(path)
+            return board
+        return Board.__read(path)
+    
+    load = staticmethod(load)
+    
+    def __read(path, given=()):
+        """Does the work of ``load`` for a file that is to be used, putting
+        the ``Polygon``s among ``given`` on the board in place of the saved
+        polygons with the same points."""
+        saved, g, blocking, engine = storage.read(path)
+        same = {} # points -> the given polygons with them
+        for p in given:
+            if isinstance(p, geometry.Polygon):
+                same.setdefault(_points(p), []).append(p)
+        for i in xrange(len(saved)):
+            matches = same.get(_points(saved[i]))
+            if matches:
+                p = matches.pop()
+                if saved[i] in blocking:
+                    blocking[p] = blocking.pop(saved[i])
+                saved[i] = p
+        board = Board(engine)
+        for p in saved:
+            board.add(p)
+        for p in saved:
+            for i in set(p.nodes):
+                board.__uses[i] = board.__uses.get(i, 0) + 1
+        board.__graph = g
+        for p, pairs in blocking.items():
+            board.__blocking[p] = [array("i", [i for i, k in pairs]),
+                                   array("i", [k for i, k in pairs]),
+                                   max(64, len(pairs))]
+        board.__precalculated = True
+        return board
+    
+    __read = staticmethod(__read)
+    
+    def __record(self, i, k, blocker):
+        """Records the result of a visibility test between the nodes with
+        indexes ``i`` and ``k`` in the visibility graph. ``blocker`` is a
+        polygon blocking the two nodes from each other, or None if they are
+        visible."""
+        if blocker is None:
+            self.__graph.add_edge(i, k)
+            return
+        if i > k:
+            i, k = k, i
+        pairs = self.__blocking.get(blocker)
+        if pairs is None:
+            pairs = self.__blocking[blocker] = [array("i"), array("i"), 64]
+        pairs[0].append(i)
+        pairs[1].append(k)
+        if len(pairs[0]) > 2 * pairs[2]:
+            # drop any duplicates, which pile up as nodes come and go
+            unique = sorted(set(zip(pairs[0], pairs[1])))
+            pairs[0] = array("i", [i for i, k in unique])
+            pairs[1] = array("i", [k for i, k in unique])
+            pairs[2] = len(unique)
+    
+    def __add_visibility(self, poly):
+        """Updates the visibility graph for a newly added polygon, ``poly``."""
+        g = self.__graph
+        # find the existing edges which now pass through poly
+        segments = poly.lines + list(poly.triangle_lines)
+        min_x = min([i.x for i in poly.nodes])
+        max_x = max([i.x for i in poly.nodes])
+        min_y = min([i.y for i in poly.nodes])
+        max_y = max([i.y for i in poly.nodes])
+        xy = g.coordinates
+        for i in g.indexes():
+            for k in g.neighbors(i):
+                if k < i or max(xy[2 * i], xy[2 * k]) < min_x or \
+                   min(xy[2 * i], xy[2 * k]) > max_x or \
+                   max(xy[2 * i + 1], xy[2 * k + 1]) < min_y or \
+                   min(xy[2 * i + 1], xy[2 * k + 1]) > max_y:
+                    continue
+                a, b = g.nodes[i], g.nodes[k]
+                if (b.x, b.y) < (a.x, a.y):
+                    a, b = b, a
+                direct_line = geometry.Line(a, b)
+                if direct_line in poly.triangle_lines or \
+                   self.__crosses(segments, direct_line):
+                    g.remove_edge(i, k)
+                    self.__record(i, k, poly)
+        # connect the new nodes to the rest of the board
+        for i in set(poly.nodes):
+            self.__uses[i] = self.__uses.get(i, 0) + 1
+            if self.__uses[i] > 1:
+                continue
+            others = [k for k in g.indexes()]
+            i = g.add_node(i)
+            blockers = self.__find_blockers(g.nodes[i],
+                                            [g.nodes[k] for k in others])
+            for k, blocker in zip(others, blockers):
+                self.__record(i, k, blocker)
+    
+    def __remove_visibility(self, poly):
+        """Updates the visibility graph for a polygon, ``poly``, that has just
+        been removed."""
+        g = self.__graph
+        # forget the nodes that are no longer on the board
+        for i in set(poly.nodes):
+            self.__uses[i] -= 1
+            if not self.__uses[i]:
+                del self.__uses[i]
+                g.remove_node(g.index[i])
+        # the pairs poly was blocking may now be visible
+        pairs = self.__blocking.pop(poly, None)
+        if pairs is None: return
+        for i, k in set(zip(pairs[0], pairs[1])):
+            a, b = g.nodes[i], g.nodes[k]
+            if a is not None and b is not None:
+                self.__record(i, k, self.__find_blocker(a, b))
+    
+    def __find_blocker(self, node_a, node_b):
+        """Performs a direct visibility test between two points, returning a
+        polygon which blocks them from each other, or None if they are visible.
+        Only the segments that the board's spatial index reports as being near
+        the direct line are tested."""
+        # ``does_intersect`` can give a different answer in edge cases (such as
+        # the line passing right through a vertex) depending on the direction
+        # of the line, so always test in the same direction
+        if (node_b.x, node_b.y) < (node_a.x, node_a.y):
+            node_a, node_b = node_b, node_a
+        direct_line = geometry.Line(node_a, node_b)
+        if direct_line in self.__diagonals:
+            return self.__diagonals[direct_line][0]
+        index = self.get_index()
+        candidates = index.candidates(direct_line)
+        if vectorized.available and len(candidates) >= VECTORIZE_THRESHOLD:
+            segments, positions, owners = self.__get_segment_array()
+            if self.stats is not None:
+                self.stats.count("vectorized_tests", len(candidates))
+            i = segments.find_blockers((node_a,), (node_b,), False,
+                                       [positions[k] for k in candidates])[0]
+            return owners[i] if i >= 0 else None
+        tests, blocker = 0, None
+        for key in candidates:
+            tests += 1
+            if index.lines[key].does_intersect(direct_line, False):
+                blocker = index.owners[key]
+                break
+        if self.stats is not None:
+            self.stats.count("does_intersect", tests)
+        return blocker
+    
+    def __crosses(self, segments, line):
+        """Returns True if ``line`` crosses any of ``segments``, other than at
+        their ends."""
+        tests, found = 0, False
+        for l in segments:
+            tests += 1
+            if l.does_intersect(line, False):
+                found = True
+                break
+        if self.stats is not None:
+            self.stats.count("does_intersect", tests)
+        return found
+    
+    def __find_blockers(self, pov, others):
+        """Performs a direct visibility test between ``pov`` and each of the
+        nodes in ``others``, returning a list with a polygon blocking each one,
+        or None if it is visible. When NumPy is available, each line is tested
+        against the segments that the spatial index reports near it, and all
+        of those tests are done at once."""
+        if not vectorized.available or not others:
+            return [self.__find_blocker(pov, i) for i in others]
+        segments, positions, owners = self.__get_segment_array()
+        index = self.get_index()
+        # always test in the same direction, as ``__find_blocker`` does
+        starts, ends, candidates = [], [], []
+        for i in others:
+            a, b = (i, pov) if (i.x, i.y) < (pov.x, pov.y) else (pov, i)
+            starts.append(a)
+            ends.append(b)
+            candidates.append([positions[k] for k in
+                               index.candidates(geometry.Line(a, b))])
+        if self.stats is not None:
+            self.stats.count("vectorized_tests",
+                             sum([len(i) for i in candidates]))
+        found = segments.find_blockers_among(starts, ends, candidates, False)
+        blockers = [owners[i] if i >= 0 else None for i in found]
+        diagonals = self.__diagonal_ends.get(pov)
+        if diagonals:
+            across = dict((other, polys[0]) for other, polys in diagonals)
+            for i in xrange(len(others)):
+                if others[i] in across: blockers[i] = across[others[i]]
+        return blockers
+    
+    def __get_segment_array(self):
+        """Returns a ``vectorized.SegmentArray`` of every segment in the index,
+        along with a dictionary mapping each segment's key in the index to its
+        position in the array, and a list of each segment's owner."""
+        if self.__segment_array is None:
+            index = self.get_index()
+            keys = list(index.lines)
+            self.__segment_array = (
+                vectorized.SegmentArray([index.lines[k] for k in keys]),
+                dict((keys[i], i) for i in xrange(len(keys))),
+                [index.owners[k] for k in keys])
+        return self.__segment_array
+    
+    def __visibility_test(self, node_a, node_b):
+        """Performs a direct visibility test between two points"""
+        return self.__find_blocker(node_a, node_b) is None
+    
+    def get_blockers(self, pov, others):
+        """Performs a direct visibility test between ``pov`` and each of the
+        nodes in ``others``, without using the visibility graph. Returns a
+        list with a polygon blocking each one from ``pov``, or None where it is
+        visible."""
+        return self.__find_blockers(pov, list(others))
     
     def is_visible(self, node_a, node_b):
         if self.__precalculated:
-            if node_a in node_b.visible_siblings:
-                return True
-            if node_a in self.nodes and node_b in self.nodes:
-                # must have been determined to be nonvisible
-                return False
+            index = self.__graph.index
+            if node_a in index and node_b in index:
+                if self.stats is not None:
+                    self.stats.count("visibility_cache_hits")
+                return self.__graph.has_edge(index[node_a], index[node_b])
         # when all else fails...
-        return self.__visibility_test(node_a, node_b)
+        if self.stats is None:
+            return self.__visibility_test(node_a, node_b)
+        self.stats.count("visibility_cache_misses")
+        with self.stats.phase("visibility_test"):
+            return self.__visibility_test(node_a, node_b)
     
     def get_visible_set(self, pov, *args):
         """Returns a set of nodes that are visible to the first argument. The
         nodes checked are the map's internal set of nodes, as well as any nodes
         given after the first argument."""
-        visible_set = self.get_visible_set_for(pov, *args)
-        for i in self.nodes:
-            if self.is_visible(pov, i) and pov != i: visible_set.add(i)
-        return visible_set
+        return self.get_visible_set_for(pov, *(list(self.nodes) + list(args)))
     
     def get_visible_set_for(self, pov, *args):
         """Returns a set of nodes that are visible to the first argument. The
         nodes checked are only the nodes given after the first argument."""
-        visible_set = set()
-        for i in args:
-            if self.is_visible(pov, i) and pov != i: visible_set.add(i)
-        return visible_set
+        args = [i for i in args if pov != i]
+        if self.__precalculated and pov in self.__graph.index:
+            return set(i for i in args if self.is_visible(pov, i))
+        with profiling.phase(self.stats, "visibility_test"):
+            blockers = self.__find_blockers(pov, args)
+        return set(i for i, blocker in zip(args, blockers) if blocker is None)
        
+    def get_links(self, pov):
+        """Returns the set of the board's nodes that are visible from ``pov``,
+        which doesn't need to be one of the board's nodes. Nodes of the board
+        are looked up in the visibility graph, while any other point is tested
+        against every node of the board."""
+        g = self.get_graph()
+        return set(g.nodes[i] for i in self.__links(pov))
+    
+    def __links(self, pov):
+        """Returns a list of the indexes of the board's nodes that are visible
+        from ``pov``."""
+        g = self.__graph
+        if pov in g.index:
+            return g.neighbors(g.index[pov])
+        others = g.indexes()
+        with profiling.phase(self.stats, "links"):
+            blockers = self.__find_blockers(pov, [g.nodes[i] for i in others])
+        return [others[i] for i in xrange(len(others)) if blockers[i] is None]
+    
     def get_shortest_path(self, node_a, node_b):
+        """Finds the shortest path from ``node_a`` to ``node_b`` with an A*
+        search over the visibility graph, using the straight-line distance to
+        ``node_b`` as the heuristic. Only ``node_a`` and ``node_b`` need to be
+        connected to the graph for each search; every other edge comes from
+        the cached graph. Returns the list of nodes to travel through, ending
+        with ``node_b`` and not including ``node_a``, or None if there is no
+        path. If the board was made with a ``path_cache_size``, the result may
+        come from the path cache."""
+        if self.path_cache_size <= 0:
+            return self.__find_shortest_path(node_a, node_b)
+        key = (self.__revision,) + self.__snap(node_a) + self.__snap(node_b)
+        cache = self.__path_cache
+        if key in cache:
+            ends, path = cache.pop(key)
+            cache[key] = ends, path
+            if ends == (node_a, node_b):
+                self.__path_cache_hits += 1
+                return None if path is None else list(path)
+            if path is not None and self.__can_reuse(node_a, node_b, path):
+                self.__path_cache_hits += 1
+                return path[:-1] + [node_b]
+        self.__path_cache_misses += 1
+        path = self.__find_shortest_path(node_a, node_b)
+        cache.pop(key, None)
+        while len(cache) >= self.path_cache_size:
+            cache.popitem(last=False) # the least recently used
+        cache[key] = (node_a, node_b), path
+        if path is None: return None
+        return list(path)
+    
+    def __can_reuse(self, node_a, node_b, path):
+        """Returns True if ``path``, found between two other endpoints, can
+        be used from ``node_a`` to ``node_b`` once its last node is replaced:
+        that is, if ``node_a`` can see its first node, and its second to last
+        node can see ``node_b``. If the path has a single step, ``node_a``
+        must see ``node_b``."""
+        nodes = [node_a] + path[:-1] + [node_b]
+        for a, b in ((nodes[0], nodes[1]), (nodes[-2], nodes[-1])):
+            if a != b and not self.is_visible(a, b):
+                return False
+        return True
+    
+    def get_anytime_path(self, node_a, node_b, seconds=None, expansions=None):
+        """Finds a path from ``node_a`` to ``node_b`` within a budget of
+        ``seconds``, or of ``expansions`` of the search, with an
+        ``anytime.Search``. Returns the best path found so far, in the same
+        form that ``get_shortest_path`` returns, or None if none has been found
+        yet, along with how many times longer than the shortest path it could
+        be. The board keeps the search, so calling this again for the same
+        two nodes carries on from where the last call stopped, and the path
+        keeps getting closer to the shortest one, which it reaches once the
+        bound is 1. If the visibility graph hasn't been built yet, building
+        it is part of the work, and is spread over as many calls as it
+        takes."""
+        search = self.__anytime
+        if search is None or search.start != node_a or search.goal != node_b:
+            search = self.__anytime = anytime.Search(self, node_a, node_b)
+        path = search.improve(seconds, expansions)
+        return path, search.bound
+    
+    def __snap(self, point):
+        """Returns the part of a path cache key for an endpoint, ``point``."""
+        if self.snap > 0:
+            return (math.floor(point.x / self.snap),
+                    math.floor(point.y / self.snap))
+        return (point.x, point.y)
+    
+    def __find_shortest_path(self, node_a, node_b):
+        """Does the work of ``get_shortest_path``, without the path cache."""
+        if self.mesh:
+            if node_a == node_b: return [node_a]
+            if not self.polygons: return [node_b]
+            with profiling.phase(self.stats, "navmesh_search"):
+                return self.get_navmesh().get_shortest_path(node_a, node_b)
+        if self.region_size > 0:
+            with profiling.phase(self.stats, "hierarchy_search"):
+                return self.get_hierarchy().get_shortest_path(node_a, node_b)
+        if self.lazy and not self.__precalculated:
+            return self.__find_lazy_path(node_a, node_b)
         self.precalculate_visibility()
         
         # Handle special/common cases
         if node_a == node_b: return [node_a]
         if self.is_visible(node_a, node_b): return [node_b] # direct is shortest
         
-        # Format: shortest_to[node] = (goes_though, cost, is_minimum)
-        shortest_to = {node_b:None}
-        for i in self.nodes:
-            shortest_to[i] = None
-        starting_from = node_a
-        starting_from_cost = 0
-        while True:
-            # find possible paths
-            improvable = set()
-            for k in shortest_to:
-                if shortest_to[k] == None or not shortest_to[k][2]:
-                    improvable.add(k)
-            improvable &= self.get_visible_set(starting_from, node_b)
-            if not improvable: # nothing else we can do
-                return None
-            # see if there is a shorter path for any of these via starting_from
-            lowest_cost = None
-            lowest_cost_node = None
-            for i in improvable:
-                cost = starting_from_cost + starting_from.dist(i)
-                if not lowest_cost or cost < lowest_cost:
-                    lowest_cost = cost
-                    lowest_cost_node = i
-                if not shortest_to[i] or cost < shortest_to[i][1]:
-                    shortest_to[i] = (starting_from, cost, False)
-            lowest_cost_info = list(shortest_to[lowest_cost_node])
-            lowest_cost_info[2] = True
-            shortest_to[lowest_cost_node] = tuple(lowest_cost_info)
-            if lowest_cost_node == node_b: # we're done! wrap it up.
-                path = []
-                n = node_b
-                while n != node_a:
-                    path[:0] = [n]
-                    n = shortest_to[n][0]
-                return path
-            starting_from = lowest_cost_node
-            starting_from_cost = lowest_cost
+        if self.stats is not None:
+            self.stats.count("searches")
+        goals = [node_b]
+        came_from = self.__expand(node_a, self.__links(node_a), goals,
+                                  [self.__links(node_b)], node_b)[1]
+        return self.__trace(came_from, node_a, goals, 0)
+    
+    def __find_lazy_path(self, node_a, node_b):
+        """Does the work of ``get_shortest_path`` for a ``lazy`` board. This is
+        an A* search over every edge that could be part of a shortest path,
+        between ``node_a``, ``node_b`` and the convex corners of the polygons,
+        as if every one of them were clear. An edge is only tested for
+        line-of-sight once the search reaches its far end along it, which is
+        when it would join the best path found so far. If it is blocked, the
+        search carries on without it. The results of testing pairs of the
+        board's nodes are kept for later searches."""
+        if node_a == node_b: return [node_a]
+        candidates = [i for i in self.__get_corners()[0]
+                      if i != node_a and i != node_b and self.__can_bend(i)]
+        candidates.append(node_b)
+        came_from = {}
+        heap = [(node_a.dist(node_b), 0, 0., node_a, None)]
+        pushes = expanded = 0
+        with profiling.phase(self.stats, "search"):
+            while heap:
+                cost, n, parent = heapq.heappop(heap)[2:]
+                if n in came_from: continue
+                if parent is not None and not self.__lazy_visible(parent, n):
+                    continue
+                came_from[n] = parent
+                expanded += 1
+                if n is node_b: break
+                for i in candidates:
+                    if i in came_from: continue
+                    if (n is node_a or self.__can_bend(n, i)) and \
+                       (i is node_b or self.__can_bend(i, n)):
+                        pushes += 1
+                        estimate = cost + n.dist(i)
+                        heapq.heappush(heap, (estimate + i.dist(node_b),
+                                              pushes, estimate, i, n))
+        if self.stats is not None:
+            self.stats.count("searches")
+            self.stats.count("nodes_expanded", expanded)
+            self.stats.count("nodes_relaxed", pushes)
+        if node_b not in came_from: return None
+        path = []
+        n = node_b
+        while n is not node_a:
+            path.append(n)
+            n = came_from[n]
+        path.reverse()
+        return path
+    
+    def __lazy_visible(self, node_a, node_b):
+        """Returns True if ``node_a`` and ``node_b`` are visible to each other,
+        reusing the result of an earlier test of the pair if they are both
+        nodes of the board."""
+        corners = self.__get_corners()[0]
+        if node_a not in corners or node_b not in corners:
+            return self.__visibility_test(node_a, node_b)
+        if (node_b.x, node_b.y) < (node_a.x, node_a.y):
+            node_a, node_b = node_b, node_a
+        pair = (node_a, node_b)
+        if pair in self.__lazy_blockers:
+            return self.__lazy_blockers[pair] is None
+        if self.stats is not None:
+            self.stats.count("lazy_tests")
+        blocker = self.__lazy_blockers[pair] = \
+            self.__find_blocker(node_a, node_b)
+        return blocker is None
+    
+    def __add_lazy_blocker(self, poly):
+        """Records a newly added polygon, ``poly``, as the blocker of each pair
+        of nodes kept by the lazy searches that it blocks."""
+        segments = poly.lines + list(poly.triangle_lines)
+        min_x, min_y, max_x, max_y = poly.bounds
+        blockers = self.__lazy_blockers
+        for pair, blocker in blockers.items():
+            a, b = pair
+            if blocker is not None or max(a.x, b.x) < min_x or \
+               min(a.x, b.x) > max_x or max(a.y, b.y) < min_y or \
+               min(a.y, b.y) > max_y:
+                continue
+            direct_line = geometry.Line(a, b)
+            if direct_line in poly.triangle_lines or \
+               self.__crosses(segments, direct_line):
+                blockers[pair] = poly
+    
+    def get_path_cache_stats(self):
+        return {"hits":self.__path_cache_hits,
+                "misses":self.__path_cache_misses,
+                "size":len(self.__path_cache)}
+    
+    path_cache_stats = property(get_path_cache_stats,
+                                doc="""A dictionary with the number of
+                                ``"hits"`` and ``"misses"`` of the path cache
+                                so far, and its current ``"size"``""")
+    
+    def clear_path_cache(self):
+        """Empties the path cache, and resets its statistics."""
+        self.__path_cache.clear()
+        self.__path_cache_hits = self.__path_cache_misses = 0
+    
+    def get_shortest_paths(self, source, targets):
+        """Finds the shortest path from ``source`` to each of ``targets`` with a
+        single search, which grows a tree of shortest paths out from
+        ``source`` until it has reached every target. Returns a dictionary
+        mapping each target to its path, in the same form that
+        ``get_shortest_path`` returns."""
+        self.precalculate_visibility()
+        goals = list(set(targets))
+        source_links = self.__links(source) + \
+                       self.__visible_goals(source, goals)
+        came_from = self.__expand(source, source_links, goals,
+                                  [self.__links(i) for i in goals])[1]
+        return dict((goals[j], self.__trace(came_from, source, goals, j))
+                    for j in xrange(len(goals)))
+    
+    def get_distance_matrix(self, sources, targets):
+        """Finds the length of the shortest path from each of ``sources`` to
+        each of ``targets``. The nodes visible from every query point are found
+        once, up front, and then a single search is made from each source.
+        Returns a list with a row for each source, each of which has the
+        distance to each target, in order. Targets that can't be reached from
+        a source are an infinite distance from it."""
+        self.precalculate_visibility()
+        sources, goals = list(sources), list(targets)
+        links = {}
+        for i in sources + goals:
+            if i not in links:
+                links[i] = self.__links(i)
+        goal_links = [links[i] for i in goals]
+        matrix = []
+        for source in sources:
+            source_links = links[source] + \
+                           self.__visible_goals(source, goals)
+            cost_to = self.__expand(source, source_links, goals,
+                                    goal_links)[0]
+            row = []
+            for j in xrange(len(goals)):
+                if goals[j] == source:
+                    row.append(0.)
+                else:
+                    row.append(cost_to.get(self.__goal_id(goals, j),
+                                           float("inf")))
+            matrix.append(row)
+        return matrix
+    
+    def __visible_goals(self, source, goals):
+        """Returns the ids of the goals that ``source`` can travel to directly
+        and that aren't nodes of the board, which ``__links`` finds already."""
+        return [-2 - j for j in xrange(len(goals))
+                if self.__goal_id(goals, j) < 0 and goals[j] != source and
+                   self.is_visible(source, goals[j])]
+    
+    def __goal_id(self, goals, j):
+        """Returns the id that ``__expand`` knows ``goals[j]`` by: its index,
+        if it is one of the board's nodes, otherwise ``-2 - j``."""
+        return self.__graph.index.get(goals[j], -2 - j)
+    
+    def __expand(self, source, source_links, goals, goal_links, heading=None):
+        """Searches outwards from ``source`` over the visibility graph until
+        every goal has been reached, or there is nowhere left to go. The search
+        knows each of the board's nodes by its index in the graph, ``source``
+        by -1, and ``goals[j]`` by ``-2 - j``, unless it is one of the board's
+        nodes. ``source_links`` is a list of the ids that ``source`` can travel
+        to directly, and ``goal_links[j]`` is a list of the indexes of the
+        board's nodes that can travel directly to ``goals[j]``. If ``heading``
+        is given, the straight-line distance to it is used as a heuristic,
+        making this an A* search, otherwise it is Dijkstra's algorithm. Returns
+        a tuple of the cost to reach each id, and the id each was reached
+        from.
+        
+        If the board is ``reduced``, the search is made over the reduced graph,
+        and only the links tangent to the polygons at the board's end are
+        followed to and from ``source`` and the goals."""
+        g = self.__graph
+        if self.reduced:
+            g = self.__get_reduced()
+            # a goal on the board is kept, as the path can end there without
+            # bending around it
+            ends = set(self.__goal_id(goals, j) for j in xrange(len(goals)))
+            source_links = [i for i in source_links
+                            if i < 0 or i in ends or
+                               self.__can_bend(g.nodes[i], source)]
+            goal_links = [[i for i in goal_links[j]
+                           if self.__can_bend(g.nodes[i], goals[j])]
+                          for j in xrange(len(goals))]
+        xy = g.coordinates
+        points = {} # id -> coordinates, for the ids that aren't on the board
+        arrivals = {} # board node index -> goals that it can travel to
+        remaining = set()
+        for j in xrange(len(goals)):
+            goal = self.__goal_id(goals, j)
+            if goals[j] != source:
+                remaining.add(goal)
+            if goal < 0:
+                points[goal] = (goals[j].x, goals[j].y)
+            if goal < 0 or self.reduced:
+                # the reduced graph may not lead to a goal on the board
+                for i in goal_links[j]:
+                    arrivals.setdefault(i, []).append(goal)
+        start = g.index.get(source, -1)
+        if start < 0:
+            points[start] = (source.x, source.y)
+        came_from = {start:None}
+        cost_to = {start:0.}
+        done = set()
+        heap = [(0., start)]
+        expanded = relaxed = 0
+        with profiling.phase(self.stats, "search"):
+            while heap and remaining:
+                n = heapq.heappop(heap)[1]
+                if n in done: continue
+                done.add(n)
+                expanded += 1
+                remaining.discard(n)
+                if n == start:
+                    links = source_links
+                elif n >= 0:
+                    links = g.neighbors(n)
+                else:
+                    continue # a goal that isn't on the board leads nowhere
+                if n in arrivals:
+                    links = links + arrivals[n]
+                if n >= 0:
+                    x, y = xy[2 * n], xy[2 * n + 1]
+                else:
+                    x, y = points[n]
+                for i in links:
+                    if i in done: continue
+                    if i >= 0:
+                        ix, iy = xy[2 * i], xy[2 * i + 1]
+                    else:
+                        ix, iy = points[i]
+                    cost = cost_to[n] + math.hypot(ix - x, iy - y)
+                    if i not in cost_to or cost < cost_to[i]:
+                        cost_to[i] = cost
+                        relaxed += 1
+                        came_from[i] = n
+                        estimate = cost
+                        if heading is not None:
+                            estimate += math.hypot(ix - heading.x,
+                                                   iy - heading.y)
+                        heapq.heappush(heap, (estimate, i))
+        if self.stats is not None:
+            self.stats.count("nodes_expanded", expanded)
+            self.stats.count("nodes_relaxed", relaxed)
+        return cost_to, came_from
+    
+    def __trace(self, came_from, source, goals, j):
+        """Follows a result of ``__expand`` back from ``goals[j]`` to
+        ``source``, returning the path between them, or None if the goal
+        wasn't reached."""
+        target = goals[j]
+        if target == source: return [source]
+        n = self.__goal_id(goals, j)
+        if n not in came_from: return None
+        path = []
+        while came_from[n] is not None:
+            if n >= 0:
+                path.append(self.__graph.nodes[n])
+            else:
+                path.append(target)
+            n = came_from[n]
+        path.reverse()
+        return path
+
+def _points(poly):
+    """Returns the points of ``poly``, as a tuple of ``(x, y)`` tuples."""
+    return tuple((i.x, i.y) for i in poly.nodes)
+
+def _as_polygon(poly):
+    """Returns ``poly`` if it is a ``Polygon``, or else a ``Polygon`` with the
+    sequence of ``(x, y)`` points ``poly``."""
+    if isinstance(poly, geometry.Polygon):
+        return poly
+    return geometry.Polygon(*[tuple(i) for i in poly])
+
+# the state of a worker process in a parallel build of a visibility graph
+_worker = {}
+
+def _start_worker(shapes, engine):
+    """Sets up a worker process for ``Board.precalculate_visibility``, given
+    each polygon as a list of its points and a list of its triangles, and the
+    visibility engine to use."""
+    polygons = [geometry.Polygon(*points, triangles=triangles)
+                for points, triangles in shapes]
+    board = Board()
+    for p in polygons:
+        board.add(p)
+    owners = {} # polygon or segment -> the position of its polygon in shapes
+    diagonals = set()
+    for i in reversed(xrange(len(polygons))):
+        owners[polygons[i]] = i
+        for l in polygons[i].lines + list(polygons[i].triangle_lines):
+            owners[l] = i
+        diagonals.update(polygons[i].triangle_lines)
+    _worker.update(board=board, engine=engine, owners=owners,
+                   diagonals=diagonals,
+                   nodes=sorted(board.nodes, key=lambda i: (i.x, i.y)))
+
+def _decide_rows(rows):
+    """Decides each of the rows of pairs ``rows`` in a worker process. Returns
+    a list with a tuple for each row ``i``, holding ``i`` and an array with the
+    position of the polygon blocking ``nodes[i]`` from each later node, or -1
+    where the two are visible."""
+    board, nodes = _worker["board"], _worker["nodes"]
+    owners = _worker["owners"]
+    found = dict((i, array("i", [-1]) * (len(nodes) - 1 - i)) for i in rows)
+    if _worker["engine"] == "sweep":
+        pairs = sweep.visibility(nodes, board.get_index().lines.values(),
+                                 _worker["diagonals"], rows)
+        for i, k, blocker in pairs:
+            if blocker is not None:
+                found[i][k - i - 1] = owners[blocker]
+    else:
+        for i in rows:
+            blockers = board.get_blockers(nodes[i], nodes[i + 1:])
+            for t in xrange(len(blockers)):
+                if blockers[t] is not None:
+                    found[i][t] = owners[blockers[t]]
+    return found.items()
@@ -0,0 +1,383 @@
+"""A navigation mesh, for finding paths on very large boards. Rather than
+linking every pair of nodes that can see each other, which grows with the
+square of the number of nodes, the free space between the polygons is cut
+into triangles, and a path is found in two steps. First, an A* search over the
+edges shared by neighboring triangles finds the channel of triangles that the
+path runs through. Then the funnel algorithm pulls a string taut through that
+channel, giving the shortest path through it.
+
+The triangles are found by ear clipping, just like the polygons' own. Each
+polygon is a hole in a box around the board, so each one is joined to the
+box, or to a hole that already is, by a bridge to a node that it can see, as
+in the "earcut" library. That makes a single ring of nodes, with each bridge
+running along it twice, once in each direction, which is then ear clipped.
+
+The mesh is built in close to linear time and space, and finding a path only
+visits the triangles near the channel. The path found is the shortest one
+through its channel, but the channel is chosen from an estimate of the
+distance through each one, so the path can sometimes be a little longer than
+the shortest path over the visibility graph."""
+
+import heapq
+import geometry
+import spatial
+from node import Node
+
+def _turn(a, b, c):
+    """Twice the signed area of the triangle ``a``, ``b``, ``c``, which is
+    positive if ``c`` is to the left of the ray from ``a`` to ``b``."""
+    return (b.x - a.x) * (c.y - a.y) - (b.y - a.y) * (c.x - a.x)
+
+def _area(nodes):
+    """Twice the signed area of a polygon, positive if it runs
+    counter-clockwise."""
+    return sum([nodes[i - 1].x * nodes[i].y - nodes[i].x * nodes[i - 1].y
+                for i in xrange(len(nodes))])
+
+def _in_circle(a, b, c, d):
+    """Returns True if ``d`` is inside of the circle through the corners of the
+    counter-clockwise triangle ``a``, ``b``, ``c``."""
+    ax, ay = a.x - d.x, a.y - d.y
+    bx, by = b.x - d.x, b.y - d.y
+    cx, cy = c.x - d.x, c.y - d.y
+    det = (ax * ax + ay * ay) * (bx * cy - cx * by) - \
+          (bx * bx + by * by) * (ax * cy - cx * ay) + \
+          (cx * cx + cy * cy) * (ax * by - bx * ay)
+    return det > 1e-12 * max(abs(ax), abs(ay), abs(bx), abs(by), abs(cx),
+                             abs(cy)) ** 4
+
+class NavMesh(object):
+    """A triangulation of the free space within ``bounds`` that isn't covered
+    by any of a group of polygons. ``points`` is the list of the mesh's nodes,
+    and ``triangles`` is a list of triples of indexes into it, each running
+    counter-clockwise."""
+
+    def __init__(self, polygons, bounds):
+        """Builds the mesh of the free space in the box ``bounds``, given as
+        ``(min_x, min_y, max_x, max_y)``, around ``polygons``, which must be
+        inside of it. Polygons that overlap are merged first, with
+        ``geometry.merge``, as the holes in the mesh must not overlap."""
+        super(NavMesh, self).__init__()
+        self.bounds = tuple(bounds)
+        ring = self.__bridge(geometry.merge(polygons))
+        try:
+            triangles = geometry.Polygon(*ring).triangles
+        except Exception:
+            raise Exception("The free space can't be triangulated")
+        self.points = []
+        self.triangles = []
+        order = {}
+        for t in triangles:
+            nodes = t.nodes if t.is_ccw else list(reversed(t.nodes))
+            triple = []
+            for n in nodes:
+                if n not in order:
+                    order[n] = len(self.points)
+                    self.points.append(n)
+                triple.append(order[n])
+            self.triangles.append(tuple(triple))
+        sides = self.__make_delaunay()
+        # link the triangles across the edges that they share
+        self.edges = [] # (i, k) for each edge with a triangle on both sides
+        self.sides = [] # the two triangles on either side of each edge
+        self.portals = [[] for t in self.triangles] # (edge, other triangle)
+        for edge, ts in sides.items():
+            if len(ts) == 2:
+                e = len(self.edges)
+                self.edges.append(edge)
+                self.sides.append(tuple(ts))
+                self.portals[ts[0]].append((e, ts[1]))
+                self.portals[ts[1]].append((e, ts[0]))
+        self.__locator = spatial.TriangleGrid(
+            [geometry.Triangle(*[self.points[i] for i in t])
+             for t in self.triangles], owners=range(len(self.triangles)))
+
+    def __make_delaunay(self):
+        """Flips the edges shared by two triangles until every triangle's
+        circumcircle is clear of the nodes across its shared edges, which
+        makes this a constrained Delaunay triangulation. Ear clipping leaves
+        long, thin triangles, which make for poor channels, and this gets rid
+        of most of them. The edges of the polygons and the box are only ever
+        on one triangle, so they are never flipped. Returns a dictionary
+        mapping each edge, as ``(i, k)`` with ``i`` less than ``k``, to the
+        indexes of the triangles on either side of it."""
+        points, triangles = self.points, self.triangles
+        sides = {}
+        for t in xrange(len(triangles)):
+            a, b, c = triangles[t]
+            for i, k in ((a, b), (b, c), (c, a)):
+                sides.setdefault((min(i, k), max(i, k)), []).append(t)
+        stack = [e for e, ts in sides.items() if len(ts) == 2]
+        # a float can't be trusted to settle, so give up after a while
+        budget = 10 * len(triangles)
+        while stack and budget:
+            e = stack.pop()
+            ts = sides.get(e)
+            if ts is None or len(ts) != 2: continue
+            i, k = e
+            t1, t2 = ts
+            if (i, k) not in zip(triangles[t1], triangles[t1][1:] +
+                                 triangles[t1][:1]):
+                t1, t2 = t2, t1
+            # t1 runs i, k, a and t2 runs k, i, b
+            a = [n for n in triangles[t1] if n != i and n != k][0]
+            b = [n for n in triangles[t2] if n != i and n != k][0]
+            pi, pk, pa, pb = points[i], points[k], points[a], points[b]
+            if _turn(pa, pi, pb) <= 0 or _turn(pb, pk, pa) <= 0 or \
+               not _in_circle(pi, pk, pa, pb):
+                continue
+            budget -= 1
+            triangles[t1], triangles[t2] = (a, i, b), (b, k, a)
+            del sides[e]
+            sides[(min(a, b), max(a, b))] = [t1, t2]
+            for edge, old, new in (((i, b), t2, t1), ((k, a), t1, t2)):
+                ts = sides[(min(edge), max(edge))]
+                ts[ts.index(old)] = new
+            stack.extend([(min(i, b), max(i, b)), (min(b, k), max(b, k)),
+                          (min(k, a), max(k, a)), (min(a, i), max(a, i))])
+        return sides
+
+    def __bridge(self, polygons):
+        """Returns the list of nodes in the ring made by bridging each of
+        ``polygons`` to the box around them. The ring runs counter-clockwise,
+        so that the free space is always on its left, and the holes run
+        clockwise. The holes are bridged in order of their leftmost nodes, each
+        to the nearest node of the ring that its leftmost node can see by
+        looking to the left, which makes sure no two bridges cross."""
+        min_x, min_y, max_x, max_y = self.bounds
+        points, nxt, prv = [], [], [] # the ring, as a doubly linked list
+        at = {} # node -> the ids of the ring's copies of it
+        def add(n):
+            points.append(n)
+            nxt.append(None)
+            prv.append(None)
+            at.setdefault(n, []).append(len(points) - 1)
+            return len(points) - 1
+        def link(nodes):
+            ids = [add(n) for n in nodes]
+            for i in xrange(len(ids)):
+                nxt[ids[i - 1]] = ids[i]
+                prv[ids[i]] = ids[i - 1]
+            return ids
+        link([Node(min_x, min_y), Node(max_x, min_y), Node(max_x, max_y),
+              Node(min_x, max_y)])
+        holes = []
+        lengths = []
+        for p in polygons:
+            nodes = list(p.nodes)
+            if _area(nodes) > 0:
+                nodes.reverse()
+            holes.append(link(nodes))
+            lengths.extend([l.length for l in p.lines])
+        # every edge of the ring and the holes, filed by the id of its start
+        grid = spatial.SegmentGrid(
+            cell_size=sum(lengths) / len(lengths) if lengths else None)
+        keys = {}
+        for i in xrange(len(points)):
+            keys[i] = grid.add(geometry.Line(points[i], points[nxt[i]]), i)
+        in_ring = set(xrange(4))
+        holes.sort(key=lambda ids: min([(points[i].x, points[i].y)
+                                        for i in ids]))
+        for ids in holes:
+            h = min(ids, key=lambda i: (points[i].x, points[i].y))
+            m = self.__find_bridge(h, points, nxt, prv, at, grid, in_ring)
+            # split the ring at m, and run it around the hole and back
+            m2, h2 = add(points[m]), add(points[h])
+            m_next, h_prev = nxt[m], prv[h]
+            nxt[m], prv[h] = h, m
+            nxt[m2], prv[m_next] = m_next, m2
+            nxt[h2], prv[m2] = m2, h2
+            nxt[h_prev], prv[h2] = h2, h_prev
+            grid.owners[keys[m]] = m2
+            keys[m2] = keys.pop(m)
+            keys[m] = grid.add(geometry.Line(points[m], points[h]), m)
+            keys[h2] = grid.add(geometry.Line(points[h], points[m]), h2)
+            in_ring.update(ids)
+            in_ring.update((m2, h2))
+        ring = [0]
+        while nxt[ring[-1]] != 0:
+            ring.append(nxt[ring[-1]])
+        return [points[i] for i in ring]
+
+    def __find_bridge(self, h, points, nxt, prv, at, grid, in_ring):
+        """Returns the id of a node of the ring that the hole's node with id
+        ``h`` can be bridged to. A ray is cast to the left from ``h``, and the
+        nearest edge of the ring that it hits gives a first guess. While any
+        edge blocks the bridge, the end of one of the blocking edges that
+        makes the smallest angle with the ray is tried next."""
+        hn = points[h]
+        ray = geometry.Line(hn, Node(self.bounds[0] - 1., hn.y))
+        best_x, m = None, None
+        for key in grid.candidates(ray):
+            i = grid.owners[key]
+            if i not in in_ring: continue
+            a, b = points[i], points[nxt[i]]
+            if a.y == b.y or hn.y < min(a.y, b.y) or hn.y > max(a.y, b.y):
+                continue
+            x = a.x + (hn.y - a.y) * (b.x - a.x) / (b.y - a.y)
+            if x > hn.x or (best_x is not None and x <= best_x): continue
+            best_x = x
+            if a.y == hn.y:
+                m = i
+            elif b.y == hn.y:
+                m = nxt[i]
+            else:
+                m = i if a.x < b.x else nxt[i]
+        if m is None:
+            raise Exception("A polygon is outside of the mesh's bounds")
+        def slope(n):
+            return (abs(n.y - hn.y) / (hn.x - n.x), -n.x)
+        for attempt in xrange(len(points)):
+            bridge = geometry.Line(hn, points[m])
+            candidates = []
+            for key in grid.candidates(bridge):
+                line = grid.lines[key]
+                if line.does_intersect(bridge, False):
+                    candidates.extend([n for n in (line.node_a, line.node_b)
+                                       if n.x < hn.x])
+            if not candidates:
+                break
+            n = min(candidates, key=slope)
+            m = at[n][0]
+        else:
+            raise Exception("No bridge was found for a polygon")
+        # where the ring passes through the node more than once, use the copy
+        # whose corner the bridge leaves through
+        for i in at[points[m]]:
+            if i in in_ring and self.__is_inside_corner(points[prv[i]],
+                                                        points[i],
+                                                        points[nxt[i]], hn):
+                return i
+        return m
+
+    def __is_inside_corner(self, a, b, c, n):
+        """Returns True if the ray from ``b`` towards ``n`` leaves through the
+        inside of the ring's corner at ``b``, between ``a`` and ``c``."""
+        if _turn(a, b, c) >= 0:
+            return _turn(a, b, n) >= 0 and _turn(b, c, n) >= 0
+        return _turn(a, b, n) >= 0 or _turn(b, c, n) >= 0
+
+    def locate(self, point):
+        """Returns the index of a triangle of the mesh that ``point`` is in or
+        on the edge of, or None if it isn't in the free space."""
+        key = self.__locator.find(point)
+        return None if key is None else self.__locator.owners[key]
+
+    def get_shortest_path(self, node_a, node_b):
+        """Finds a path from ``node_a`` to ``node_b`` through the free space,
+        in the same form that ``Board.get_shortest_path`` returns it: the list
+        of nodes to travel through, ending with ``node_b`` and not including
+        ``node_a``, or None if there is no path. Points that aren't in the
+        free space, such as ones outside of the mesh's bounds, have no path."""
+        if node_a == node_b: return [node_a]
+        start, goal = self.locate(node_a), self.locate(node_b)
+        if start is None or goal is None: return None
+        if start == goal: return [node_b]
+        channel = self.__find_channel(node_a, start, node_b, goal)
+        if channel is None: return None
+        return self.__funnel(node_a, channel, node_b)
+
+    def __closest(self, e, point):
+        """Returns the point on the edge ``e`` that is closest to ``point``."""
+        i, k = self.edges[e]
+        a, b = self.points[i], self.points[k]
+        dx, dy = b.x - a.x, b.y - a.y
+        t = ((point.x - a.x) * dx + (point.y - a.y) * dy) / (dx * dx + dy * dy)
+        t = min(max(t, 0.), 1.)
+        return Node(a.x + t * dx, a.y + t * dy)
+
+    def __find_channel(self, node_a, start, node_b, goal):
+        """Finds the channel from the triangle ``start`` to the triangle
+        ``goal`` with an A* search over the edges between them. Each edge is
+        crossed at the point on it closest to where the edge before it was
+        crossed, which follows the straight line that a taut path takes much
+        better than crossing at the midpoints does. Returns the list of the
+        edges crossed, as ``(left, right)`` pairs of nodes as seen when
+        crossing them, or None if there is no channel."""
+        g = {} # edge -> the cost of the best path to it so far
+        came_from = {} # edge -> (the previous edge, the triangle before it)
+        at = {} # edge -> where the best path so far crosses it
+        queue = []
+        for e, t in self.portals[start]:
+            at[e] = self.__closest(e, node_a)
+            g[e] = node_a.dist(at[e])
+            came_from[e] = (None, start)
+            heapq.heappush(queue, (g[e] + at[e].dist(node_b), g[e], e))
+        done = set()
+        end, end_cost = None, float("inf")
+        while queue:
+            f, cost, e = heapq.heappop(queue)
+            if f >= end_cost: break
+            if e in done: continue
+            done.add(e)
+            # the triangle on the far side of e
+            t = sum(self.sides[e]) - came_from[e][1]
+            if t == goal:
+                total = cost + at[e].dist(node_b)
+                if total < end_cost:
+                    end, end_cost = e, total
+                continue
+            for e2, t2 in self.portals[t]:
+                if e2 == e or e2 in done: continue
+                point = self.__closest(e2, at[e])
+                cost2 = cost + at[e].dist(point)
+                if cost2 < g.get(e2, float("inf")):
+                    g[e2] = cost2
+                    at[e2] = point
+                    came_from[e2] = (e, t)
+                    heapq.heappush(queue, (cost2 + point.dist(node_b),
+                                           cost2, e2))
+        if end is None:
+            return None
+        channel = []
+        e = end
+        while e is not None:
+            previous, before = came_from[e]
+            i, k = self.edges[e]
+            a, b = self.points[i], self.points[k]
+            third = [self.points[n] for n in self.triangles[before]
+                     if n != i and n != k][0]
+            # the triangle being left is on the left of a to b, so b is on the
+            # left when crossing
+            channel.append((b, a) if _turn(a, b, third) > 0 else (a, b))
+            e = previous
+        channel.reverse()
+        return channel
+
+    def __funnel(self, node_a, channel, node_b):
+        """Pulls a string from ``node_a`` to ``node_b`` through ``channel``,
+        with the "simple stupid funnel algorithm": the funnel from the apex is
+        narrowed edge by edge, and when one side of it crosses over the other,
+        the corner it crossed is added to the path and becomes the new apex."""
+        portals = channel + [(node_b, node_b)]
+        path = []
+        apex = left = right = node_a
+        apex_i = left_i = right_i = -1
+        i = 0
+        while i < len(portals):
+            new_left, new_right = portals[i]
+            if _turn(apex, right, new_right) >= 0:
+                if apex == right or _turn(apex, left, new_right) < 0:
+                    right, right_i = new_right, i
+                else:
+                    # a side still at the apex has nothing to add
+                    if left != apex:
+                        path.append(left)
+                    apex, apex_i = left, left_i
+                    right, right_i = apex, apex_i
+                    i = apex_i + 1
+                    continue
+            if _turn(apex, left, new_left) <= 0:
+                if apex == left or _turn(apex, right, new_left) > 0:
+                    left, left_i = new_left, i
+                else:
+                    if right != apex:
+                        path.append(right)
+                    apex, apex_i = right, right_i
+                    left, left_i = apex, apex_i
+                    i = apex_i + 1
+                    continue
+            i += 1
+        if not path or path[-1] != node_b:
+            path.append(node_b)
+        return path
@@ -1,10 +1,26 @@
 import math
 
 class Node(object):
+    """A point on a game board. Nodes can't be changed once made, so they can
+    be kept in sets and used as keys.
+    
+    If ``resolution`` is set, with ``set_resolution``, each coordinate is
+    rounded to the nearest multiple of it, which makes every node fall on a
+    fixed grid."""
+    __slots__ = ("x", "y", "__hash")
+    
+    # the spacing of the grid that coordinates are rounded to, or None to
+    # keep them as they are
+    resolution = None
+    
     def __init__(self, x, y):
         super(Node, self).__init__()
-        self.x, self.y = float(x), float(y)
-        self.visible_siblings = set()
+        r = Node.resolution
+        if r is None:
+            self.x, self.y = float(x), float(y)
+        else:
+            self.x, self.y = round(x / r) * r, round(y / r) * r
+        self.__hash = hash((self.x, self.y))
     
     def dist(self, point):
         return math.hypot(self.x - point.x, self.y - point.y)
@@ -22,4 +38,26 @@ class Node(object):
         return "Node" + self.__str__()
     
     def __hash__(self):
-        return hash(self.x)^hash(self.y)
+        return self.__hash
+
+# how far from zero, in multiples of the resolution, coordinates can be while
+# the orientation tests on them stay exact
+EXACT_RANGE = 2 ** 25
+
+def set_resolution(resolution):
+    """Sets the ``resolution`` of every ``Node`` made from now on, turning on
+    the fixed-point mode, or turns it off again if ``resolution`` is None.
+    Nodes that already exist are left as they were, so this should be done
+    before any are made.
+    
+    The resolution must be a power of two, such as ``2 ** -16``, so that each
+    coordinate is an exact whole number of steps of it. As long as every
+    coordinate is within ``EXACT_RANGE`` steps of zero, the differences and
+    products worked out by ``Line.does_intersect`` and the other orientation
+    and area tests are all exact, so their answers have no rounding error,
+    and two nodes are equal exactly when they round to the same place."""
+    if resolution is not None and \
+       (resolution <= 0 or math.frexp(resolution)[0] != .5):
+        raise Exception("The resolution must be a power of two: " +
+                        str(resolution))
+    Node.resolution = resolution
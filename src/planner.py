@@ -0,0 +1,179 @@
+"""Incremental replanning with D* Lite, for a robot that keeps replanning its
+path to one goal as it moves and as the obstacles around it change. Rather
+than searching from scratch each time, a ``Planner`` keeps its search between
+plans, and repairs only the part of it that a change affects. The search runs
+backwards, from the goal towards the robot, so moving the robot doesn't undo
+any of it either.
+
+See "D* Lite" by Sven Koenig and Maxim Likhachev, AAAI 2002."""
+
+import heapq
+import math
+from searching import SearchGraph, START, GOAL
+
+class Planner(object):
+    """Plans paths to a fixed ``goal`` across a ``Board``. Call ``get_path``
+    with the robot's position each time a path is needed. Polygons can be
+    added to and removed from the board in between, and the planner finds out
+    which edges of the visibility graph have changed, and works from those.
+    Call ``close`` once the planner is no longer needed, as the board's graph
+    keeps telling it about every change until then."""
+
+    def __init__(self, board, goal):
+        """Creates a planner for paths to ``goal`` across ``board``, whose
+        visibility graph is calculated first if need be."""
+        super(Planner, self).__init__()
+        self.board = board
+        self.goal = goal
+        self.__links = SearchGraph(board, None, goal)
+        self.__graph = self.__links.graph
+        self.__graph.listeners.append(self.__changed)
+        self.__changed_nodes = set() # nodes added to or removed from the graph
+        self.__dirty = set() # ids whose edges have changed
+        self.__g = {}
+        self.__rhs = {GOAL:0.}
+        self.__queue = []
+        self.__queued = {} # id -> its key in the queue
+        self.__km = 0.
+        self.__revision = None
+
+    def close(self):
+        """Stops the board from telling this planner about its changes."""
+        if self.__changed in self.__graph.listeners:
+            self.__graph.listeners.remove(self.__changed)
+
+    def __changed(self, i, k):
+        if k is None:
+            self.__changed_nodes.add(i)
+        else:
+            self.__dirty.add(k)
+        self.__dirty.add(i)
+
+    def get_path(self, start):
+        """Finds the shortest path from ``start`` to the goal, in the same form
+        that ``Board.get_shortest_path`` returns it: the list of nodes to
+        travel through, ending with the goal and not including ``start``, or
+        None if there is no path."""
+        if start == self.goal: return [start]
+        links = self.__links
+        last = links.start
+        moved = last is None or start != last
+        if last is None:
+            links.start = start
+            self.__push(GOAL, self.__key(GOAL))
+        elif moved:
+            self.__km += math.hypot(start.x - last.x, start.y - last.y)
+            links.start = start
+        if self.board.revision != self.__revision:
+            self.__revision = self.board.revision
+            moved = True # the start may see other nodes now, too
+            old = links.goal_links
+            links.link_goal()
+            self.__dirty.update(links.goal_links ^ old)
+        if moved:
+            links.link_start(start)
+            self.__dirty.add(START)
+        for i in self.__changed_nodes:
+            self.__g.pop(i, None)
+            self.__rhs.pop(i, None)
+            self.__queued.pop(i, None)
+        self.__changed_nodes.clear()
+        for i in self.__dirty:
+            self.__update(i)
+        self.__dirty.clear()
+        self.__search()
+        return self.__trace()
+
+    def __key(self, u):
+        k = min(self.__g.get(u, float("inf")), self.__rhs.get(u, float("inf")))
+        return (k + self.__links.cost(START, u) + self.__km, k)
+
+    def __push(self, u, key):
+        self.__queued[u] = key
+        heapq.heappush(self.__queue, (key, u))
+
+    def __update(self, u):
+        """Works out the cost of the best path from ``u`` to the goal, from
+        the costs of its successors, and queues ``u`` if that disagrees with
+        the cost it has."""
+        if u >= 0 and self.__graph.nodes[u] is None:
+            return # no longer on the board
+        if u != GOAL:
+            best = float("inf")
+            g = self.__g
+            for i in self.__links.successors(u):
+                if i in g:
+                    best = min(best, self.__links.cost(u, i) + g[i])
+            self.__rhs[u] = best
+        self.__requeue(u)
+    
+    def __requeue(self, u):
+        """Queues ``u`` if its costs disagree, or takes it out of the queue if
+        they agree."""
+        self.__queued.pop(u, None)
+        if self.__g.get(u, float("inf")) != self.__rhs.get(u, float("inf")):
+            self.__push(u, self.__key(u))
+
+    def __search(self):
+        """Settles the ids in the queue, until the cost from the start is
+        known."""
+        g, rhs, queue, queued = self.__g, self.__rhs, self.__queue, self.__queued
+        inf = float("inf")
+        expanded = 0
+        while queue:
+            key, u = queue[0]
+            if queued.get(u) != key:
+                heapq.heappop(queue) # stale
+                continue
+            if key >= self.__key(START) and \
+               g.get(START, inf) == rhs.get(START, inf):
+                break
+            heapq.heappop(queue)
+            del queued[u]
+            expanded += 1
+            new_key = self.__key(u)
+            if key < new_key:
+                self.__push(u, new_key)
+            elif g.get(u, inf) > rhs[u]:
+                # u has got cheaper, which can only make its predecessors
+                # cheaper too
+                g[u] = rhs[u]
+                for i in self.__links.predecessors(u):
+                    cost = self.__links.cost(i, u) + g[u]
+                    if cost < rhs.get(i, inf):
+                        rhs[i] = cost
+                        self.__requeue(i)
+            else:
+                # u has got dearer, so everything whose best path went through
+                # it has to look again
+                old = g.pop(u)
+                self.__update(u)
+                for i in self.__links.predecessors(u):
+                    if rhs.get(i, inf) == self.__links.cost(i, u) + old:
+                        self.__update(i)
+        stats = self.board.stats
+        if stats is not None:
+            stats.count("planner_expanded", expanded)
+
+    def __trace(self):
+        """Follows the best successors from the start to the goal."""
+        g = self.__g
+        if g.get(START, float("inf")) == float("inf"):
+            return None
+        path = []
+        seen = set()
+        u = START
+        while u != GOAL:
+            best, step = float("inf"), None
+            for i in self.__links.successors(u):
+                if i in g and self.__links.cost(u, i) + g[i] < best:
+                    best, step = self.__links.cost(u, i) + g[i], i
+            if step is None or step in seen:
+                return None
+            seen.add(step)
+            u = step
+            n = self.__links.get_node(u)
+            path.append(n)
+            if n == self.goal:
+                break
+        return path
@@ -0,0 +1,87 @@
+"""Opt-in instrumentation for finding out where the time goes. A ``Stats``
+object collects counters and per-phase timers. Give one to a ``Board`` as its
+``stats``, and the board counts its visibility cache hits and misses and the
+nodes its searches expand and relax, and times each phase of its work.
+
+The board also counts the geometry tests it makes itself: its calls to
+``Line.does_intersect`` and ``BasePolygon.contains_node_in_area``, and the
+segment tests it does in bulk with ``vectorized.SegmentArray``. When it
+locates a point in its grid of triangles, each triangle tested counts as a
+call to ``contains_node_in_area``. Each board
+counts only its own, so boards used by different threads, each with its own
+``Stats``, don't get in each other's way. The tests made within geometry
+itself, such as while triangulating a polygon, aren't counted."""
+
+import time
+
+class Stats(object):
+    """A set of named counters and timers. ``counts`` maps each counter's name
+    to its count, and ``times`` maps each phase's name to the total number of
+    seconds spent in it, which includes the time spent in any phases started
+    within it."""
+
+    def __init__(self, callback=None):
+        """Creates a set of statistics with nothing collected yet. If given,
+        ``callback`` is called as ``callback(phase, seconds)`` each time a
+        phase finishes."""
+        super(Stats, self).__init__()
+        self.callback = callback
+        self.counts = {}
+        self.times = {}
+
+    def count(self, name, n=1):
+        """Adds ``n`` to the counter called ``name``."""
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def phase(self, name):
+        """Returns a context manager which times its body as part of the phase
+        called ``name``."""
+        return _Phase(self, name)
+
+    def reset(self):
+        """Sets every counter and timer back to zero."""
+        self.counts.clear()
+        self.times.clear()
+
+    def __str__(self):
+        lines = ["%-32s %12d" % i for i in sorted(self.counts.items())]
+        lines.extend(["%-32s %11.6fs" % i for i in sorted(self.times.items())])
+        return "\n".join(lines)
+
+class _Phase(object):
+    """The context manager returned by ``Stats.phase``."""
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self.stats
+
+    def __exit__(self, *exc_info):
+        seconds = time.time() - self.start
+        stats = self.stats
+        stats.times[self.name] = stats.times.get(self.name, 0.) + seconds
+        if stats.callback is not None:
+            stats.callback(self.name, seconds)
+        return False
+
+class _Idle(object):
+    """A context manager which does nothing, standing in for a phase when no
+    statistics are being collected."""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+_idle = _Idle()
+
+def phase(stats, name):
+    """Returns ``stats.phase(name)``, or a context manager which does nothing
+    if ``stats`` is None."""
+    if stats is None:
+        return _idle
+    return stats.phase(name)
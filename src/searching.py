@@ -0,0 +1,119 @@
+"""The graph that ``planner.Planner`` and ``anytime.Search`` search over: the
+visibility graph of a ``Board``, with a start and a goal joined to it. The
+board's nodes are known by their indexes in the visibility graph, and the start
+and the goal by ``START`` and ``GOAL``."""
+
+import math
+
+START, GOAL = -1, -2
+
+class SearchGraph(object):
+    """The visibility graph of ``board``, joined to ``start`` and ``goal``.
+    Call ``link_start`` and ``link_goal`` to work out which of the board's
+    nodes they can see, and again whenever the board or the start changes.
+    ``linking`` does the same work in steps, for a search with a budget."""
+    
+    def __init__(self, board, start, goal):
+        super(SearchGraph, self).__init__()
+        self.board = board
+        self.graph = board.graph
+        self.start = start
+        self.goal = goal
+        self.start_links = set() # the ids that the start can see
+        self.goal_links = set() # the ids that the goal can see
+    
+    def link_start(self, start):
+        """Moves the start to ``start``, and finds the ids it can see."""
+        for step in self.__link_start(start):
+            pass
+    
+    def link_goal(self):
+        """Finds the ids that the goal can see, including its own id if it is
+        also a node of the board."""
+        for step in self.__link_goal():
+            pass
+    
+    def linking(self, start):
+        """Does the work of ``link_goal`` and then of ``link_start(start)``,
+        yielding after each step of it. A step tests up to the board's
+        ``build_step`` nodes."""
+        for step in self.__link_goal():
+            yield step
+        for step in self.__link_start(start):
+            yield step
+    
+    def __link_start(self, start):
+        links = set()
+        for step in self.__find_links(start, links):
+            yield step
+        if self.board.is_visible(start, self.goal):
+            links.add(GOAL)
+        self.start, self.start_links = start, links
+    
+    def __link_goal(self):
+        links = set()
+        for step in self.__find_links(self.goal, links):
+            yield step
+        if self.goal in self.graph.index:
+            links.add(self.graph.index[self.goal])
+        self.goal_links = links
+    
+    def __find_links(self, pov, links):
+        """Adds the ids that ``pov`` can see to ``links``, yielding after
+        testing each ``build_step`` of the board's nodes."""
+        g = self.graph
+        if pov in g.index:
+            links.update(g.neighbors(g.index[pov]))
+            return
+        nodes = [n for n in g.nodes if n is not None]
+        size = self.board.build_step
+        for i in xrange(0, len(nodes), size):
+            visible = self.board.get_visible_set_for(pov, *nodes[i:i + size])
+            links.update(g.index[n] for n in visible)
+            yield True
+    
+    def get_node(self, u):
+        """The node with the id ``u``."""
+        if u == START:
+            return self.start
+        if u == GOAL:
+            return self.goal
+        return self.graph.nodes[u]
+    
+    def position(self, u):
+        if u == START:
+            return self.start.x, self.start.y
+        if u == GOAL:
+            return self.goal.x, self.goal.y
+        xy = self.graph.coordinates
+        return xy[2 * u], xy[2 * u + 1]
+    
+    def cost(self, u, v):
+        """The straight-line distance between the ids ``u`` and ``v``, which is
+        also used as the heuristic."""
+        ux, uy = self.position(u)
+        vx, vy = self.position(v)
+        return math.hypot(vx - ux, vy - uy)
+    
+    def successors(self, u):
+        """The ids that can be travelled to from ``u``."""
+        if u == START:
+            return list(self.start_links)
+        if u == GOAL:
+            return []
+        links = self.graph.neighbors(u)
+        if u in self.goal_links:
+            links.append(GOAL)
+        return links
+    
+    def predecessors(self, u):
+        """The ids that can travel to ``u``."""
+        if u == START:
+            return []
+        if u == GOAL:
+            links = list(self.goal_links)
+        else:
+            links = self.graph.neighbors(u)
+        if u in self.start_links:
+            links.append(START)
+        return links
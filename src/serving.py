@@ -0,0 +1,208 @@
+"""Answering path queries from a pool of workers while the board keeps
+changing. A ``QueryServer`` answers each batch of queries against a frozen
+snapshot of the board (see ``Board.freeze``), so no query ever waits on a
+change. Changes are made one at a time in a thread of their own, which then
+freezes the board again; queries carry on against the old snapshot until the
+new one is ready, and those submitted after that use the new one."""
+
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+import mapping
+import node
+
+# how many batches each worker is given, at most, for a single call to
+# QueryServer.get_paths
+CHUNKS_PER_WORKER = 4
+
+class QueryServer(object):
+    """Answers batches of path queries across ``board``, spread over
+    ``workers`` threads, or as many as there are cores if it is None. With
+    ``processes`` True, worker processes are used instead, which gets around
+    the interpreter lock at the cost of each process loading every snapshot
+    from a file. Once handed to a server, the board should only be changed
+    through ``change``. Call ``close`` when done with the server."""
+    
+    def __init__(self, board, workers=None, processes=False):
+        self.board = board
+        self.processes = processes
+        self.__directory = tempfile.mkdtemp() if processes else None
+        self.__lock = threading.Lock()
+        self.__users = {} # snapshot file -> the batches yet to finish with it
+        self.__saves = 0
+        self.__current = self.__build()
+        self.__builder = ThreadPool(1)
+        if processes:
+            self.__pool = multiprocessing.Pool(workers)
+        else:
+            self.__pool = ThreadPool(workers or multiprocessing.cpu_count())
+        self.__workers = workers or multiprocessing.cpu_count()
+    
+    def get_snapshot(self):
+        return self.__current[0]
+    
+    snapshot = property(get_snapshot,
+                        doc="""The frozen ``Board`` that queries are answered
+                        against at the moment""")
+    
+    def get_paths(self, pairs, callback=None):
+        """Finds the shortest path between each of ``pairs`` of nodes, in the
+        same form that ``Board.get_shortest_path`` returns, without waiting
+        for them. Returns a ``Batch``, whose ``get`` gives the list of paths,
+        in the order of ``pairs``. If ``callback`` is given, it is called with
+        that list once it is ready. It is called from one of the server's
+        threads, so an event loop should be handed the result through its own
+        thread-safe call, such as ``call_soon_threadsafe``."""
+        pairs = list(pairs)
+        with self.__lock:
+            snapshot, path = self.__current
+            if path is not None:
+                self.__users[path] += 1
+        size = max(1, int(math.ceil(float(len(pairs)) /
+                                    (self.__workers * CHUNKS_PER_WORKER))))
+        if self.processes:
+            chunks = [(path, [((a.x, a.y), (b.x, b.y))
+                              for a, b in pairs[i:i + size]])
+                      for i in xrange(0, len(pairs), size)]
+            find = _find_saved_paths
+            convert = _to_paths
+        else:
+            chunks = [(snapshot, pairs[i:i + size])
+                      for i in xrange(0, len(pairs), size)]
+            find = _find_paths
+            convert = _join
+        def done(found):
+            if path is not None:
+                self.__release(path)
+            if callback is not None:
+                callback(convert(found))
+        return Batch(self.__pool.map_async(find, chunks, 1, done), convert)
+    
+    def get_shortest_path(self, node_a, node_b, callback=None):
+        """Finds the shortest path from ``node_a`` to ``node_b`` without
+        waiting for it, as a batch of one. The ``Batch`` returned gives the
+        path itself, rather than a list."""
+        if callback is not None:
+            callback = lambda found, callback=callback: callback(found[0])
+        batch = self.get_paths([(node_a, node_b)], callback)
+        return Batch(batch, lambda found: found[0])
+    
+    def change(self, function, *args):
+        """Calls ``function(board, *args)`` in the server's builder thread, to
+        change the board, and then freezes it again. Changes are made in the
+        order they were asked for. Returns a ``multiprocessing.pool``
+        ``AsyncResult``, which gives the new snapshot once queries are being
+        answered against it."""
+        return self.__builder.apply_async(self.__change, (function, args))
+    
+    def add(self, poly):
+        """Adds ``poly`` to the board with ``change``."""
+        return self.change(mapping.Board.add, poly)
+    
+    def remove(self, poly):
+        """Removes ``poly`` from the board with ``change``."""
+        return self.change(mapping.Board.remove, poly)
+    
+    def close(self):
+        """Waits for the queries and changes already asked for, and then
+        stops the server's workers."""
+        self.__builder.close()
+        self.__builder.join()
+        self.__pool.close()
+        self.__pool.join()
+        if self.__directory is not None:
+            shutil.rmtree(self.__directory, ignore_errors=True)
+    
+    def __change(self, function, args):
+        function(self.board, *args)
+        current = self.__build()
+        with self.__lock:
+            old = self.__current[1]
+            self.__current = current
+        if old is not None:
+            self.__release(old, 0)
+        return current[0]
+    
+    def __release(self, path, count=1):
+        """Records that ``count`` batches have finished with the snapshot
+        file at ``path``, and removes the file if it is no longer the current
+        one and no batch is still using it. A batch whose worker fails never
+        releases its file, which is then left until ``close``."""
+        with self.__lock:
+            self.__users[path] -= count
+            if self.__users[path] > 0 or path == self.__current[1]:
+                return
+            del self.__users[path]
+        os.remove(path)
+    
+    def __build(self):
+        """Returns a new snapshot of the board, and the file it was saved to
+        if the server uses processes."""
+        snapshot = self.board.freeze()
+        path = None
+        if self.processes:
+            self.__saves += 1
+            path = os.path.join(self.__directory, "%d.board" % self.__saves)
+            snapshot.save(path)
+            with self.__lock:
+                self.__users[path] = 0
+        return snapshot, path
+
+class Batch(object):
+    """The answers to a batch of queries given to a ``QueryServer``, which may
+    not be ready yet."""
+    
+    def __init__(self, result, convert):
+        self.__result = result
+        self.__convert = convert
+    
+    def ready(self):
+        """Returns True if the answers are ready."""
+        return self.__result.ready()
+    
+    def wait(self, timeout=None):
+        """Waits until the answers are ready, or ``timeout`` seconds pass."""
+        self.__result.wait(timeout)
+    
+    def get(self, timeout=None):
+        """Waits for the answers and returns them. If they aren't ready within
+        ``timeout`` seconds, a ``multiprocessing.TimeoutError`` is raised."""
+        return self.__convert(self.__result.get(timeout))
+
+def _join(found):
+    """Joins the lists of paths found for each chunk of a batch."""
+    return [path for paths in found for path in paths]
+
+def _to_paths(found):
+    """Joins the lists of paths found for each chunk of a batch by worker
+    processes, turning their points back into nodes."""
+    return [None if path is None else [node.Node(x, y) for x, y in path]
+            for path in _join(found)]
+
+def _find_paths(chunk):
+    """Finds the path between each pair of nodes in a chunk of a batch, given
+    as the snapshot to use and the pairs."""
+    snapshot, pairs = chunk
+    return [snapshot.get_shortest_path(a, b) for a, b in pairs]
+
+# the snapshot a worker process last loaded, by the file it came from
+_loaded = {}
+
+def _find_saved_paths(chunk):
+    """Finds the path between each pair of points in a chunk of a batch in a
+    worker process, given as the file its snapshot was saved to and the pairs.
+    Returns each path as a list of points."""
+    path, pairs = chunk
+    if path not in _loaded:
+        _loaded.clear()
+        _loaded[path] = mapping.Board.load(path)
+    board = _loaded[path]
+    found = []
+    for a, b in pairs:
+        p = board.get_shortest_path(node.Node(*a), node.Node(*b))
+        found.append(None if p is None else [(i.x, i.y) for i in p])
+    return found
@@ -0,0 +1,89 @@
+"""An ordered set kept in a skip list, for the sweeps that keep the segments
+crossed by their sweep line in order: Lee's rotational sweep in ``sweep``, and
+the check for a self-intersecting ``geometry.Polygon``. Items are placed by a
+test that the caller gives for each insertion, rather than by comparing the
+items themselves, as where a segment belongs depends on where the sweep line
+is at the time."""
+
+import random
+
+# the most levels a ``SkipList`` has, which is enough for 2 ** 32 items
+LEVELS = 32
+
+class SkipList(object):
+    """A sequence of distinct, hashable items other than None, in an order
+    decided by the caller as each one is inserted. Inserting an item takes
+    O(log n) expected time, and removing one takes O(1) expected time, as each
+    entry knows its neighbors on every level. Iterating over the list gives
+    the items from the first to the last."""
+
+    def __init__(self):
+        super(SkipList, self).__init__()
+        # each entry is [item, next entry on each level, previous entry on
+        # each level]; the head holds no item
+        self.__head = [None, [None] * LEVELS, [None] * LEVELS]
+        self.__levels = 1
+        self.__entries = {} # item -> its entry
+        self.__random = random.Random(0)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __iter__(self):
+        entry = self.__head[1][0]
+        while entry is not None:
+            yield entry[0]
+            entry = entry[1][0]
+
+    def insert(self, item, before):
+        """Inserts ``item`` in front of the first item ``k`` for which
+        ``before(k)`` is True. It must be False for every item in front of
+        that one, and True for every item after it."""
+        head = entry = self.__head
+        levels = self.__levels
+        update = [head] * levels
+        stop = None # the last entry found to be after item
+        for level in xrange(levels - 1, -1, -1):
+            following = entry[1][level]
+            while following is not None and following is not stop and \
+                  not before(following[0]):
+                entry = following
+                following = entry[1][level]
+            stop = following
+            update[level] = entry
+        # each level above the first is reached with a chance of one half
+        bits = self.__random.getrandbits(LEVELS - 1)
+        height = 1
+        while bits & 1:
+            height += 1
+            bits >>= 1
+        if height > levels:
+            update.extend([head] * (height - levels))
+            self.__levels = height
+        nexts, previouses = [None] * height, [None] * height
+        new = [item, nexts, previouses]
+        for level in xrange(height):
+            previous = update[level]
+            following = previous[1][level]
+            nexts[level], previouses[level] = following, previous
+            previous[1][level] = new
+            if following is not None:
+                following[2][level] = new
+        self.__entries[item] = new
+
+    def neighbors(self, item):
+        """Returns the items just in front of and just after ``item``, which
+        must be in the list, with None in place of either one that it
+        lacks."""
+        entry = self.__entries[item]
+        following = entry[1][0]
+        return entry[2][0][0], None if following is None else following[0]
+
+    def remove(self, item):
+        """Removes ``item``, which must be in the list."""
+        entry = self.__entries.pop(item)
+        for level in xrange(len(entry[1])):
+            previous, following = entry[2][level], entry[1][level]
+            previous[1][level] = following
+            if following is not None:
+                following[2][level] = previous
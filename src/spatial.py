@@ -0,0 +1,243 @@
+import math
+import geometry
+
+class SegmentGrid(object):
+    """A uniform grid over a group of line segments, used to quickly find which
+    segments lie near a query segment. Each segment is filed in every cell that
+    it passes through, so a query only has to look at the segments sharing a
+    cell with it, rather than at every segment in the group. The result of a
+    query is a superset of the segments that may intersect the query segment,
+    so the caller still needs to do the exact intersection test itself.
+
+    Segments can be added and removed after the grid is built, though the size
+    of the cells stays fixed, so a grid that has grown far beyond what it was
+    built with is best rebuilt. Each segment can carry an ``owner``, such as the
+    polygon it belongs to."""
+
+    def __init__(self, lines=(), cell_size=None, owners=None):
+        """Builds a grid over ``lines``, an iterable of ``Line`` objects, owned
+        by the matching items of ``owners``, if given. If ``cell_size`` is not
+        given, the average length of the segments is used, which keeps each
+        segment in only a handful of cells."""
+        super(SegmentGrid, self).__init__()
+        lines = list(lines)
+        if owners is None:
+            owners = [None] * len(lines)
+        self.lines = {}
+        self.owners = {}
+        self.cells = {}
+        self.__next_key = 0
+        if cell_size is None:
+            cell_size = 0.
+            if lines:
+                cell_size = sum([l.length for l in lines]) / len(lines)
+        if not cell_size > 0:
+            cell_size = 1.
+        self.cell_size = float(cell_size)
+        if lines:
+            self.origin_x = min([min(l.node_a.x, l.node_b.x) for l in lines])
+            self.origin_y = min([min(l.node_a.y, l.node_b.y) for l in lines])
+        else:
+            self.origin_x = self.origin_y = 0.
+        self.built_size = len(lines)
+        for l, owner in zip(lines, owners):
+            self.add(l, owner)
+
+    def add(self, line, owner=None):
+        """Files ``line`` in the grid, and returns the key that it was given,
+        which can later be passed to ``remove``."""
+        key = self.__next_key
+        self.__next_key += 1
+        self.lines[key] = line
+        self.owners[key] = owner
+        for cell in self.__get_cells(line.node_a, line.node_b):
+            self.cells.setdefault(cell, []).append(key)
+        return key
+
+    def remove(self, key):
+        """Removes the segment with the given ``key`` from the grid."""
+        line = self.lines.pop(key)
+        del self.owners[key]
+        for cell in self.__get_cells(line.node_a, line.node_b):
+            bucket = self.cells[cell]
+            bucket.remove(key)
+            if not bucket:
+                del self.cells[cell]
+
+    def __get_cells(self, a, b):
+        """Yields the cells that the segment from ``a`` to ``b`` passes
+        through. The segment is walked one column at a time, and the walk is
+        padded by a cell on every side, so that rounding error can never cause
+        a cell to be missed."""
+        s, ox, oy = self.cell_size, self.origin_x, self.origin_y
+        if a.x > b.x:
+            a, b = b, a
+        col_a = int(math.floor((a.x - ox) / s))
+        col_b = int(math.floor((b.x - ox) / s))
+        dx, dy = b.x - a.x, b.y - a.y
+        for col in xrange(col_a - 1, col_b + 2):
+            if dx == 0:
+                y_lo, y_hi = a.y, b.y
+            else:
+                # find where the segment enters and leaves this column
+                x_lo = min(max(a.x, ox + col * s), b.x)
+                x_hi = max(min(b.x, ox + (col + 1) * s), a.x)
+                y_lo = a.y + dy * (x_lo - a.x) / dx
+                y_hi = a.y + dy * (x_hi - a.x) / dx
+            if y_lo > y_hi:
+                y_lo, y_hi = y_hi, y_lo
+            row_lo = int(math.floor((y_lo - oy) / s)) - 1
+            row_hi = int(math.floor((y_hi - oy) / s)) + 1
+            for row in xrange(row_lo, row_hi + 1):
+                yield (col, row)
+
+    def candidates(self, line):
+        """Returns the set of keys of the segments in this grid that may
+        intersect ``line``. Any segment not in the set is guaranteed not to
+        intersect it."""
+        cells = self.cells
+        found = set()
+        for cell in self.__get_cells(line.node_a, line.node_b):
+            if cell in cells:
+                found.update(cells[cell])
+        return found
+
+    def query(self, line):
+        """Returns a list of the segments in this grid that may intersect
+        ``line``."""
+        return [self.lines[k] for k in self.candidates(line)]
+
+    def __len__(self):
+        return len(self.lines)
+
+class TriangleGrid(object):
+    """A uniform grid over a group of triangles, used to quickly find which
+    triangle, if any, covers a point. Each triangle is filed in every cell that
+    its bounding box overlaps, so finding a point only means testing the
+    handful of triangles filed in its cell. Like ``SegmentGrid``, triangles
+    can be added and removed after the grid is built, and each one can carry
+    an ``owner``, such as the polygon it was cut from."""
+
+    def __init__(self, triangles=(), cell_size=None, owners=None):
+        """Builds a grid over ``triangles``, an iterable of ``Triangle``
+        objects, owned by the matching items of ``owners``, if given. If
+        ``cell_size`` is not given, the average size of the triangles' bounding
+        boxes is used."""
+        super(TriangleGrid, self).__init__()
+        triangles = list(triangles)
+        if owners is None:
+            owners = [None] * len(triangles)
+        self.triangles = {}
+        self.owners = {}
+        self.cells = {}
+        self.__next_key = 0
+        if cell_size is None:
+            cell_size = 0.
+            if triangles:
+                cell_size = sum([max(t.bounds[2] - t.bounds[0],
+                                     t.bounds[3] - t.bounds[1])
+                                 for t in triangles]) / len(triangles)
+        if not cell_size > 0:
+            cell_size = 1.
+        self.cell_size = float(cell_size)
+        if triangles:
+            self.origin_x = min([t.bounds[0] for t in triangles])
+            self.origin_y = min([t.bounds[1] for t in triangles])
+        else:
+            self.origin_x = self.origin_y = 0.
+        self.built_size = len(triangles)
+        for t, owner in zip(triangles, owners):
+            self.add(t, owner)
+
+    def add(self, triangle, owner=None):
+        """Files ``triangle`` in the grid, and returns the key that it was
+        given, which can later be passed to ``remove``."""
+        key = self.__next_key
+        self.__next_key += 1
+        a, b, c = triangle.nodes
+        if (b.x - a.x) * (c.y - a.y) < (b.y - a.y) * (c.x - a.x):
+            a, c = c, a # keep every triangle counter-clockwise
+        self.triangles[key] = (a, b, c)
+        self.owners[key] = owner
+        for cell in self.__get_cells(triangle.bounds):
+            self.cells.setdefault(cell, []).append(key)
+        return key
+
+    def remove(self, key):
+        """Removes the triangle with the given ``key`` from the grid."""
+        a, b, c = self.triangles.pop(key)
+        del self.owners[key]
+        bounds = (min(a.x, b.x, c.x), min(a.y, b.y, c.y),
+                  max(a.x, b.x, c.x), max(a.y, b.y, c.y))
+        for cell in self.__get_cells(bounds):
+            bucket = self.cells[cell]
+            bucket.remove(key)
+            if not bucket:
+                del self.cells[cell]
+
+    def __get_cell(self, x, y):
+        s = self.cell_size
+        return (int(math.floor((x - self.origin_x) / s)),
+                int(math.floor((y - self.origin_y) / s)))
+
+    def __get_cells(self, bounds):
+        """Yields the cells that the bounding box ``bounds`` overlaps."""
+        col_lo, row_lo = self.__get_cell(bounds[0], bounds[1])
+        col_hi, row_hi = self.__get_cell(bounds[2], bounds[3])
+        for col in xrange(col_lo, col_hi + 1):
+            for row in xrange(row_lo, row_hi + 1):
+                yield (col, row)
+
+    def __covers(self, key, x, y, eps):
+        """Returns True if the triangle with the given ``key`` covers the
+        point ``(x, y)``, including its edges, which are widened by ``eps``
+        just as ``BasePolygon.contains_node_in_area`` widens them."""
+        a, b, c = self.triangles[key]
+        return (b.x - a.x) * (y - a.y) - (b.y - a.y) * (x - a.x) >= -eps and \
+               (c.x - b.x) * (y - b.y) - (c.y - b.y) * (x - b.x) >= -eps and \
+               (a.x - c.x) * (y - c.y) - (a.y - c.y) * (x - c.x) >= -eps
+
+    def find(self, point, stats=None):
+        """Returns the key of a triangle in this grid that covers ``point``,
+        which may be on its edge, or None if there isn't one. If ``stats`` is
+        given, each triangle tested is counted into it as a call to
+        ``BasePolygon.contains_node_in_area``, which it stands in for."""
+        x, y = point.x, point.y
+        eps = geometry.get_epsilon()
+        tests, found = 0, None
+        for key in self.cells.get(self.__get_cell(x, y), ()):
+            tests += 1
+            if self.__covers(key, x, y, eps):
+                found = key
+                break
+        if stats is not None:
+            stats.count("contains_node_in_area", tests)
+        return found
+
+    def find_all(self, points, stats=None):
+        """Returns a list with the result of ``find`` for each of ``points``,
+        counting the triangles tested into ``stats`` as ``find`` does. The
+        points are grouped by cell first, so that each cell is only looked up
+        once."""
+        groups = {}
+        for i in xrange(len(points)):
+            cell = self.__get_cell(points[i].x, points[i].y)
+            groups.setdefault(cell, []).append(i)
+        result = [None] * len(points)
+        eps = geometry.get_epsilon()
+        tests = 0
+        for cell, group in groups.items():
+            keys = self.cells.get(cell, ())
+            for i in group:
+                x, y = points[i].x, points[i].y
+                for key in keys:
+                    tests += 1
+                    if self.__covers(key, x, y, eps):
+                        result[i] = key
+                        break
+        if stats is not None:
+            stats.count("contains_node_in_area", tests)
+        return result
+
+    def __len__(self):
+        return len(self.triangles)
@@ -0,0 +1,209 @@
+"""An implementation of Lee's rotational plane-sweep for building visibility
+graphs. For each vertex, the other vertexes are visited in order of angle
+around it, while an ordered set of the segments crossed by the rotating ray
+is maintained, in a skip list. Only the segments in front of a vertex on that
+ray need to be tested. Each sweep sorts the other vertexes, makes one pass
+over the segments to find those crossing the ray at the start, and then
+inserts and removes each segment in O(log n) expected time, so building the
+whole graph costs O(n^2 log n) for n vertexes, with the segments in
+proportion to them, rather than the O(n^3) of testing every pair against
+every segment.
+
+The final say on whether a segment blocks a line-of-sight is still left to
+``Line.does_intersect``, so the graph produced is identical to the one made by
+testing every pair directly. The sweep assumes that no two segments cross each
+other; use ``has_crossings`` to check for that first."""
+
+import functools
+import math
+import geometry
+import skiplist
+
+EPSILON = 1e-9
+
+def orientation(a, b, c):
+    """Returns 1 if ``c`` is counter-clockwise of the ray from ``a`` to ``b``,
+    -1 if it is clockwise, and 0 if the three are collinear. This is computed
+    the same way as ``Line.does_intersect`` computes it, so both agree on what
+    is collinear."""
+    l = (c.y - a.y) * (b.x - a.x)
+    r = (b.y - a.y) * (c.x - a.x)
+    if l > r: return 1
+    if l < r: return -1
+    return 0
+
+def has_crossings(grid):
+    """Returns True if any two segments in ``grid``, a ``spatial.SegmentGrid``,
+    properly cross each other. Segments that only touch do not count."""
+    for l in grid.lines.values():
+        a, b = l.node_a, l.node_b
+        for k in grid.query(l):
+            c, d = k.node_a, k.node_b
+            if orientation(a, b, c) * orientation(a, b, d) < 0 and \
+               orientation(c, d, a) * orientation(c, d, b) < 0:
+                return True
+    return False
+
+def visibility(nodes, segments, diagonals, rows=None, stats=None):
+    """Decides whether each pair of nodes in ``nodes`` can see each other. A
+    pair is blocked if its direct line intersects one of ``segments`` or is one
+    of ``diagonals``, just as ``Board`` would decide it. Every endpoint of
+    ``segments`` must be one of ``nodes``. Each pair is yielded once, as
+    ``(a, b, blocker)``, where ``a`` and ``b`` are the indexes of the nodes in
+    ``nodes``, and ``a`` is less than ``b``. If the pair is visible,
+    ``blocker`` is None, otherwise it is a ``Line`` which blocks the pair:
+    either one of ``segments``, or the pair's own direct line if it is one of
+    ``diagonals``. If ``rows`` is given, only the pairs whose ``a`` is one of
+    ``rows`` are decided, so the work can be split up. If ``stats`` is given,
+    the calls to ``Line.does_intersect`` are counted into it."""
+    nodes = list(nodes)
+    segments = list(segments)
+    order = dict((nodes[i], i) for i in xrange(len(nodes)))
+    ends = [(order[l.node_a], order[l.node_b]) for l in segments]
+    # the start and the direction of each segment, for working out where it
+    # crosses the sweep's ray
+    rays = [(l.node_a.x, l.node_a.y, l.node_b.x - l.node_a.x,
+             l.node_b.y - l.node_a.y) for l in segments]
+    incident = [[] for n in nodes]
+    for i in xrange(len(ends)):
+        incident[ends[i][0]].append(i)
+        incident[ends[i][1]].append(i)
+    if rows is None:
+        rows = xrange(len(nodes))
+    for v in rows:
+        for w, blocker in _sweep(v, nodes, segments, ends, rays, incident,
+                                 diagonals, stats):
+            yield v, w, blocker
+
+def _sweep(v, nodes, segments, ends, rays, incident, diagonals, stats):
+    """Performs the rotational sweep around ``nodes[v]``, yielding the index of
+    every node after it in ``nodes``, along with what blocks it, if anything.
+    The calls to ``Line.does_intersect`` are counted into ``stats``, unless it
+    is None."""
+    pov = nodes[v]
+    vx, vy = pov.x, pov.y
+
+    def compare(p, q):
+        p, q = nodes[p], nodes[q]
+        hp = 0 if p.y > vy or (p.y == vy and p.x > vx) else 1
+        hq = 0 if q.y > vy or (q.y == vy and q.x > vx) else 1
+        if hp != hq: return hp - hq
+        o = orientation(pov, p, q)
+        if o: return -o
+        return cmp(pov.dist(p), pov.dist(q))
+
+    others = [i for i in xrange(len(nodes)) if i != v]
+    others.sort(key=functools.cmp_to_key(compare))
+    position = [0] * len(nodes)
+    for i in xrange(len(others)):
+        position[others[i]] = i
+
+    # sort out which segments are swept over, and which ones can be skipped
+    skipped = set(incident[v]) # these can never block the view from v
+    pinned = [] # segments passing straight through v
+    initial = []
+    for i in xrange(len(segments)):
+        if i in skipped:
+            continue
+        a, b = ends[i]
+        if position[a] > position[b]:
+            a, b = b, a
+        o = orientation(pov, nodes[a], nodes[b])
+        if o < 0:
+            # crosses the ray that the sweep starts on
+            initial.append(i)
+        elif o == 0:
+            # collinear with v, so it is never crossed by the ray, but if v is
+            # inside of it then it can still block some directions
+            skipped.add(i)
+            a, b = nodes[a], nodes[b]
+            if (a.x - vx) * (b.x - vx) + (a.y - vy) * (b.y - vy) < 0:
+                pinned.append(i)
+
+    def distance(i, rx, ry):
+        """The distance along the ray ``(rx, ry)`` from ``v`` at which segment
+        ``i`` is crossed, in units of the ray's length"""
+        ax, ay, dx, dy = rays[i]
+        denominator = rx * dy - ry * dx
+        if denominator == 0:
+            return float("inf")
+        return ((ax - vx) * dy - (ay - vy) * dx) / denominator
+
+    def insert(i, rx, ry, far):
+        """Inserts segment ``i`` into the active list. ``far`` is the endpoint
+        of ``i`` on the side the sweep is heading towards, used to break ties
+        with segments that cross the ray at the same point."""
+        t = distance(i, rx, ry)
+        tolerance = EPSILON * max(1., abs(t))
+
+        def closer(k):
+            """Returns True if ``i`` is closer to ``v`` than ``k`` is."""
+            u = distance(k, rx, ry)
+            if abs(u - t) <= tolerance:
+                a, b = segments[k].node_a, segments[k].node_b
+                return orientation(a, b, pov) * orientation(a, b, far) > 0
+            return t < u
+
+        active.insert(i, closer)
+
+    active = skiplist.SkipList()
+    for i in initial:
+        a, b = segments[i].node_a, segments[i].node_b
+        insert(i, 1., 0., a if a.y < b.y else b)
+
+    def near_ray(k, rx, ry):
+        """Returns True if node ``k`` lies on, or very nearly on, the ray
+        ``(rx, ry)`` from ``v``."""
+        qx, qy = nodes[k].x - vx, nodes[k].y - vy
+        return rx * qx + ry * qy > 0 and abs(rx * qy - ry * qx) <= \
+               EPSILON * math.hypot(rx, ry) * math.hypot(qx, qy)
+
+    tests = 0
+    for j in xrange(len(others)):
+        w = others[j]
+        node = nodes[w]
+        rx, ry = node.x - vx, node.y - vy
+        if w > v:
+            direct_line = geometry.Line(pov, node)
+            blocker = None
+            if direct_line in diagonals:
+                blocker = direct_line
+            for i in pinned:
+                if blocker is not None: break
+                tests += 1
+                if segments[i].does_intersect(direct_line, False):
+                    blocker = segments[i]
+            # the ray passes right by the ends of the segments touching the
+            # nodes on, or very nearly on, it. Whether ``does_intersect``
+            # counts those as blocking can come down to rounding error, so
+            # they are always checked, whether they are active or not
+            for step in (-1, 1):
+                k = j + step
+                while blocker is None and 0 <= k < len(others) and \
+                      near_ray(others[k], rx, ry):
+                    for i in incident[others[k]]:
+                        if i in skipped:
+                            continue
+                        tests += 1
+                        if segments[i].does_intersect(direct_line, False):
+                            blocker = segments[i]
+                            break
+                    k += step
+            for i in active:
+                if blocker is not None or \
+                   distance(i, rx, ry) > 1. + EPSILON: break
+                tests += 1
+                if segments[i].does_intersect(direct_line, False):
+                    blocker = segments[i]
+            yield w, blocker
+        for i in incident[w]:
+            if i in skipped:
+                continue
+            a, b = ends[i]
+            far = nodes[b if a == w else a]
+            if orientation(pov, node, far) > 0:
+                insert(i, rx, ry, far)
+            else:
+                active.remove(i)
+    if stats is not None:
+        stats.count("does_intersect", tests)
@@ -1,5 +1,20 @@
+import anytime
 import geometry
+import graph
+import loading
 import mapping
+import navmesh
+import node
+import os
+import planner
+import profiling
+import random
+import serving
+import StringIO
+import tempfile
+import threading
+import time
+import vectorized
 from node import Node
 import unittest
 
@@ -26,6 +41,12 @@ s_start = Node(1.5, 3)
 s_end = Node(3.5, 0)
 # del left_side; del right_side
 
+# a block in the gap at the top right of the s-curve, which the path from
+# s_start to s_end has to go around
+s_block = geometry.Polygon((3.25, .25), (3.75, .25), (3.75, 1.5),
+                           (3.25, 1.5))
+s_blocked_path = [Node(2.0, 2.0), Node(3.0, 1.0), Node(3.25, .25), s_end]
+
 # A simple rectangular board, to test that a path cannot pass through a polygon
 # (0, 0) ________ (1, 0)
 #       |        |
@@ -37,17 +58,127 @@ r_board.add(geometry.Polygon((0, 0), (1, 0), (1, 1), (0, 1), ccw=False))
 r_start = Node(0, 0)
 r_end = Node(1, 1)
 
+def build_board(*polygons, **options):
+    """Returns a new board, made with ``options``, holding a copy of each of
+    ``polygons``."""
+    board = mapping.Board(**options)
+    for p in polygons:
+        board.add(geometry.Polygon(*[(n.x, n.y) for n in p.nodes]))
+    return board
+
+def visibility_relation(board):
+    """Returns the edges of ``board``'s visibility graph, as a set."""
+    return set(frozenset(i) for i in board.graph.edges())
+
 class TestContainsNodeInArea(unittest.TestCase):
     def test_s_curve_node_in_area(self):
         assert s_left_side.contains_node_in_area(Node(2, .5))
         assert s_left_side.contains_node_in_area(Node(1, 2.5))
         assert not s_left_side.contains_node_in_area(Node(3.5, .5))
         assert not s_right_side.contains_node_in_area(Node(3.5, .5))
+    
+    def test_s_curve_locate(self):
+        assert s_board.locate(Node(2, .5)) is s_left_side
+        assert s_board.locate(Node(4.5, 1)) is s_right_side
+        assert s_board.locate(Node(3, .5)) is s_left_side # on an edge
+        assert s_board.is_free(Node(3.5, .5))
+        assert s_board.locate_all([Node(1, 2.5), Node(2, 1.5), Node(9, 9)]) \
+               == [s_left_side, None, None]
+    
+    def test_locate_on_slanted_edges(self):
+        poly = geometry.Polygon((.1, .3), (2.7, .9), (1.3, 2.9), (.2, 1.7))
+        board = mapping.Board()
+        board.add(poly)
+        ends = poly.nodes + poly.nodes[:1]
+        points = [Node(a.x + (b.x - a.x) * t, a.y + (b.y - a.y) * t)
+                  for a, b in zip(ends, ends[1:]) for t in (.1, .3, .7)]
+        for p in points:
+            assert poly.contains_node_in_area(p)
+            assert board.locate(p) is poly
+        assert board.locate_all(points) == [poly] * len(points)
+
+class TestHashing(unittest.TestCase):
+    def test_mirrored_points(self):
+        hashes = set(hash(Node(x, y)) for x in xrange(20) for y in xrange(20))
+        assert len(hashes) == 400
+    
+    def test_lines(self):
+        a, b = Node(1, 2), Node(2, 1)
+        assert hash(geometry.Line(a, b)) == hash(geometry.Line(b, a))
+        assert hash(geometry.Line(a, b)) != \
+               hash(geometry.Line(Node(0, 0), Node(3, 3)))
+
+class TestFixedPoint(unittest.TestCase):
+    def setUp(self):
+        node.set_resolution(2 ** -10)
+    
+    def tearDown(self):
+        node.set_resolution(None)
+    
+    def test_rounding(self):
+        assert Node(.1, .3) == Node(.1 + 1e-6, .3 - 1e-6)
+        assert Node(.1, .3).x * 2 ** 10 == 102
+        self.assertRaises(Exception, node.set_resolution, .1)
+    
+    def test_pathfinding(self):
+        board = mapping.Board()
+        board.add(geometry.Polygon((0, 0), (3, 0), (3, 1), (1, 1), (1, 3),
+                                   (0, 3)))
+        right = geometry.Polygon((4, 0), (5, 0), (5, 3), (2, 3), (2, 2), (4, 2))
+        board.add(right)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        # points on an edge are found exactly, with no epsilon
+        assert right.contains_node_in_area(Node(4.5, 0))
+        assert right.contains_node_in_area(Node(5, 1.5 + 1e-5))
 
 class TestTriangulation(unittest.TestCase):
     def test_s_curve_triangulation(self):
         print(s_left_side.triangles)
         print(s_right_side.triangles)
+    
+    def test_comb_triangulation(self):
+        # a comb, with many reflex nodes between its teeth
+        nodes = [(0, 0)]
+        for i in xrange(20):
+            nodes.extend([(2 * i + 1, 0), (2 * i + 1, 5), (2 * i + 2, 5),
+                          (2 * i + 2, 0)])
+        nodes.extend([(41, 0), (41, -1), (0, -1)])
+        p = geometry.Polygon(*nodes)
+        assert len(p.triangles) == len(nodes) - 2
+        assert abs(sum([t.area for t in p.triangles]) - 141) < 1e-9
+    
+    def test_self_intersecting(self):
+        self.assertRaises(Exception, geometry.Polygon,
+                          (0, 0), (2, 2), (2, 0), (0, 2))
+    
+    def test_slanted_comb(self):
+        # long teeth, each of which spans the others' extents
+        nodes = []
+        for i in xrange(40):
+            nodes.extend([(2 * i, 0), (2 * i + 80, 10), (2 * i + 81, 10),
+                          (2 * i + 1, 0)])
+        p = geometry.Polygon(*(nodes + [(79, -1), (0, -1)]))
+        assert len(p.triangles) == len(p.nodes) - 2
+        nodes[-3] = (0, 10) # the last tooth leans back across the others
+        self.assertRaises(Exception, geometry.Polygon,
+                          *(nodes + [(79, -1), (0, -1)]))
+    
+    def test_self_intersecting_matches_pairs(self):
+        generator = random.Random(3)
+        for trial in xrange(200):
+            points = [(generator.random(), generator.random())
+                      for i in xrange(generator.randint(4, 12))]
+            lines = [geometry.Line(points[i - 1], points[i])
+                     for i in xrange(len(points))]
+            crossing = [a for a in lines for b in lines
+                        if a.does_intersect(b, False)]
+            try:
+                geometry.Polygon(*points)
+                raised = False
+            except Exception:
+                raised = True
+            assert raised == bool(crossing)
 
 class TestExpansion(unittest.TestCase):
     def test_r_expansion(self):
@@ -55,6 +186,40 @@ class TestExpansion(unittest.TestCase):
     
     def test_s_expansion(self):
         print("Expanded s: " + str(s_board.get_expanded(.25)))
+    
+    def test_expanded_cache(self):
+        board = mapping.Board()
+        board.add(geometry.Polygon(*[(n.x, n.y) for n in s_left_side.nodes]))
+        expanded = board.get_expanded(.25)
+        assert board.get_expanded(.25) is expanded
+        assert board.get_expanded(.5) is not expanded
+        board.add(geometry.Polygon((5, 5), (6, 5), (6, 6)))
+        assert board.get_expanded(.25) is not expanded
+    
+    def test_expanded_is_shared_safely(self):
+        board = mapping.Board(reduced=True, lazy=True)
+        board.add(geometry.Polygon(*[(n.x, n.y) for n in s_left_side.nodes]))
+        expanded = board.get_expanded(.25)
+        assert expanded.reduced and expanded.lazy and expanded.frozen
+        self.assertRaises(Exception, expanded.add,
+                          geometry.Polygon((5, 5), (6, 5), (6, 6)))
+        self.assertRaises(Exception, expanded.remove,
+                          list(expanded.polygons)[0])
+        assert expanded.get_shortest_path(Node(2, 1.5), Node(-1, -1))
+        board.reduced = False
+        assert not board.get_expanded(.25).reduced
+    
+    def test_merged_expansion(self):
+        # the two sides of the s-curve are 1 apart, so they overlap once each
+        # is grown by .75, and between them they fill their bounding box
+        board = mapping.Board()
+        for p in (s_left_side, s_right_side):
+            board.add(geometry.Polygon(*[(n.x, n.y)
+                                         for n in reversed(p.nodes)]))
+        assert len(board.get_expanded(.75).polygons) == 2
+        merged = board.get_expanded(.75, merge=True)
+        assert [p.bounds for p in merged.polygons] == [(-.75, -.75, 5.75, 3.75)]
+        assert len(list(merged.polygons)[0].nodes) == 4
 
 class TestLineOfSight(unittest.TestCase):
     def test_s_curve_is_visible(self):
@@ -81,6 +246,80 @@ class TestLineOfSight(unittest.TestCase):
     def test_r_board(self):
         assert not r_board.is_visible(r_start, r_end)
 
+class TestBatchPathfinding(unittest.TestCase):
+    def path_length(self, start, path):
+        length = 0.
+        for i in path:
+            length += start.dist(i)
+            start = i
+        return length
+    
+    def test_s_curve_paths(self):
+        targets = [s_end, Node(3, 1), Node(1.5, 2.5), s_start]
+        paths = s_board.get_shortest_paths(s_start, targets)
+        for i in targets:
+            assert paths[i] == s_board.get_shortest_path(s_start, i)
+    
+    def test_s_curve_distance_matrix(self):
+        points = [s_start, s_end, Node(3.5, 2.5), Node(.5, 3.5)]
+        matrix = s_board.get_distance_matrix(points, points)
+        for i in xrange(len(points)):
+            for k in xrange(len(points)):
+                path = s_board.get_shortest_path(points[i], points[k])
+                assert abs(matrix[i][k] -
+                           self.path_length(points[i], path)) < 1e-9
+    
+    def test_board_node_targets(self):
+        # targets that are nodes of the board, seen straight from the source
+        for reduced in (False, True):
+            board = mapping.Board(reduced=reduced)
+            board.add(geometry.Polygon((0, 0), (1, 0), (1, 1), (0, 1)))
+            source, targets = Node(-1, .5), [Node(0, 0), Node(1, 1)]
+            paths = board.get_shortest_paths(source, targets)
+            assert paths[Node(0, 0)] == [Node(0, 0)]
+            assert paths[Node(1, 1)] == board.get_shortest_path(source,
+                                                                Node(1, 1))
+            matrix = board.get_distance_matrix([source], targets)
+            assert matrix[0][0] == source.dist(Node(0, 0))
+            assert abs(matrix[0][1] - self.path_length(
+                source, paths[Node(1, 1)])) < 1e-9
+
+class TestSpatialIndex(unittest.TestCase):
+    def brute_force_visible(self, board, node_a, node_b):
+        if (node_b.x, node_b.y) < (node_a.x, node_a.y):
+            node_a, node_b = node_b, node_a
+        direct_line = geometry.Line(node_a, node_b)
+        for p in board.polygons:
+            for l in p.lines + list(p.triangle_lines):
+                if l.does_intersect(direct_line, False):
+                    return False
+            if direct_line in p.triangle_lines: return False
+        return True
+    
+    def test_s_curve_index_matches_brute_force(self):
+        board = mapping.Board()
+        board.add(s_left_side); board.add(s_right_side)
+        points = list(board.nodes) + [s_start, s_end, Node(1.5, 2),
+                                      Node(3.5, .5), Node(2, .5)]
+        for a in points:
+            for b in points:
+                if a != b:
+                    assert board.is_visible(a, b) == \
+                           self.brute_force_visible(board, a, b)
+    
+    def test_index_rebuilt_on_change(self):
+        board = mapping.Board()
+        board.add(geometry.Polygon((0, 0), (1, 0), (1, 1), (0, 1)))
+        assert board.is_visible(Node(2, 0), Node(2, 1))
+        revision = board.revision
+        wall = geometry.Polygon((1.5, .25), (2.5, .25), (2.5, .75),
+                                (1.5, .75))
+        board.add(wall)
+        assert board.revision > revision
+        assert not board.is_visible(Node(2, 0), Node(2, 1))
+        board.remove(wall)
+        assert board.is_visible(Node(2, 0), Node(2, 1))
+
 class TestPathfinding(unittest.TestCase):
     def test_s_curve_path(self):
         s_path = [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
@@ -88,6 +327,588 @@ class TestPathfinding(unittest.TestCase):
         # try it backwards too
         s_back_path = [Node(3.0, 1.0), Node(2.0, 2.0), s_start]
         assert s_board.get_shortest_path(s_end, s_start) == s_back_path
+    
+    def test_r_path(self):
+        path = r_board.get_shortest_path(r_start, r_end)
+        assert path in ([Node(1.0, 0.0), r_end], [Node(0.0, 1.0), r_end])
+
+class TestReducedGraph(unittest.TestCase):
+    def test_paths_and_reflex_nodes(self):
+        board = mapping.Board(reduced=True)
+        board.add(s_left_side); board.add(s_right_side)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        assert board.get_shortest_path(Node(1, 1), s_end) == \
+               [Node(3.0, 1.0), s_end]
+        reduced = board.reduced_graph
+        assert reduced.edge_count() < board.graph.edge_count()
+        # (1, 1) and (4, 2) are reflex corners, so no path bends there
+        assert not reduced.neighbors(reduced.index[Node(1, 1)])
+        assert not reduced.neighbors(reduced.index[Node(4, 2)])
+
+class TestLazyPathfinding(unittest.TestCase):
+    def test_s_curve(self):
+        stats = profiling.Stats()
+        board = mapping.Board(lazy=True, stats=stats)
+        board.add(s_left_side); board.add(s_right_side)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        assert board.get_shortest_path(s_end, s_start) == \
+               [Node(3.0, 1.0), Node(2.0, 2.0), s_start]
+        assert "precalculate_visibility" not in stats.times
+        tests = stats.counts["lazy_tests"]
+        board.get_shortest_path(s_start, s_end)
+        assert stats.counts["lazy_tests"] == tests
+    
+    def test_changes(self):
+        board = mapping.Board(lazy=True)
+        board.add(s_left_side); board.add(s_right_side)
+        board.get_shortest_path(s_start, s_end)
+        board.add(s_block)
+        assert board.get_shortest_path(s_start, s_end) == s_blocked_path
+        board.remove(s_block)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+
+class TestNavMesh(unittest.TestCase):
+    def test_s_curve(self):
+        board = mapping.Board(mesh=True)
+        board.add(s_left_side); board.add(s_right_side)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        assert board.get_shortest_path(s_end, s_start) == \
+               [Node(3.0, 1.0), Node(2.0, 2.0), s_start]
+        assert board.get_shortest_path(s_start, Node(.5, 2)) is None
+        assert board.get_shortest_path(s_start, Node(-9, -9)) is None
+    
+    def test_free_space(self):
+        mesh = navmesh.NavMesh([s_left_side, s_right_side], (-1, -1, 6, 4))
+        area = sum([geometry.Triangle(*[mesh.points[i] for i in t]).area
+                    for t in mesh.triangles])
+        assert abs(area - (7 * 5 - 5 - 5)) < 1e-9
+        assert mesh.locate(Node(.5, 2)) is None
+        assert mesh.locate(Node(3.5, .5)) is not None
+    
+    def test_changes(self):
+        board = mapping.Board(mesh=True)
+        board.add(s_left_side); board.add(s_right_side)
+        board.get_shortest_path(s_start, s_end)
+        board.add(s_block)
+        assert board.get_shortest_path(s_start, s_end) == s_blocked_path
+        board.remove(s_block)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+
+class TestHierarchy(unittest.TestCase):
+    def test_s_curve(self):
+        stats = profiling.Stats()
+        board = mapping.Board(region_size=2, stats=stats)
+        board.add(s_left_side); board.add(s_right_side)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        assert board.get_shortest_path(s_end, s_start) == \
+               [Node(3.0, 1.0), Node(2.0, 2.0), s_start]
+        assert "precalculate_visibility" not in stats.times
+    
+    def test_changes(self):
+        stats = profiling.Stats()
+        board = mapping.Board(region_size=2, stats=stats)
+        board.add(s_left_side); board.add(s_right_side)
+        board.get_shortest_path(s_start, s_end)
+        board.add(s_block)
+        # only the region that block is in has to be worked out again
+        assert stats.counts["regions_forgotten"] == 1
+        assert board.get_shortest_path(s_start, s_end) == s_blocked_path
+        board.remove(s_block)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+
+class TestLoading(unittest.TestCase):
+    map_file = """# the s curve, in two of the forms a map file can take
+0 0, 3 0, 3 1, 1 1, 1 3, 0 3
+
+POLYGON ((4 0, 5 0, 5 3, 2 3, 2 2, 4 2, 4 0))
+"""
+    
+    def test_read_polygons(self):
+        polygons = list(loading.read_polygons(StringIO.StringIO(self.map_file)))
+        assert [p.nodes for p in polygons] == \
+               [s_left_side.nodes, s_right_side.nodes]
+        self.assertRaises(Exception, list, loading.read_polygons(
+            StringIO.StringIO("POLYGON ((0 0, 1 0, 1 1), (0 0, 1 0, 1 1))")))
+        self.assertRaises(Exception, list, loading.read_polygons(
+            StringIO.StringIO("[[0, 0], [1, 0]]")))
+    
+    def test_from_array(self):
+        polygons = loading.from_array([0, 0, 3, 0, 3, 1, 1, 1, 1, 3, 0, 3,
+                                       4, 0, 5, 0, 5, 3, 2, 3, 2, 2, 4, 2],
+                                      [6, 6])
+        board = mapping.Board()
+        board.add_all(polygons)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+    
+    def test_add_all(self):
+        phases = []
+        board = mapping.Board(stats=profiling.Stats(
+            lambda name, seconds: phases.append(name)))
+        board.add(s_left_side)
+        board.precalculate_visibility()
+        board.add_all([s_left_side, [(4, 0), (5, 0), (5, 3), (2, 3), (2, 2),
+                                     (4, 2)]])
+        assert len(board.polygons) == 2 and board.revision == 2
+        # the graph is built again once, rather than updated
+        assert "update_visibility" not in phases
+        assert phases.count("precalculate_visibility") == 2
+        assert visibility_relation(board) == visibility_relation(s_board)
+
+class TestSnapshot(unittest.TestCase):
+    def test_freeze(self):
+        board = mapping.Board()
+        board.add(s_left_side); board.add(s_right_side)
+        snapshot = board.freeze()
+        assert snapshot.frozen and not board.frozen
+        assert snapshot.get_shortest_path(s_start, s_end) == \
+               board.get_shortest_path(s_start, s_end)
+        self.assertRaises(Exception, snapshot.add, s_block)
+        self.assertRaises(Exception, snapshot.remove, s_left_side)
+    
+    def test_changing_the_board(self):
+        board = mapping.Board()
+        board.add(s_left_side); board.add(s_right_side)
+        snapshot = board.freeze()
+        board.add(s_block)
+        assert snapshot.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        assert board.get_shortest_path(s_start, s_end) == s_blocked_path
+
+class TestQueryServer(unittest.TestCase):
+    def check_server(self, processes):
+        board = mapping.Board()
+        board.add(s_left_side); board.add(s_right_side)
+        server = serving.QueryServer(board, 2, processes)
+        try:
+            paths = server.get_paths([(s_start, s_end), (s_end, s_start)] * 5)
+            assert paths.get() == \
+                   [[Node(2.0, 2.0), Node(3.0, 1.0), s_end],
+                    [Node(3.0, 1.0), Node(2.0, 2.0), s_start]] * 5
+            snapshot = server.add(s_block).get()
+            assert server.snapshot is snapshot and s_block in snapshot.polygons
+            assert server.get_shortest_path(s_start, s_end).get() == \
+                   s_blocked_path
+        finally:
+            server.close()
+    
+    def test_threads(self):
+        self.check_server(False)
+    
+    def test_processes(self):
+        self.check_server(True)
+    
+    def test_changes_while_queued(self):
+        # batches queued against old snapshots still find their files after
+        # several changes in a row
+        board = mapping.Board()
+        board.add(s_left_side); board.add(s_right_side)
+        server = serving.QueryServer(board, 2, True)
+        try:
+            batches = [server.get_paths([(s_start, s_end)] * 40)]
+            for i in xrange(2):
+                server.add(s_block)
+                batches.append(server.get_paths([(s_start, s_end)] * 40))
+                server.remove(s_block).get()
+            for batch in batches:
+                assert len(batch.get()) == 40
+        finally:
+            server.close()
+    
+    def test_callback(self):
+        board = mapping.Board()
+        board.add(s_left_side); board.add(s_right_side)
+        server = serving.QueryServer(board)
+        found = []
+        try:
+            server.get_shortest_path(s_start, s_end, found.append).wait()
+        finally:
+            server.close()
+        assert found == [[Node(2.0, 2.0), Node(3.0, 1.0), s_end]]
+
+class TestPlanner(unittest.TestCase):
+    def test_replanning(self):
+        board = mapping.Board()
+        board.add(s_left_side); board.add(s_right_side)
+        plan = planner.Planner(board, s_end)
+        assert plan.get_path(s_start) == [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        board.add(s_block)
+        assert plan.get_path(s_start) == s_blocked_path
+        assert plan.get_path(Node(3, 1)) == [Node(3.25, .25), s_end]
+        board.remove(s_block)
+        assert plan.get_path(s_start) == \
+               board.get_shortest_path(s_start, s_end)
+        plan.close()
+        assert not board.graph.listeners
+
+class TestAnytime(unittest.TestCase):
+    def test_budget(self):
+        stats = profiling.Stats()
+        board = mapping.Board(stats=stats)
+        board.add(s_left_side); board.add(s_right_side)
+        path, bound = board.get_anytime_path(s_start, s_end, expansions=1)
+        assert path is None and bound == float("inf")
+        assert stats.counts["anytime_setup_steps"] + \
+               stats.counts["anytime_expanded"] == 1
+        while bound > 1:
+            path, bound = board.get_anytime_path(s_start, s_end, expansions=1)
+        assert path == [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+    
+    def test_resuming(self):
+        # a search done in slices expands no more than one done all at once
+        stats = profiling.Stats()
+        search = anytime.Search(mapping.Board(stats=stats), s_start, s_end)
+        search.board.add(s_left_side); search.board.add(s_right_side)
+        search.improve()
+        whole = stats.counts["anytime_expanded"]
+        stats.reset()
+        search = anytime.Search(search.board, s_start, s_end)
+        while not search.done:
+            search.improve(expansions=2)
+        assert stats.counts["anytime_expanded"] == whole
+        assert search.bound == 1.
+    
+    def test_unbuilt_graph(self):
+        # building the graph of a large board takes far longer than the
+        # budget, so it is spread over many calls
+        board = mapping.Board()
+        for i in xrange(15):
+            for k in xrange(15):
+                board.add(geometry.Polygon((2 * i, 2 * k), (2 * i + 1, 2 * k),
+                                           (2 * i + 1, 2 * k + 1),
+                                           (2 * i, 2 * k + 1)))
+        search = anytime.Search(board, Node(-1, -1), Node(30, 30))
+        started = time.time()
+        assert search.improve(seconds=.01) is None
+        assert time.time() - started < .25
+        assert not board.precalculated and search.bound == float("inf")
+    
+    def test_changes(self):
+        board = mapping.Board()
+        board.add(s_left_side); board.add(s_right_side)
+        search = anytime.Search(board, s_start, s_end)
+        search.improve()
+        board.add(s_block)
+        assert search.improve() == s_blocked_path
+
+class TestPathCache(unittest.TestCase):
+    def test_hits_and_invalidation(self):
+        board = mapping.Board(path_cache_size=2)
+        board.add(s_left_side); board.add(s_right_side)
+        path = [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        assert board.get_shortest_path(s_start, s_end) == path
+        assert board.get_shortest_path(s_start, s_end) == path
+        assert board.path_cache_stats == {"hits":1, "misses":1, "size":1}
+        board.add(s_block)
+        assert board.get_shortest_path(s_start, s_end) == s_blocked_path
+        assert board.path_cache_stats["misses"] == 2
+    
+    def test_snapping(self):
+        board = mapping.Board(path_cache_size=8, snap=.25)
+        board.add(s_left_side); board.add(s_right_side)
+        board.get_shortest_path(s_start, s_end)
+        end = Node(3.6, .1)
+        assert board.get_shortest_path(Node(1.55, 3.05), end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), end]
+        assert board.path_cache_stats["hits"] == 1
+    
+    def test_snapping_around_a_corner(self):
+        # every query shares a cell, but (3, 1) can't see past the right side
+        board = mapping.Board(path_cache_size=8, snap=10)
+        board.add(s_left_side); board.add(s_right_side)
+        board.get_shortest_path(s_start, s_end)
+        end = Node(6, 1)
+        assert board.get_shortest_path(s_start, end) == \
+               s_board.get_shortest_path(s_start, end)
+        assert board.path_cache_stats["misses"] == 2
+
+class TestProfiling(unittest.TestCase):
+    def test_counters_and_phases(self):
+        phases = []
+        stats = profiling.Stats(lambda name, seconds: phases.append(name))
+        board = mapping.Board(stats=stats)
+        board.add(s_left_side); board.add(s_right_side)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        assert stats.counts.get("does_intersect", 0) > 0 or \
+               stats.counts.get("vectorized_tests", 0) > 0
+        assert stats.counts["nodes_expanded"] > 0
+        assert stats.counts["nodes_relaxed"] >= stats.counts["nodes_expanded"]
+        assert stats.counts["visibility_cache_misses"] == 1
+        assert "precalculate_visibility" in stats.times
+        assert "search" in phases and "links" in phases
+        assert board.is_visible(Node(2.0, 2.0), Node(3.0, 1.0))
+        assert stats.counts["visibility_cache_hits"] == 1
+    
+    def test_locating_is_counted(self):
+        stats = profiling.Stats()
+        board = mapping.Board(stats=stats)
+        board.add(s_left_side); board.add(s_right_side)
+        assert not board.is_free(Node(2, .5))
+        located = stats.counts.get("contains_node_in_area", 0)
+        assert located > 0
+        assert board.locate_all([Node(2, .5), Node(4.5, 1)]) == \
+               [s_left_side, s_right_side]
+        assert stats.counts["contains_node_in_area"] > located
+    
+    def test_disabled(self):
+        stats = profiling.Stats()
+        board = mapping.Board(stats=stats)
+        board.add(s_left_side); board.add(s_right_side)
+        board.get_shortest_path(s_start, s_end)
+        counts = dict(stats.counts)
+        board.stats = None
+        board.get_shortest_path(s_end, s_start)
+        assert stats.counts == counts
+    
+    def test_boards_count_separately(self):
+        # each board counts only its own tests, even from other threads
+        results = []
+        def work():
+            stats = profiling.Stats()
+            board = mapping.Board(stats=stats)
+            board.add(s_left_side); board.add(s_right_side)
+            board.precalculate_visibility()
+            results.append(stats.counts.get("does_intersect", 0) +
+                           stats.counts.get("vectorized_tests", 0))
+        threads = [threading.Thread(target=work) for i in xrange(6)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        alone = profiling.Stats()
+        board = mapping.Board(stats=alone)
+        board.add(s_left_side); board.add(s_right_side)
+        board.precalculate_visibility()
+        assert results == [alone.counts.get("does_intersect", 0) +
+                           alone.counts.get("vectorized_tests", 0)] * 6
+
+class TestSweepEngine(unittest.TestCase):
+    def test_s_curve_matches_pairwise(self):
+        pairwise = build_board(s_left_side, s_right_side, engine="pairwise")
+        swept = build_board(s_left_side, s_right_side, engine="sweep")
+        assert visibility_relation(pairwise) == visibility_relation(swept)
+    
+    def test_many_active_segments(self):
+        # rows of thin, tilted bars, which the ray crosses many at a time
+        bars = [geometry.Polygon((i, k), (i + .8, k + .1), (i + .8, k + .3),
+                                 (i, k + .2))
+                for i in xrange(6) for k in xrange(6)]
+        assert visibility_relation(build_board(*bars, engine="pairwise")) == \
+               visibility_relation(build_board(*bars, engine="sweep"))
+    
+    def test_s_curve_path(self):
+        board = build_board(s_left_side, s_right_side, engine="sweep")
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        assert board.get_shortest_path(s_end, s_start) == \
+               [Node(3.0, 1.0), Node(2.0, 2.0), s_start]
+    
+    def test_r_board(self):
+        board = build_board(*r_board.polygons, engine="sweep")
+        board.precalculate_visibility()
+        assert not board.is_visible(r_start, r_end)
+    
+    def test_parallel_matches_serial(self):
+        polygons = [s_left_side, s_right_side,
+                    geometry.Polygon((6, 0), (7, 0), (7, 1), (6, 1))]
+        for engine in mapping.Board.engines:
+            serial = build_board(engine=engine, *polygons)
+            parallel = build_board(engine=engine, *polygons)
+            parallel.precalculate_visibility(processes=2)
+            assert visibility_relation(serial) == visibility_relation(parallel)
+
+@unittest.skipUnless(vectorized.available, "NumPy is not installed")
+class TestVectorized(unittest.TestCase):
+    def test_matches_does_intersect(self):
+        lines = list(s_left_side.lines) + list(s_right_side.lines) + \
+                list(s_left_side.triangle_lines) + [
+                geometry.Line((0, 0), (5, 3)), geometry.Line((1, 1), (4, 0)),
+                geometry.Line((3, 1), (3, 3)), geometry.Line((0, 3), (5, 3))]
+        segments = vectorized.SegmentArray(lines)
+        for vertexes_count in (True, False):
+            for query in lines:
+                for i in xrange(len(lines)):
+                    found = segments.find_blockers((query.node_a,),
+                                                   (query.node_b,),
+                                                   vertexes_count, [i])[0]
+                    assert (found == i) == \
+                           lines[i].does_intersect(query, vertexes_count)
+    
+    def test_among_matches_stub(self):
+        lines = list(s_left_side.lines) + list(s_right_side.lines) + \
+                list(s_left_side.triangle_lines)
+        starts = [l.node_a for l in lines]
+        ends = [Node(5 - l.node_b.x, l.node_b.y) for l in lines]
+        candidates = [range(i % 3, len(lines), 1 + i % 4)
+                      for i in xrange(len(lines))]
+        stub = PureSegmentArray(lines)
+        for vertexes_count in (True, False):
+            found = vectorized.SegmentArray(lines).find_blockers_among(
+                starts, ends, candidates, vertexes_count)
+            assert list(found) == stub.find_blockers_among(
+                starts, ends, candidates, vertexes_count)
+    
+    def test_s_curve_matches_scalar(self):
+        relations = []
+        for available in (True, False):
+            vectorized.available = available
+            try:
+                relations.append(visibility_relation(
+                    build_board(s_left_side, s_right_side)))
+            finally:
+                vectorized.available = True
+        assert relations[0] == relations[1]
+
+class PureSegmentArray(object):
+    """A stand-in for ``vectorized.SegmentArray`` that keeps to its contract
+    with ``Line.does_intersect``, so that the board's NumPy path can be tested
+    without NumPy."""
+    
+    def __init__(self, lines):
+        self.lines = list(lines)
+    
+    def __len__(self):
+        return len(self.lines)
+    
+    def find_blockers(self, starts, ends, vertexes_count=True, subset=None):
+        if subset is None:
+            subset = xrange(len(self.lines))
+        return self.find_blockers_among(starts, ends, [subset] * len(starts),
+                                        vertexes_count)
+    
+    def find_blockers_among(self, starts, ends, candidates,
+                            vertexes_count=True):
+        result = []
+        for a, b, keys in zip(starts, ends, candidates):
+            query = geometry.Line(a, b)
+            hits = [k for k in keys
+                    if self.lines[k].does_intersect(query, vertexes_count)]
+            result.append(hits[0] if hits else -1)
+        return result
+
+class TestVectorizedBoard(unittest.TestCase):
+    def setUp(self):
+        self.saved = vectorized.available, vectorized.SegmentArray
+    
+    def tearDown(self):
+        vectorized.available, vectorized.SegmentArray = self.saved
+    
+    def build(self, batched, *polygons):
+        vectorized.available = batched
+        vectorized.SegmentArray = PureSegmentArray
+        board = build_board(*polygons)
+        board.precalculate_visibility()
+        return board
+    
+    def test_matches_scalar(self):
+        polygons = [s_left_side, s_right_side, s_block]
+        scalar = self.build(False, *polygons)
+        batched = self.build(True, *polygons)
+        assert visibility_relation(batched) == visibility_relation(scalar)
+        # on one board, both ways find the same blocker for each node
+        pov, nodes = Node(3.5, 2.5), list(batched.nodes)
+        found = batched.get_blockers(pov, nodes)
+        vectorized.available = False
+        assert found == batched.get_blockers(pov, nodes)
+        assert None in found and len(set(found)) > 2
+    
+    def test_diagonals_after_remove(self):
+        board = self.build(True, s_left_side, s_right_side, s_block)
+        block = [p for p in board.polygons
+                 if p.nodes[0] == s_block.nodes[0]][0]
+        board.remove(block)
+        board.add(geometry.Polygon((3.25, .25), (3.75, .25), (3.75, 1.5)))
+        assert visibility_relation(board) == visibility_relation(
+            self.build(False, s_left_side, s_right_side,
+                       geometry.Polygon((3.25, .25), (3.75, .25),
+                                        (3.75, 1.5))))
+
+class TestIncrementalVisibility(unittest.TestCase):
+    def test_add_and_remove(self):
+        board = build_board(s_left_side, s_right_side)
+        board.precalculate_visibility()
+        board.add(s_block)
+        assert not board.is_visible(Node(3, 1), Node(4, 0))
+        assert visibility_relation(board) == visibility_relation(
+            build_board(s_left_side, s_right_side, s_block))
+        board.remove(s_block)
+        assert board.is_visible(Node(3, 1), Node(4, 0))
+        assert visibility_relation(board) == visibility_relation(
+            build_board(s_left_side, s_right_side))
+    
+    def test_path_after_add(self):
+        board = build_board(s_left_side, s_right_side)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+        board.add(s_block)
+        assert board.get_shortest_path(s_start, s_end) == s_blocked_path
+
+class TestVisibilityGraph(unittest.TestCase):
+    def test_edits(self):
+        g = graph.VisibilityGraph([Node(0, 0), Node(1, 0), Node(0, 1)])
+        g.set_edges([0, 0], [1, 2])
+        g.add_edge(1, 2)
+        g.remove_edge(0, 1)
+        assert sorted(g.neighbors(0)) == [2]
+        assert sorted(g.neighbors(2)) == [0, 1]
+        assert g.has_edge(2, 1) and not g.has_edge(1, 0)
+        g.compact()
+        assert g.edge_count() == 2 and g.has_edge(1, 2)
+        g.remove_node(2)
+        assert g.edge_count() == 0
+        assert g.add_node(Node(2, 2)) == 2
+    
+    def test_s_curve_graph(self):
+        board = mapping.Board()
+        board.add(s_left_side); board.add(s_right_side)
+        g = board.graph
+        assert len(g) == len(board.nodes)
+        assert g.has_edge(g.index[Node(2, 2)], g.index[Node(3, 1)])
+        assert not g.has_edge(g.index[Node(1, 3)], g.index[Node(3, 0)])
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        os.remove(self.path)
+    
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def test_save_and_load(self):
+        s_board.save(self.path)
+        board = mapping.Board.load(self.path)
+        assert visibility_relation(board) == visibility_relation(s_board)
+        assert board.get_shortest_path(s_start, s_end) == \
+               [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+    
+    def test_stale_file_is_rebuilt(self):
+        left = [(n.x, n.y) for n in s_left_side.nodes]
+        right = [(n.x, n.y) for n in s_right_side.nodes]
+        board = mapping.Board.load(self.path, [left])
+        assert len(board.polygons) == 1 and os.path.exists(self.path)
+        board = mapping.Board.load(self.path, [right, left])
+        assert len(board.polygons) == 2
+        assert mapping.Board.load(self.path).get_shortest_path(
+                   s_start, s_end) == [Node(2.0, 2.0), Node(3.0, 1.0), s_end]
+    
+    def test_given_polygons_are_kept(self):
+        # the caller's polygons are on the board, whether the file is used or
+        # rebuilt
+        for i in xrange(2):
+            board = mapping.Board.load(self.path, [s_left_side, s_right_side])
+            assert s_left_side in board.polygons
+            assert s_right_side in board.polygons
+            board.remove(s_right_side)
+            assert board.get_shortest_path(s_start, s_end) == \
+                   [Node(3.0, 1.0), s_end]
 
 if __name__ == "__main__":
     unittest.main()
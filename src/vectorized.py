@@ -0,0 +1,129 @@
+"""Segment intersection tests done in bulk with NumPy. The segments are stored
+as contiguous arrays of coordinates, and a whole batch of query segments can be
+tested against all of them with array-wide orientation tests, rather than one
+``Line.does_intersect`` call at a time. The arithmetic is done in the same
+order as ``Line.does_intersect`` does it, so the results are exactly the same,
+right down to the handling of parallel lines and shared vertexes.
+
+NumPy is optional. If it can't be imported, ``available`` is False and the
+rest of the package carries on with ``Line.does_intersect``."""
+
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+available = numpy is not None
+
+# the most segment/query pairs tested at once, to bound memory use
+CHUNK_SIZE = 1 << 18
+
+class SegmentArray(object):
+    """A group of line segments, stored as arrays of their endpoints'
+    coordinates. Like the polygons it is built from, this should be assumed to
+    be immutable."""
+
+    def __init__(self, lines):
+        """Builds the arrays from ``lines``, an iterable of ``Line``
+        objects."""
+        super(SegmentArray, self).__init__()
+        self.lines = list(lines)
+        coordinates = numpy.array([(l.node_a.x, l.node_a.y,
+                                    l.node_b.x, l.node_b.y)
+                                   for l in self.lines],
+                                  dtype=float).reshape(-1, 4)
+        self.ax, self.ay, self.bx, self.by = [numpy.ascontiguousarray(i)
+                                              for i in coordinates.T]
+
+    def __len__(self):
+        return len(self.lines)
+
+    def find_blockers(self, starts, ends, vertexes_count=True, subset=None):
+        """Tests each query segment, running from ``starts[i]`` to ``ends[i]``,
+        against the segments in this array. ``starts`` and ``ends`` are
+        sequences of nodes of the same length. If given, ``subset`` is a
+        sequence of the indexes of the segments to test against, otherwise all
+        of them are used. Returns an array holding, for each query, the index of
+        the first segment it intersects in the sense of
+        ``segment.does_intersect(query, vertexes_count)``, or -1 if there is
+        none."""
+        cx = numpy.array([i.x for i in starts], dtype=float)
+        cy = numpy.array([i.y for i in starts], dtype=float)
+        dx = numpy.array([i.x for i in ends], dtype=float)
+        dy = numpy.array([i.y for i in ends], dtype=float)
+        return self.find_blockers_xy(cx, cy, dx, dy, vertexes_count, subset)
+
+    def find_blockers_xy(self, cx, cy, dx, dy, vertexes_count=True,
+                         subset=None):
+        """The same as ``find_blockers``, but with the query segments already
+        given as arrays of their coordinates."""
+        if subset is None:
+            subset = numpy.arange(len(self.lines))
+        else:
+            subset = numpy.asarray(subset, dtype=int)
+        result = numpy.empty(len(cx), dtype=int)
+        result.fill(-1)
+        if not len(subset) or not len(cx):
+            return result
+        ax, ay = self.ax[subset], self.ay[subset]
+        bx, by = self.bx[subset], self.by[subset]
+        step = max(1, CHUNK_SIZE // len(subset))
+        for start in xrange(0, len(cx), step):
+            s = slice(start, start + step)
+            hits = _intersect(ax, ay, bx, by,
+                              cx[s, None], cy[s, None], dx[s, None],
+                              dy[s, None], vertexes_count)
+            first = hits.argmax(axis=1)
+            result[s] = numpy.where(hits.any(axis=1), subset[first], -1)
+        return result
+
+    def find_blockers_among(self, starts, ends, candidates,
+                            vertexes_count=True):
+        """Like ``find_blockers``, but tests each query segment only against
+        its own segments, ``candidates[i]``, a sequence of indexes into this
+        array, such as the segments a spatial index reports near it. All of
+        the pairs are still tested at once. Returns an array holding, for each
+        query, the first of its candidates that it intersects, or -1 if there
+        is none."""
+        counts = [len(i) for i in candidates]
+        result = numpy.empty(len(starts), dtype=int)
+        result.fill(-1)
+        total = sum(counts)
+        if not total:
+            return result
+        cx = numpy.array([i.x for i in starts], dtype=float)
+        cy = numpy.array([i.y for i in starts], dtype=float)
+        dx = numpy.array([i.x for i in ends], dtype=float)
+        dy = numpy.array([i.y for i in ends], dtype=float)
+        queries = numpy.repeat(numpy.arange(len(starts)), counts)
+        subset = numpy.fromiter(itertools.chain.from_iterable(candidates),
+                                dtype=int, count=total)
+        for start in xrange(0, total, CHUNK_SIZE):
+            q = queries[start:start + CHUNK_SIZE]
+            k = subset[start:start + CHUNK_SIZE]
+            hits = numpy.flatnonzero(_intersect(
+                self.ax[k], self.ay[k], self.bx[k], self.by[k],
+                cx[q], cy[q], dx[q], dy[q], vertexes_count))
+            # keep the first hit of each query that has none yet
+            hits = hits[result[q[hits]] < 0]
+            first, at = numpy.unique(q[hits], return_index=True)
+            result[first] = k[hits[at]]
+        return result
+
+def _intersect(ax, ay, bx, by, cx, cy, dx, dy, vertexes_count):
+    """The array-wide version of ``Line.does_intersect``, where the segments
+    run from ``a`` to ``b``, and the query segments from ``c`` to ``d``."""
+    # the algorithm doesn't handle parallel lines, so let's check that first
+    hits = (bx - ax) * (dy - cy) != (by - ay) * (dx - cx)
+    hits &= ((dy - ay) * (cx - ax) > (cy - ay) * (dx - ax)) != \
+            ((dy - by) * (cx - bx) > (cy - by) * (dx - bx))
+    hits &= ((cy - ay) * (bx - ax) > (by - ay) * (cx - ax)) != \
+            ((dy - ay) * (bx - ax) > (by - ay) * (dx - ax))
+    if not vertexes_count:
+        hits &= (ax != cx) | (ay != cy)
+        hits &= (ax != dx) | (ay != dy)
+        hits &= (bx != cx) | (by != cy)
+        hits &= (bx != dx) | (by != dy)
+    return hits